@@ -7,21 +7,34 @@
 # Created:     5/14/2013
 # Copyright:   (c) Mechanical Solutions Inc.
 #-------------------------------------------------------------------------------
+import glob
+import hashlib
+import json
 import logging
+import numpy
 import os
 import subprocess
 import sys
 import time
 import string
 
+import ansyscache
+import ansyscdb
+import ansysevents
 import ansysinfo
+import ansysresults
 
-from PyQt4.QtCore import *
-from PyQt4.QtGui import *
 import ConfigParser
-from PyQt4 import QtCore, QtGui
-from ui_ANSYS_Wrapper_Generator_3 import *
-import openmdao.gui.filemanager
+try:
+    from PyQt4.QtCore import *
+    from PyQt4.QtGui import *
+    from PyQt4 import QtCore, QtGui
+    from ui_ANSYS_Wrapper_Generator_3 import *
+    import openmdao.gui.filemanager
+except ImportError: #only the dialog, MainDlg, needs them; WrapperGenerator works without
+    QDialog = Ui_Dialog = object
+    def pyqtSignature(*args):
+        return lambda f: f
 
 indent1 = '    '
 indent2 = indent1 + indent1
@@ -30,6 +43,7 @@ indent4 = indent3 + indent1
 indent5 = indent4 + indent1
 indent6 = indent5 + indent1
 triplequote = '"""'
+GENERATOR_VERSION = 1 #change when the files generated change, so that earlier ones are not reused
 CR = "'\\n'"
 
 
@@ -109,7 +123,8 @@ class WrapperGenerator:
                Name used to identify the Wrapped Component.
                
             genfilename: string
-                Full path to filename of the generate Wrapped Component.
+                Full path to filename of the generate Wrapped Component.  The node numbers of its components are
+                saved next to it, in <genfilename without extension>_components.npz, which the wrapper loads.
                 
             dbfile: string (optional)
                 Full path to name of ANSYS Structural .db file.  Default ''.  One of dbfile and componentsfile MUST be set.
@@ -129,6 +144,23 @@ class WrapperGenerator:
                 
             initial_values_dictionary: dictionary of string to float (optional)
                 Values in the original Structural model of the items in ansysinfo globalinputtypes
+
+            outputs: list of strings (optional)
+                Names of the outputs the wrapper uses, such as tip_UR_o_max.  Only the outputs of those output types
+                and components are declared, and ANSYS extracts only those (see ANSYSRunner.add_instance).
+                Default None, which is every output of every component.
+
+            quiet: boolean (optional)
+                Set to True to print nothing to stdout; messages still go to the logger.  Default False.
+
+            cdbfile: string (optional)
+                Full path to name of ANSYS .cdb file of the model.  Default ''.  If set and there is no componentsfile,
+                the components are read from it (see ansyscdb) instead of running ANSYS on dbfile.  Node and element
+                components become node components; the .cdb has no areas, so there are no surfaces.
+
+            facets: boolean (optional)
+                Set to False to have ANSYS list only the nodes of the components, not the element faces of area
+                components, when it writes the components file.  The wrapper then has no surfaces.  Default True.
        """
     ok = True
     components = {} #empty dictionary of dictionaries of node numbers
@@ -137,48 +169,69 @@ class WrapperGenerator:
     post = []
 
     def __init__(self, name, genfilename, dbfile = '', componentsfile = '', ANSYS_VER = 'ANSYS145', model_file_ext = 'py', 
-                 logger_name = None, initial_values_dictionary = {'omega_Z':0.0, 'temp_ref':0.0, 'temp_unif':0.0}):
+                 logger_name = None, initial_values_dictionary = {'omega_Z':0.0, 'temp_ref':0.0, 'temp_unif':0.0},
+                 outputs = None, quiet = False, cdbfile = '', facets = True):
         if logger_name == None:
             self.logger = logging.getLogger("MSI")
         else:
             self.logger = logging.getLogger(logger_name)
-        if dbfile == '' and componentsfile == '':
-            s = 'AnsysWrapperGenerator for ' + name + ': at least one of dbfile or componentsfile is required'
-            print 'ERROR: ' + s
-            self.logger.error(s)
+        self.events = ansysevents.EventLog(self.logger, quiet)
+        self.components = {} #of this generator, not shared through the class attribute
+        self.name = name
+        if dbfile == '' and componentsfile == '' and cdbfile == '':
+            s = 'AnsysWrapperGenerator for ' + name + ': at least one of dbfile, componentsfile or cdbfile is required'
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             self.ok = False
             return
         self.genfilename = genfilename
+        self.tablesfilename = os.path.splitext(genfilename)[0] + '_components.npz' #arrays of the components
+        self.path = os.path.split(genfilename)[0] #directory of other relative file names
         
         self.dbfile = dbfile
+        self.cdbfile = cdbfile
+        self.facets = facets
         self.componentsfile = componentsfile
-        self.name = name
         self.classname = name + 'Wrapper'    
         self.ANSYS_VER = ANSYS_VER
         self.model_file_ext = model_file_ext
         self.initial_values_dictionary = initial_values_dictionary
+        self.outputs = outputs
+        self.subscribed = None #(component name, output type) of outputs, None for all
+        if outputs != None:
+            self.subscribed = set()
+            for n in outputs:
+                split = ansysinfo.split_output_name(n)
+                if split == None:
+                    s = 'AnsysWrapperGenerator for ' + name + ': ' + n + ' is not an output name - IGNORED'
+                    self.events.warning('generator_error', 'WARNING: %s', s, generator = self.name)
+                else:
+                    self.subscribed.add((split[0].upper(), split[1]))
         self.input_names = set([])
         self.output_names = set([])
         
     def get_model_file_name(self):
         return self.componentsfilebase + '.' + self.model_file_ext
 
+    def _path(self, fname):
+        """Return fname, if relative, joined to the directory of genfilename: relative names are relative to it."""
+        if not fname or os.path.isabs(fname):
+            return fname
+        return os.path.join(self.path, fname)
+
     def _gen_componentsfile(self, path):
         cfile = ''
         try:
             ansysdir =  os.environ[self.ANSYS_VER + '_DIR']
         except KeyError as ke:
-            s =  'Cannot find ' + self.ANSYS_VER + '_DIR in environment\n\t' + sys.exc_info()[0] + '\n\t' + str(ke)
-            print 'ERROR: ' + s
-            self.logger.error(s)            
+            s =  'Cannot find ' + self.ANSYS_VER + '_DIR in environment\n\t' + str(sys.exc_info()[0]) + '\n\t' + str(ke)
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             self.ok = False
             return cfile
         try:
             ansysdir2 = os.environ['ANSYS_SYSDIR']
         except KeyError as ke:
-            s =  'Cannot find ANSYS_SYSDIR in environment\n\t' + sys.exc_info()[0] + '\n\t' + str(ke)
-            print 'ERROR: ' + s
-            self.logger.error(s)           
+            s =  'Cannot find ANSYS_SYSDIR in environment\n\t' + str(sys.exc_info()[0]) + '\n\t' + str(ke)
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             self.ok = False
             return cfile
 
@@ -190,7 +243,7 @@ class WrapperGenerator:
         inputfile = tempstr + '_gen_comps.dat'
         self.componentsfilebase = 'c_' + tempstr
         try:
-            f = open(inputfile, 'w')
+            f = open(os.path.join(path, inputfile), 'w')
             outfile = tempstr + '_ListComps.out'
             #import pdb; pdb.set_trace()
             f.write('/batch\n')
@@ -260,50 +313,44 @@ class WrapperGenerator:
             f.write('			}\n')
             f.write('\n')
             f.write('\n')
-            f.write('\n')
-            f.write('! another DO loop for the facets\n')
             f.write('*vwrite\n')
             f.write('		self.facetMap = {\n')
-            f.write('*do,i,1,nComps,1\n')
-            f.write('    *get,compName,comp,i,name		! get the name of the nth component\n')
-            f.write('    *get,nType,comp,compName,type	! get the type #\n')
-            f.write('					! 1=Nodes, 2=Elements, 6=Keypoints, 7=Lines, 8=Areas, 9=Volumes\n')
-            f.write('\n')
-            f.write('    *if,nType,eq,8,then\n')
-            f.write('\n')
-            f.write('     allsel\n')
-            f.write('     cmsel,,compName\n')
-            f.write('     nsla,s,1\n')
-            f.write('\n')
-            f.write('     nsla,S,0   ! select all nodes internal to the area(s)\n')
-            f.write('     esln,S,0   ! select all elements connected to the nodes\n')
-            f.write('     nsla,S,1   ! select all nodes internal to the area and\n')
-            f.write('\n')
-            f.write('     *get,eCount,ELEM,,count    ! number of selected elements\n')
-            f.write('     current_element_number=0\n')
-            f.write('*vwrite, compName\n')
-            f.write('			"%s" :\n')
-            f.write('*vwrite\n')
-            f.write('			[\n')
-            f.write('\n')
-            f.write('     *do,AR13,1,eCount          ! loop on all selected nodes\n')
-            f.write('         current_element_number=ELNEXT(current_element_number)       ! element number in the list\n')
-            f.write('         face_number=NMFACE(current_element_number)       ! face number\n')
-            f.write('         *if, face_number, gt, 0, then\n')
-            f.write('             *dim,fn,array,8\n')
-            f.write('             *do,j,1,8\n')
-            f.write('                 fn(j) = ndface(current_element_number, face_number, j) !node numbers for this face\n')
-            f.write('             *enddo\n')
-            f.write('             *vwrite, current_element_number, face_number, fn(1), fn(2), fn(3), fn(4), fn(5), fn(6), fn(7), fn(8)\n')
-            f.write('			[%6d, %6d, %6d, %6d, %6d, %6d, %6d, %6d, %6d, %6d,],\n')
-            f.write('\n')
-            f.write('                *del,fn,,NOPR\n')
-            f.write('            *endif\n')
-            f.write('        *enddo\n')
-            f.write('        *vwrite\n')
-            f.write('			],\n')
-            f.write('     *endif\n')
-            f.write('*enddo\n')
+            if self.facets:
+                f.write('! another DO loop for the facets\n')
+                f.write('*do,i,1,nComps,1\n')
+                f.write('    *get,compName,comp,i,name		! get the name of the nth component\n')
+                f.write('    *get,nType,comp,compName,type	! get the type #\n')
+                f.write('					! 1=Nodes, 2=Elements, 6=Keypoints, 7=Lines, 8=Areas, 9=Volumes\n')
+                f.write('\n')
+                f.write('    *if,nType,eq,8,then\n')
+                f.write('\n')
+                f.write('     allsel\n')
+                f.write('     cmsel,,compName\n')
+                f.write('     nsla,s,1\n')
+                f.write('\n')
+                f.write('     nsla,S,0   ! select all nodes internal to the area(s)\n')
+                f.write('     esln,S,0   ! select all elements connected to the nodes\n')
+                f.write('     nsla,S,1   ! select all nodes internal to the area and\n')
+                f.write('\n')
+                f.write('     *get,eCount,ELEM,,count    ! number of selected elements\n')
+                f.write('*vwrite, compName\n')
+                f.write('			"%s" :\n')
+                f.write('*vwrite\n')
+                f.write('			[\n')
+                f.write('     *if,eCount,gt,0,then\n')
+                f.write('         *dim,eArray,array,eCount,2\n')
+                f.write('         *vget,eArray(1,1),elem,1,elist    ! numbers of all selected elements at once\n')
+                f.write('         *do,k,1,eCount\n')
+                f.write('             eArray(k,2) = NMFACE(eArray(k,1))    ! face with all nodes selected, 0 if none\n')
+                f.write('         *enddo\n')
+                f.write('         *vwrite, eArray(1,1), eArray(1,2)    ! all rows at once; rows of face 0 are skipped when read\n')
+                f.write('			[%8d, %8d,],\n')
+                f.write('         *del,eArray,,nopr\n')
+                f.write('     *endif\n')
+                f.write('*vwrite\n')
+                f.write('			],\n')
+                f.write('    *endif\n')
+                f.write('*enddo\n')
             f.write('*vwrite		!finished with the element faces\n')
             f.write('			}\n')
             f.write('*CFCLOSE\n')
@@ -313,19 +360,18 @@ class WrapperGenerator:
             cmd = '"' + ansys_exe + '" -b -i ' + inputfile + \
                 ' -o ' + outfile + ' -j ' + 'Job_' + tempstr 
 
-            ret = subprocess.call(cmd)
+            ret = subprocess.call(cmd, cwd = path)
 
             if ret == 8: # success return
-                cfile = self.get_model_file_name()
+                cfile = os.path.join(path, self.get_model_file_name())
                 #check for errors in ansys error file
-                errfile = 'Job_' + tempstr + '.err'
+                errfile = os.path.join(path, 'Job_' + tempstr + '.err')
                 try:
                     f = open(errfile, 'r')
                 except IOError as ioe:
                     s =  'AnsysWrapperGenerator for ' + self.name + ': opening error file ' + errfile
-                    s += '\n\tPLEASE CHECK GENERATED WRAPPER ' + cfile + '\n\t' + sys.exc_info()[0] + '\n\t' + str(ioe)
-                    print 'ERROR: ' + s
-                    self.logger.error(s)          
+                    s += '\n\tPLEASE CHECK GENERATED WRAPPER ' + cfile + '\n\t' + str(sys.exc_info()[0]) + '\n\t' + str(ioe)
+                    self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
                     return cfile
                 lines = f.readlines()
                 f.close()
@@ -333,71 +379,126 @@ class WrapperGenerator:
                     if l.count('ERROR'):
                         s =  'AnsysWrapperGenerator for ' + self.name + ': found "ERROR" in ' + errfile
                         s += '\n\tPLEASE CHECK GENERATED WRAPPER ' + cfile
-                        print 'ERROR: ' + s
-                        self.logger.error(s)          
+                        self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
                         break
+                else: #no errors: the script, output and job files are not needed
+                    for fname in ([os.path.join(path, inputfile), os.path.join(path, outfile)] +
+                                  glob.glob(os.path.join(path, 'Job_' + tempstr + '.*'))):
+                        try:
+                            os.remove(fname)
+                        except OSError:
+                            pass
 
             else:
                 s =  'AnsysWrapperGenerator for ' + self.name + ': ANSYS returned ' + str(ret) + ' for command ' + cmd
-                print 'ERROR: ' + s
-                self.logger.error(s)          
+                self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             return cfile
         except IOError as ioe:
             s =  'AnsysWrapperGenerator for ' + self.name + ': trying to create file ' + inputfile + ' in directory ' + path
-            s += '\n\t' + sys.exc_info()[0] + '\n\t' + str(ioe)
-            print 'ERROR: ' + s
-            self.logger.error(s)          
+            s += '\n\t' + str(sys.exc_info()[0]) + '\n\t' + str(ioe)
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             self.ok = False
             return cfile
 
     def _parse_componentsfile(self, componentsfile):
-
+        """Set self.components and self.unitsinfo from componentsfile, read line by line into arrays
+           (see ansysresults.read_components_file).  Returns True if it was read."""
         try:
-            f = open(componentsfile, 'r')
-        except IOError as ioe:
-            s =  'AnsysWrapperGenerator for ' + self.name + ': opening componentsfile file ' + componentsfile
-            s += '\n\t' + sys.exc_info()[0] + '\n\t' + str(ioe)
-            print 'ERROR: ' + s
-            self.logger.error(s)        
+            feaModel = ansysresults.read_components_file(componentsfile)
+        except (IOError, ValueError) as e:
+            s =  'AnsysWrapperGenerator for ' + self.name + ': reading componentsfile file ' + componentsfile
+            s += '\n\t' + str(e)
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             return False
-        exec(f)
-        f.close()
-
-        feaModel = FeaModelInPythonFormat()
-
-
-        self.components['nodes'] = {} # empty dictionary
-        for nodeName in feaModel.nodeMap:
-            self.components['nodes'][nodeName] = [] # empty list
-            for n in feaModel.nodeMap[nodeName]:
-                self.components['nodes'][nodeName].append( n[0] ) 
-
-        self.components['surfaces'] = {} # empty dictionary
-        for surfaceName in feaModel.facetMap:
-            self.components['surfaces'][surfaceName] = [] # empty list
-            for n in feaModel.facetMap[surfaceName]:
-                self.components['surfaces'][surfaceName].append( [n[0], n[1]] ) 
 
+        self.components['nodes'] = feaModel.nodes
+        self.components['surfaces'] = feaModel.facets
 
-        self.unitsinfo = ansysinfo.unitsinfodict['0']
+        self.unitskey = '0'
         if str(feaModel.units) in ansysinfo.unitsinfodict:
-            self.unitsinfo = ansysinfo.unitsinfodict[ str(feaModel.units) ]                   
+            self.unitskey = str(feaModel.units)
         else:
             s = 'AnsysWrapperGenerator for ' + self.name + ': unknown units value ' + str(feaModel.units) + ' in components file ' + componentsfile
-            print 'WARNING: ' + s
-            self.logger.warning(s)        
-        s = 'Units info: ' + self.unitsinfo.dump()
-        print s
-        self.logger.info(s)
+            self.events.warning('generator_error', 'WARNING: %s', s, generator = self.name)
+        self.unitsinfo = ansysinfo.unitsinfodict[self.unitskey]
+        self.events.info('generator', 'Units info: %s', ansysevents.lazy(self.unitsinfo.dump), generator = self.name)
         return True
 
+    def _manifestfilename(self):
+        """Full path of the file recording what the files last generated were generated from."""
+        return os.path.splitext(self.genfilename)[0] + '_generated.json'
+
+    def _read_manifest(self):
+        """Return the dictionary saved by _write_manifest, empty if there is none."""
+        try:
+            f = open(self._manifestfilename(), 'r')
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        try:
+            f = open(self._manifestfilename(), 'w')
+            try:
+                json.dump(manifest, f, indent = 1, sort_keys = True)
+            finally:
+                f.close()
+        except IOError as ioe:
+            s = 'AnsysWrapperGenerator for ' + self.name + ': cannot write ' + self._manifestfilename() + '\n\t' + str(ioe)
+            self.events.warning('generator_error', 'WARNING: %s', s, generator = self.name)
+
+    def _components_key(self, source):
+        """Return a digest of what the components depend on: the content of source (the db, cdb or components file),
+           ANSYS_VER, the options of the components file and GENERATOR_VERSION."""
+        h = hashlib.sha1(repr((GENERATOR_VERSION, self.ANSYS_VER, self.model_file_ext, self.facets)))
+        h.update(ansyscache.file_digest(source) + '\0')
+        return h.hexdigest()
+
+    def _wrapper_key(self, components_key, codepath):
+        """Return a digest of what the wrapper depends on: the components, the prep7, solution and post files
+           and the options of the wrapper."""
+        h = hashlib.sha1(components_key)
+        h.update(repr((self.name, codepath, self.outputs, sorted(self.initial_values_dictionary.items()))))
+        dbname = os.path.splitext(self.dbfile or self.cdbfile)[0]
+        for ext in ('.prep7.txt', '.solution.txt', '.post.txt'):
+            h.update(ansyscache.file_digest(self._path(dbname + ext)) + '\0')
+        return h.hexdigest()
+
+    def _read_cdbfile(self, cdbfile):
+        """Set self.components and self.unitsinfo from the .cdb file cdbfile.  Returns True if it was read."""
+        try:
+            model = ansyscdb.read_cdb(cdbfile)
+        except (IOError, ValueError) as e:
+            s = 'AnsysWrapperGenerator for ' + self.name + ': reading cdbfile ' + cdbfile + '\n\t' + str(e)
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
+            return False
+        self.components['nodes'] = {}
+        for name in model.components:
+            self.components['nodes'][name] = model.component_nodes(name)
+        self.components['surfaces'] = {}
+
+        self.unitskey = '0'
+        if model.units != None:
+            indices = dict((k.upper(), v) for k, v in ansysinfo.unitsindices.iteritems())
+            if model.units.upper() in indices:
+                self.unitskey = indices[model.units.upper()]
+            else:
+                s = 'AnsysWrapperGenerator for ' + self.name + ': unknown units ' + model.units + ' in cdbfile ' + cdbfile
+                self.events.warning('generator_error', 'WARNING: %s', s, generator = self.name)
+        self.unitsinfo = ansysinfo.unitsinfodict[self.unitskey]
+        self.events.info('generator', 'Units info: %s', ansysevents.lazy(self.unitsinfo.dump), generator = self.name)
+        return len(self.components['nodes']) > 0
+
     def _parse_prep7File(self):
         """ Read the extra /PREP7 command file, if it exists. This will have extra 
         commands that wind up in the PREP7 portion of the wrapped ANSYS input file.
         The commands come from model_db_name.prep7.txt from the same directory as the db file."""
 
-        dbname, dbext = os.path.splitext(self.dbfile)
-        apdlFile = dbname + '.prep7.txt'
+        dbname, dbext = os.path.splitext(self.dbfile or self.cdbfile)
+        apdlFile = self._path(dbname + '.prep7.txt')
         if os.path.exists( apdlFile ):
             f = open(apdlFile, 'r')
             self.prep7 = f.readlines()
@@ -408,8 +509,8 @@ class WrapperGenerator:
         commands that wind up in the SOL portion of the wrapped ANSYS input file.
         The commands come from model_db_name.solution.txt from the same directory as the db file"""
 
-        dbname, dbext = os.path.splitext(self.dbfile)
-        apdlFile = dbname + '.solution.txt'
+        dbname, dbext = os.path.splitext(self.dbfile or self.cdbfile)
+        apdlFile = self._path(dbname + '.solution.txt')
         if os.path.exists( apdlFile ):
             f = open(apdlFile, 'r')
             self.solution = f.readlines()
@@ -420,8 +521,8 @@ class WrapperGenerator:
         commands that wind up in the POST portion of the wrapped ANSYS input file.
         The commands come from model_db_name.post.txt from the same directory as the db file"""
 
-        dbname, dbext = os.path.splitext(self.dbfile)
-        apdlFile = dbname + '.post.txt'
+        dbname, dbext = os.path.splitext(self.dbfile or self.cdbfile)
+        apdlFile = self._path(dbname + '.post.txt')
         if os.path.exists( apdlFile ):
             f = open(apdlFile, 'r')
             self.post = f.readlines()
@@ -446,7 +547,8 @@ class WrapperGenerator:
         self._writeline('import sys')
         self._writeline('sys.path.insert(0, \'' + codepath.replace('\\', '/') +
                         '\')\n')
-        self._writeline('from ansyswrapper.ansyswrapper import ANSYSWrapperBase')
+        self._writeline('from ansyswrapper import ansysevents')
+        self._writeline('from ansyswrapper.ansyswrapper import ANSYSWrapperBase, load_components')
         self._writeline('class ' + self.classname + '(ANSYSWrapperBase):')
         self._writeline(indent1 + triplequote +
                         'A Wrapper for ANSYS Classic Structural ' + self.name + '.' +
@@ -455,6 +557,9 @@ class WrapperGenerator:
                         '#Creates parameters and initializes components.')
         self._writeline(indent1 +
                         '#Base class handles input, execution, and output.')
+        self._writeline(indent1 + '#Node numbers of the components, loaded once per process by the first instance')
+        self._writeline(indent1 + 'components_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "' +
+                        os.path.basename(self.tablesfilename) + '")')
 
     def _gendecl(self, k, i, name, units):
         nm = ansysinfo._make_name(name, i)
@@ -482,9 +587,10 @@ class WrapperGenerator:
                         self._gendecl(k, i, name, v[1])
                 else:
                     s = 'AnsysWrapperGenerator for ' + name + ': unknown component type ' + k + ' - IGNORED'
-                    print 'WARNING: ' + s
-                    self.logger.warning(s)        
+                    self.events.warning('generator_error', 'WARNING: %s', s, generator = self.name)
                 for otype, ounits in ansysinfo.outputtypes.iteritems():
+                    if self.subscribed != None and (name.upper(), otype) not in self.subscribed:
+                        continue
                     n = ansysinfo._make_name(name, otype)
                     self.output_names.add(n)
                     if self.unitsinfo.ok and ounits in self.unitsinfo.info:
@@ -513,30 +619,49 @@ class WrapperGenerator:
             else:
                 initial_value = 0.0
                 s = 'AnsysWrapperGenerator for ' + name + ': ' + i + ' not in initial_values_dictionary; using 0.0 as initial value'
-                print 'WARNING: ' + s
-                self.logger.warning(s)
+                self.events.warning('generator_error', 'WARNING: %s', s, generator = self.name)
             self._writeline(indent1 + global_name + ' = Float(' + str(initial_value) + ', iotype = "in", ' + units_str + ')') 
             self._writeline(indent1 + initial_name  + ' = ' + str(initial_value))
         #an output for the full name of the python results file
-        self._writeline(indent1 + 'Results_File = Str(iotype = "out", desc = "Results file in Python Format")')
+        self._writeline(indent1 + 'Results_File = Str(iotype = "out", desc = "Results file written by ANSYS")')
+
+    def _read_tables(self):
+        """Set self.components from tablesfilename, as saved by _gentables.  Returns True if it was read."""
+        try:
+            arrays = numpy.load(self.tablesfilename)
+        except (IOError, ValueError):
+            return False
+        try:
+            self.components = {'nodes': {}, 'surfaces': {}}
+            for key in arrays.files:
+                k, name = key.split('/', 1)
+                self.components.setdefault(k, {})[name] = arrays[key]
+        finally:
+            arrays.close()
+        return True
+
+    def _gentables(self):
+        """Save the arrays of the components to tablesfilename, read by the wrapper with load_components."""
+        arrays = {}
+        for k, v in self.components.iteritems():
+            for name, nodes in v.iteritems():
+                arrays[k + '/' + name] = nodes
+        numpy.savez(self.tablesfilename, **arrays)
 
     def _geninit(self):
         self._writeline(indent1 +
-            'def __init__(self, name, runner, dbfile, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33], logger_name = None):')
+            'def __init__(self, name, runner, dbfile, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33], logger_name = None, **kwargs):')
         self._writeline(indent2 + triplequote + 'Constructor for the ' +
                         self.classname + ' ANSYS OpenMDAO component.' + triplequote)
+        if self.outputs != None:
+            self._writeline(indent2 + 'kwargs.setdefault("outputs", ' + repr(list(self.outputs)) + ')')
         self._writeline(indent2 + 'super(' + self.classname +
-            ', self).__init__(name = name, runner = runner, dbfile = dbfile, elasticity = elasticity, poisson = poisson, logger_name = logger_name)')
-        self._writeline(indent2 + 'self.Results_File = os.path.join(runner.workingdir, self.my_name + ".py")')
+            ', self).__init__(name = name, runner = runner, dbfile = dbfile, elasticity = elasticity, poisson = poisson, logger_name = logger_name, **kwargs)')
+        self._writeline(indent2 + 'self.Results_File = os.path.join(runner.workingdir, self.my_name + "." + runner.results_ext)')
+        self._writeline(indent2 + 'self.components = load_components(self.components_file)')
         self._writeline(indent2 + 'self.components["global"] = {}')
         self._writeline(indent2 + 'self.components["global"]["FEA"] = []')
-        for k, v in self.components.iteritems():
-            self._writeline(indent2 +
-                            'self.components["' + k + '"] = {} #empty dictionary')
-            for name, nodes in v.iteritems():
-                self._writeline(indent2 +
-                                'self.components["' + k + '"]["' + name + '"] = ' + str(nodes))
-        self._writeline(indent2 + 'self.logger.debug("Init: " + self.dump())')
+        self._writeline(indent2 + 'self.events.debug("wrapper", "Init: %s", ansysevents.lazy(self.dump), instance = self.my_name)')
         self._writeline(indent1 + 'def execute(self):')
         self._writeline(indent2 + 'super(' + self.classname + ', self).execute()')
 
@@ -578,60 +703,105 @@ class WrapperGenerator:
                 self._writeline(indent2 + 'options.append( ' + '"' + line.strip() + '"' + ' )' )
             self._writeline(indent2 + 'return options')
 
-    def generate(self):
-        """Generate the wrapper."""
+    def generate(self, force = False):
+        """Generate the wrapper.
+
+           The components file made by ANSYS is kept, and reused while the db file, ANSYS_VER and the options
+           of the components file are the same, so ANSYS is only run when one of them changes.  The wrapper is not
+           generated again while those and the prep7, solution and post files and the options of the wrapper are
+           the same.  What they were is recorded in <genfilename without extension>_generated.json.
+
+           *Parameters*
+
+               force: boolean (optional)
+                   Set to True to generate the components file, if there is none, and the wrapper again
+                   regardless.  Default False.
+        """
         if not self.ok:
             s = 'AnsysWrapperGenerator for ' + self.name + ': see previous errors'
-            print 'ERROR: ' + s
-            self.logger.error(s)        
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
             return
         currdir = os.getcwd()
+        path = self.path
+        self.componentsfile = self._path(self.componentsfile)
+        from_cdb = not os.path.exists(self.componentsfile) and self.cdbfile
+        generated = not from_cdb and not os.path.exists(self.componentsfile)
+        if from_cdb: #read the components from the cdb file, without ANSYS
+            self.componentsfile = self._path(self.cdbfile)
+        if generated:
+            components_key = self._components_key(self._path(self.dbfile))
+        else:
+            components_key = self._components_key(self.componentsfile)
+        wrapper_key = self._wrapper_key(components_key, currdir)
+        manifest = self._read_manifest()
+        if (not force and manifest.get('wrapper_key') == wrapper_key and
+            os.path.exists(self.genfilename) and self._read_tables()):
+            #the same state as after generating it
+            self.unitskey = manifest.get('units', '0')
+            self.unitsinfo = ansysinfo.unitsinfodict.get(self.unitskey, ansysinfo.unitsinfodict['0'])
+            self._parse_prep7File()
+            self._parse_solutionFile()
+            self._parse_postFile()
+            s = 'AnsysWrapperGenerator for ' + self.name + ': ' + self.genfilename + ' is up to date'
+            self.events.info('generator', s, generator = self.name)
+            return
+        cached = manifest.get('componentsfile')
+        if cached:
+            cached = self._path(cached)
+        if generated and not force and manifest.get('components_key') == components_key and cached and \
+                os.path.exists(cached): #ANSYS would write the same components file again
+            self.componentsfile = cached
+        elif generated: #need to generate the components file
+            self.componentsfile = self._gen_componentsfile(path)
+            if not os.path.exists(self.componentsfile): #problem generating it
+                self.ok = False
+                s = 'AnsysWrapperGenerator for ' + self.name + ': trying to create componentsfile ' + self.componentsfile
+                self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
+                return
+            if cached and os.path.exists(cached) and os.path.abspath(cached) != os.path.abspath(self.componentsfile):
+                os.remove(cached) #superseded
+        manifest = {'version': GENERATOR_VERSION}
+        if generated:
+            manifest['components_key'] = components_key
+            manifest['componentsfile'] = os.path.basename(self.componentsfile)
+        self._write_manifest(manifest) #no wrapper_key until the wrapper is written
+        s = 'AnsysWrapperGenerator for ' + self.name + ': components file: ' + self.componentsfile 
+        self.events.info('generator', s, generator = self.name)
         try:
-            path,gen = os.path.split(self.genfilename)
-            os.chdir(path)
-            if not os.path.exists(self.componentsfile): #need to generate the components file
-                self.componentsfile = self._gen_componentsfile(path)
-                if not os.path.exists(self.componentsfile): #problem generating it
-                    self.ok = False
-                    s = 'AnsysWrapperGenerator for ' + self.name + ': trying to create componentsfile ' + self.componentsfile
-                    print 'ERROR: ' + s
-                    self.logger.error(s)        
-                    return
-            s = 'AnsysWrapperGenerator for ' + self.name + ': components file: ' + self.componentsfile 
-            print s
-            self.logger.info(s)
-            try:
-                self.genfile = open(self.genfilename, 'w')
-                #import pdb; pdb.set_trace()
+            self.genfile = open(self.genfilename, 'w')
+            #import pdb; pdb.set_trace()
+            if from_cdb:
+                self.ok = self._read_cdbfile(self.componentsfile)
+            else:
                 self.ok = self._parse_componentsfile(self.componentsfile)
-                if not self.ok:
-                    s = 'AnsysWrapperGenerator for ' + self.name + ': no components found in ' + self.componentsfile
-                    print 'ERROR: ' + s
-                    self.logger.error(s)        
-                    return
-
-                #parse the prep7, sol, and post files
-                self._parse_prep7File()
-                self._parse_solutionFile()
-                self._parse_postFile()
-
-                self._genheader(currdir)
-                self._gendecls()
-                self._geninit() 
-                self._genexecute()
-                self._genoptions()
-                self.genfile.close()
-
-            except IOError as ioe:
-                s = 'AnsysWrapperGenerator for ' + self.name + ': cannot open ' + self.genfilename 
-                s += '\n\t' + sys.exc_info()[0] + '\n\t' + str(ioe)
-                print 'ERROR: ' + s
-                self.logger.error(s)        
-                self.ok = False
+            if not self.ok:
+                s = 'AnsysWrapperGenerator for ' + self.name + ': no components found in ' + self.componentsfile
+                self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
                 return
-        finally:
-            os.chdir(currdir)
-            
+
+            #parse the prep7, sol, and post files
+            self._parse_prep7File()
+            self._parse_solutionFile()
+            self._parse_postFile()
+
+            self._gentables()
+            self._genheader(currdir)
+            self._gendecls()
+            self._geninit() 
+            self._genexecute()
+            self._genoptions()
+            self.genfile.close()
+            manifest['wrapper_key'] = wrapper_key
+            manifest['units'] = self.unitskey
+            self._write_manifest(manifest)
+
+        except IOError as ioe:
+            s = 'AnsysWrapperGenerator for ' + self.name + ': cannot open ' + self.genfilename 
+            s += '\n\t' + str(sys.exc_info()[0]) + '\n\t' + str(ioe)
+            self.events.error('generator_error', 'ERROR: %s', s, generator = self.name)
+            self.ok = False
+            return
+        
 if __name__ == "__main__": # pragma: no cover         
 
     import sys
@@ -0,0 +1,159 @@
+"""On-disk cache of ANSYS results, used by ANSYSWrapperBase.
+
+The cache is an sqlite database with one row per solved design point.
+Adding a result writes only that row, and a lookup reads only the row it
+needs, so the cost of each does not grow with the size of the cache.
+
+If max_entries is set, the least recently used entries are removed once the
+cache holds more than max_entries.
+
+file_digest gives the digests of the model files that keys, and the files kept
+by ANSYSWrapperGenerator, depend on.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+
+_file_digests = {} #full path of model file to ((size, mtime), sha1 digest of its content)
+
+def file_digest(fname):
+    """Return the sha1 digest of the content of fname, read again only if its size or time has changed."""
+    fname = os.path.abspath(fname)
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return 'missing ' + fname
+    stamp = (st.st_size, st.st_mtime)
+    known = _file_digests.get(fname)
+    if known != None and known[0] == stamp:
+        return known[1]
+    h = hashlib.sha1()
+    f = open(fname, 'rb')
+    try:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    finally:
+        f.close()
+    _file_digests[fname] = (stamp, h.digest())
+    return h.digest()
+
+class ResultCache(object):
+    """Cache of results keyed by the inputs that produced them.
+
+       *Parameters*
+
+           fname: string
+               Full path of the sqlite database file.  Created if it does not exist.
+
+           max_entries: integer (optional)
+               Largest number of entries to keep.  Default None, which is no limit.
+
+           logger_name:
+               Name of an existing logging::logger to use, if any.  Default None.
+    """
+    def __init__(self, fname, max_entries = None, logger_name = None):
+        if logger_name == None:
+            self.logger = logging.getLogger("MSI")
+        else:
+            self.logger = logging.getLogger(logger_name)
+        self.fname = fname
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.created = not os.path.exists(fname)
+        #check_same_thread False so ANSYSRunnerPool threads may share the cache; self.lock serializes use
+        self.db = sqlite3.connect(fname, check_same_thread = False)
+        self.db.text_factory = str
+        self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                        '(key TEXT PRIMARY KEY, value BLOB, last_used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.db.commit()
+        row = self.db.execute('SELECT COUNT(*), MAX(last_used) FROM results').fetchone()
+        self.count = row[0]
+        self.clock = row[1] or 0
+        self.touched = False
+
+    def _key(self, key):
+        if isinstance(key, basestring):
+            return key
+        return repr(key)
+
+    def _tick(self):
+        self.clock = self.clock + 1
+        return self.clock
+
+    def get(self, key, default = None):
+        """Return the value stored for key, or default if there is none."""
+        with self.lock:
+            k = self._key(key)
+            row = self.db.execute('SELECT value FROM results WHERE key = ?', (k,)).fetchone()
+            if row == None:
+                return default
+            #committed with the next put, so a hit does not wait for the disk
+            self.db.execute('UPDATE results SET last_used = ? WHERE key = ?', (self._tick(), k))
+            self.touched = True
+            return pickle.loads(str(row[0]))
+
+    def put(self, key, value):
+        """Store value for key, replacing any value already stored."""
+        blob = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            k = self._key(key)
+            cur = self.db.execute('UPDATE results SET value = ?, last_used = ? WHERE key = ?', (blob, self._tick(), k))
+            if cur.rowcount == 0:
+                self.db.execute('INSERT INTO results (key, value, last_used) VALUES (?, ?, ?)', (k, blob, self.clock))
+                self.count = self.count + 1
+            self._evict()
+            self.db.commit()
+            self.touched = False
+
+    def _evict(self):
+        if self.max_entries == None or self.count <= self.max_entries:
+            return
+        extra = self.count - self.max_entries
+        self.db.execute('DELETE FROM results WHERE key IN '
+                        '(SELECT key FROM results ORDER BY last_used LIMIT ?)', (extra,))
+        self.count = self.max_entries
+        self.logger.debug('ResultCache %s evicted %d entries', self.fname, extra)
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM results WHERE key = ?', (self._key(key),)).fetchone() != None
+
+    def has_key(self, key):
+        return key in self
+
+    def __len__(self):
+        return self.count
+
+    def iteritems(self):
+        """Iterate over (key, value) of every entry, least recently used first."""
+        with self.lock:
+            rows = self.db.execute('SELECT key, value FROM results ORDER BY last_used').fetchall()
+        for k, v in rows:
+            yield k, pickle.loads(str(v))
+
+    def flush(self):
+        """Write the recently used order of entries read since the last put."""
+        with self.lock:
+            if self.touched:
+                self.db.commit()
+                self.touched = False
+
+    def close(self):
+        if self.db != None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
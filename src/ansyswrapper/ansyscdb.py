@@ -0,0 +1,228 @@
+"""Reads the nodes, elements and components of an ANSYS .cdb file (as written by CDWRITE) without ANSYS.
+
+Three kinds of block are read, each into NumPy arrays; every other line is skipped:
+
+    NBLOCK
+        One row per node: node number, two solid model fields, then X, Y and Z (trailing zero
+        coordinates may be left out) and rotations, in the fixed width format on the line after it.
+    EBLOCK
+        One row per element.  In the SOLID format: material, type, real constant, section, coordinate
+        system, birth/death, solid model reference, shape, number of nodes, unused, element number and
+        the first 8 nodes, with any more nodes on the next line.  Otherwise: element number, type, real
+        constant, material, coordinate system and the nodes.
+    CMBLOCK
+        The node or element numbers of a component, where -n after m is the range m+1 to n.
+
+The fields are fixed width and need not be separated by spaces, so they are cut out by width,
+a chunk of lines at a time, rather than split.  A /UNITS line gives the units.
+"""
+
+import re
+
+import numpy
+
+#lines of a block converted at a time
+CHUNK = 100000
+
+class CdbModel(object):
+    """Nodes, elements and components of a .cdb file.
+
+       node_ids: array of int32 node numbers
+       coords: array with one row of X, Y and Z per node
+       element_ids, element_types: arrays of int32 element numbers and types
+       element_nodes: array with one row of node numbers per element, padded with 0
+       components: dictionary of component name to (type, array of int32 numbers), type 'NODE' or 'ELEM'
+       units: units label of /UNITS, such as 'SI', or None"""
+    def __init__(self):
+        self.node_ids = numpy.zeros(0, dtype = numpy.int32)
+        self.coords = numpy.zeros((0, 3))
+        self.element_ids = numpy.zeros(0, dtype = numpy.int32)
+        self.element_types = numpy.zeros(0, dtype = numpy.int32)
+        self.element_nodes = numpy.zeros((0, 0), dtype = numpy.int32)
+        self.components = {}
+        self.units = None
+
+    def component_nodes(self, name):
+        """Return the sorted node numbers of component name: its nodes, or the nodes of its elements."""
+        kind, ids = self.components[name]
+        if kind == 'NODE':
+            return numpy.unique(ids)
+        nodes = numpy.unique(self.element_nodes[_rows(self.element_ids, ids)])
+        return nodes[nodes > 0]
+
+    def node_coords(self, ids):
+        """Return the coordinates of the nodes ids, one row per node."""
+        return self.coords[_rows(self.node_ids, ids)]
+
+def _rows(all_ids, ids):
+    """Return the indices in all_ids of ids, which must all be in it."""
+    if not len(all_ids):
+        if len(ids):
+            raise ValueError('numbers not in the model')
+        return numpy.zeros(0, dtype = numpy.intp)
+    order = numpy.argsort(all_ids, kind = 'mergesort')
+    pos = numpy.searchsorted(all_ids, ids, sorter = order)
+    rows = order[numpy.minimum(pos, len(order) - 1)]
+    if numpy.any(all_ids[rows] != ids):
+        raise ValueError('numbers not in the model')
+    return rows
+
+def _fields(fmt):
+    """Return a list of (kind, width) of the fields of a Fortran format such as (3i9,6e21.13e3)."""
+    fields = []
+    for item in fmt.strip().strip('()').split(','):
+        m = re.match(r'\s*(\d*)([a-z])(\d+)', item.lower())
+        if m == None:
+            raise ValueError('unknown format ' + fmt)
+        fields.extend([(m.group(2), int(m.group(3)))] * int(m.group(1) or 1))
+    return fields
+
+def _parse(lines, widths, dtype):
+    """Return an array with one row per line and one column per field of widths, converted to dtype.
+       Missing fields at the end of a line are 0."""
+    filler = ''.join('%*d' % (w, 0) for w in widths)
+    total = len(filler)
+    records = ''.join((line + filler[len(line):])[:total] for line in lines)
+    fields = numpy.frombuffer(records, dtype = [('f%d' % i, 'S%d' % w) for i, w in enumerate(widths)])
+    if not len(fields):
+        return numpy.zeros((0, len(widths)), dtype = dtype)
+    return numpy.column_stack([fields['f%d' % i].astype(dtype) for i in range(len(widths))])
+
+def _concatenate(chunks, ncols, dtype):
+    """Return the arrays chunks, padded with 0 to ncols columns, one after the other."""
+    if not chunks:
+        return numpy.zeros((0, ncols), dtype = dtype)
+    padded = []
+    for c in chunks:
+        if c.shape[1] < ncols:
+            c = numpy.hstack([c, numpy.zeros((len(c), ncols - c.shape[1]), dtype = dtype)])
+        padded.append(c)
+    return numpy.concatenate(padded)
+
+def _block_lines(f, fname):
+    """Yield the lines of a block up to, not including, its -1 or N, line."""
+    for line in iter(f.readline, ''):
+        line = line.rstrip('\r\n')
+        word = line.strip()
+        if word.startswith('-1') or word.upper().startswith('N,'):
+            return
+        yield line
+    raise ValueError(fname + ' ends inside a block')
+
+def _read_nblock(f, fname, model):
+    fields = _fields(f.readline())
+    widths = [w for kind, w in fields]
+    ints = [i for i, (kind, w) in enumerate(fields) if kind == 'i']
+    reals = [i for i, (kind, w) in enumerate(fields) if kind != 'i']
+    if not ints or len(reals) < 3:
+        raise ValueError(fname + ' NBLOCK format has no node number or coordinates')
+    ids = []
+    coords = []
+    def convert(lines):
+        rows = _parse(lines, widths[:reals[2] + 1], numpy.float64)
+        ids.append(rows[:, ints[0]].astype(numpy.int32))
+        coords.append(rows[:, reals[:3]])
+    lines = []
+    for line in _block_lines(f, fname):
+        lines.append(line)
+        if len(lines) == CHUNK:
+            convert(lines)
+            lines = []
+    convert(lines)
+    model.node_ids = numpy.concatenate([model.node_ids] + ids)
+    model.coords = numpy.concatenate([model.coords] + coords)
+
+def _read_eblock(f, fname, model, solid):
+    widths = [w for kind, w in _fields(f.readline())]
+    per_line = len(widths)
+    filler = ''.join('%*d' % (w, 0) for w in widths)
+    width = len(filler)
+    def pad(r):
+        #pad r with 0 fields to whole lines
+        k = len(r) % width
+        return r + filler[k:] if k else r
+    chunks = []
+    def convert(records):
+        if records:
+            nlines = -(-max(len(r) for r in records) // width)
+            chunks.append(_parse(records, widths * nlines, numpy.int32))
+    records = []
+    more = 0 #continuation lines left of the current element
+    for line in _block_lines(f, fname):
+        if more:
+            records[-1] = pad(records[-1]) + line
+            more -= 1
+            continue
+        if len(records) >= CHUNK:
+            convert(records)
+            records = []
+        if solid:
+            nnodes = int(line[sum(widths[:8]):sum(widths[:9])])
+            more = max(0, -(-(nnodes - (per_line - 11)) // per_line))
+            line = pad(line)
+        records.append(line)
+    convert(records)
+    rows = _concatenate(chunks, max([c.shape[1] for c in chunks] + [per_line]), numpy.int32)
+    if solid:
+        ids, types, nodes = rows[:, 10], rows[:, 1], rows[:, 11:]
+    else:
+        ids, types, nodes = rows[:, 0], rows[:, 1], rows[:, 5:]
+    used = numpy.nonzero(nodes.any(axis = 0))[0]
+    nodes = nodes[:, :used[-1] + 1 if len(used) else 0]
+    model.element_ids = numpy.concatenate([model.element_ids, ids])
+    model.element_types = numpy.concatenate([model.element_types, types])
+    ncols = max(model.element_nodes.shape[1], nodes.shape[1])
+    model.element_nodes = _concatenate([model.element_nodes, nodes], ncols, numpy.int32)
+
+def _read_cmblock(f, fname, model, words):
+    if len(words) < 4:
+        raise ValueError(fname + ' CMBLOCK without a count: ' + ','.join(words))
+    name = words[1].strip()
+    kind = words[2].strip().upper()
+    count = int(words[3])
+    widths = [w for k, w in _fields(f.readline())]
+    lines = []
+    while count and len(lines) * len(widths) < count:
+        line = f.readline()
+        if not line:
+            raise ValueError(fname + ' ends inside CMBLOCK ' + name)
+        lines.append(line.rstrip('\r\n'))
+    values = _parse(lines, widths, numpy.int32).ravel()[:count]
+    model.components[name] = (kind, _expand(values))
+
+def _expand(values):
+    """Return values with each -n after m replaced by m+1 to n."""
+    negative = numpy.nonzero(values < 0)[0]
+    if not len(negative):
+        return values
+    parts = []
+    start = 0
+    for i in negative:
+        parts.append(values[start:i])
+        parts.append(numpy.arange(values[i - 1] + 1, -values[i] + 1, dtype = numpy.int32))
+        start = i + 1
+    parts.append(values[start:])
+    return numpy.concatenate(parts)
+
+def read_cdb(fname):
+    """Read the .cdb file fname, returning a CdbModel.  Raises IOError if it cannot be read
+       and ValueError if a block is not understood."""
+    model = CdbModel()
+    f = open(fname, 'r')
+    try:
+        for line in iter(f.readline, ''):
+            head = line[:8].upper()
+            if head.startswith('NBLOCK'):
+                _read_nblock(f, fname, model)
+            elif head.startswith('EBLOCK'):
+                words = line.split(',')
+                _read_eblock(f, fname, model, len(words) > 2 and words[2].strip().upper() == 'SOLID')
+            elif head.startswith('CMBLOCK'):
+                _read_cmblock(f, fname, model, line.split('!')[0].split(','))
+            elif head.startswith('/UNITS'):
+                words = line.split(',')
+                if len(words) > 1:
+                    model.units = words[1].strip()
+    finally:
+        f.close()
+    return model
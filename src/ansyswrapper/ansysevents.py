@@ -0,0 +1,72 @@
+"""Messages of ANSYSRunner, ANSYSRunnerPool, ANSYSWrapperBase and ANSYSWrapperGenerator.
+
+Each message is an event: a level, a name such as 'run_failed', a format string with its arguments,
+and fields such as the runner and instance it concerns.  Nothing is done for an event below the level
+of the logger and the echo level, and the format string is only filled in when the event is written, so
+debug messages cost little when DEBUG is off.  Arguments whose value is expensive to compute can be
+wrapped in lazy(), which calls them only then.
+
+An event goes to the logger with its name and fields in the extra attributes 'event' and 'fields' of
+the logging.LogRecord, so a handler can write them out as structured records.  Events at echo_level
+or above (default WARNING) are also printed to stdout, unless quiet.
+"""
+
+import logging
+import sys
+
+class lazy(object):
+    """An argument of an event that is computed, by calling fn(*args), only if the event is written."""
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+class EventLog(object):
+    """Writes events to a logger and, unless quiet, stdout.
+
+       *Parameters*
+
+           logger: logging.Logger
+               Where events go.
+
+           quiet: boolean (optional)
+               Set to True to print nothing to stdout.  Default False.
+
+           echo_level: integer (optional)
+               Level from which events are printed to stdout as well.  Default logging.WARNING.
+    """
+    def __init__(self, logger, quiet = False, echo_level = logging.WARNING):
+        self.logger = logger
+        self.quiet = quiet
+        self.echo_level = echo_level
+
+    def enabled(self, level):
+        """Return True if events at level are written anywhere."""
+        return (not self.quiet and level >= self.echo_level) or self.logger.isEnabledFor(level)
+
+    def emit(self, level, event, msg, *args, **fields):
+        """Write event at level: msg % args, with fields."""
+        echo = not self.quiet and level >= self.echo_level
+        logged = self.logger.isEnabledFor(level)
+        if not (echo or logged):
+            return
+        if logged:
+            self.logger.log(level, msg, *args, extra = {'event': event, 'fields': fields})
+        if echo:
+            if args:
+                msg = msg % args
+            sys.stdout.write(msg + '\n')
+
+    def debug(self, event, msg, *args, **fields):
+        self.emit(logging.DEBUG, event, msg, *args, **fields)
+
+    def info(self, event, msg, *args, **fields):
+        self.emit(logging.INFO, event, msg, *args, **fields)
+
+    def warning(self, event, msg, *args, **fields):
+        self.emit(logging.WARNING, event, msg, *args, **fields)
+
+    def error(self, event, msg, *args, **fields):
+        self.emit(logging.ERROR, event, msg, *args, **fields)
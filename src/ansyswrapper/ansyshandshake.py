@@ -0,0 +1,445 @@
+"""Handshakes between ANSYSRunner and the ANSYS control script it writes.
+
+A handshake has two halves: the APDL commands ANSYSRunner.init_ansys writes into
+the control script (tell the runner ANSYS is ready, then wait to be told to run
+an instance), and the Python calls ANSYSRunner uses to wait for ANSYS and to
+signal it.  The wait can also be done without blocking, with start_wait() then
+ready() until it returns True; fileno() gives a file descriptor to select() on
+meanwhile, where the handshake has one.  Select a handshake by name with create():
+
+    waitfor
+        The Windows WAITFOR signals ANSYSRunner has always used.  Windows only.
+    fifo
+        A pair of named pipes in the working directory.  POSIX only.
+    file
+        A pair of flag files in the working directory, watched with inotify
+        where available and polled otherwise.  Works everywhere, including on
+        shared cluster filesystems.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import subprocess
+import sys
+import time
+
+class Handshake(object):
+    """Base class for handshakes.  Call setup() before anything else."""
+    kind = ''
+
+    def setup(self, name, workingdir, hostname, timeout):
+        """Set the names used by the handshake for the ANSYSRunner called name."""
+        self.name = name
+        self.workingdir = workingdir
+        self.hostname = hostname
+        self.timeout = timeout
+
+    def ansys_init_commands(self):
+        """APDL commands run once, before the control loop."""
+        return []
+
+    def ansys_ready_commands(self):
+        """APDL commands with which ANSYS tells the runner it is ready."""
+        return []
+
+    def ansys_wait_commands(self):
+        """APDL commands with which ANSYS waits for the runner to signal it."""
+        return []
+
+    def signal_ansys(self):
+        """Tell ANSYS to read the instance file."""
+        pass
+
+    def wait_for_ansys(self, timeout, alive = None):
+        """Wait up to timeout seconds for ANSYS to be ready.
+           alive, if given, is called now and then and the wait is abandoned if it returns False.
+           Returns True if ANSYS signalled."""
+        return False
+
+    def start_wait(self):
+        """Start waiting for ANSYS to be ready, without blocking.  Follow with calls to ready()."""
+        pass
+
+    def ready(self):
+        """Return True if ANSYS has signalled since start_wait(), without blocking."""
+        return False
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable when ANSYS may have signalled, or None."""
+        return None
+
+    def abandon(self):
+        """Give up the wait begun by start_wait(); the next wait also waits for the abandoned signal."""
+        pass
+
+    def cleanup(self):
+        """Remove anything the handshake left in workingdir and release what it holds."""
+        pass
+
+    def stop_message(self, instancefile):
+        """Instructions for forcibly stopping ANSYS."""
+        return 'Put -1 in ' + instancefile + '\n'
+
+    def dump(self):
+        return 'handshake ' + self.kind
+
+
+def _check_windows():
+    """Raise OSError unless on Windows, where WAITFOR is."""
+    if sys.platform != 'win32':
+        raise OSError('the waitfor handshake needs Windows, not ' + sys.platform)
+
+class WaitforHandshake(Handshake):
+    """Windows WAITFOR signals.  settle_time is slept before each signal, because a signal
+       sent before ANSYS has started waiting for it is lost.  Elsewhere setup() raises OSError."""
+    kind = 'waitfor'
+
+    def __init__(self, settle_time = 1.0):
+        self.settle_time = settle_time
+        self.waiter = None # WAITFOR process of start_wait
+
+    def setup(self, name, workingdir, hostname, timeout):
+        _check_windows()
+        super(WaitforHandshake, self).setup(name, workingdir, hostname, timeout)
+        signame = ''
+        #Fix signame so is a legal signal name
+        #The signal cannot contain characters other than a-z, A-Z, 0-9 and ASCII characters in the range 128-255
+        l1 = range(ord('A'), ord('Z')+1)
+        l2 = range(ord('a'), ord('z')+1)
+        l3 = range(ord('0'), ord('9')+1)
+        l4 = range(128, 256)
+        l1.extend(l2)
+        l1.extend(l3)
+        l1.extend(l4)
+        for c  in name:
+            if ord(c) in l1:
+                signame += c
+            else:
+                signame += '0' #an arbitrary substitution of a legal character
+        self.from_ansys_signal = 'MSI' + signame + 'fromansyssignal'
+        self.to_ansys_signal = 'MSI' + signame + 'toansyssignal'
+
+    def ansys_ready_commands(self):
+        return ['/SYS, C:\\Windows\\System32\\waitfor.exe /S ' + self.hostname + ' /SI ' + self.from_ansys_signal]
+
+    def ansys_wait_commands(self):
+        return ['/SYS, C:\\Windows\\System32\\waitfor.exe /T ' + str(self.timeout) + ' ' + self.to_ansys_signal]
+
+    def signal_ansys(self):
+        _check_windows()
+        if self.waiter != None: # abandoned wait: ANSYS is not waiting for us yet
+            self.waiter.wait()
+            self.waiter = None
+        time.sleep(self.settle_time)
+        subprocess.call(['WAITFOR', '/S', self.hostname, '/SI', self.to_ansys_signal])
+
+    def wait_for_ansys(self, timeout, alive = None):
+        _check_windows()
+        ret = subprocess.call(['WAITFOR', '/T', str(timeout), self.from_ansys_signal])
+        return ret == 0
+
+    def start_wait(self):
+        self.waiter = subprocess.Popen(['WAITFOR', '/T', str(self.timeout), self.from_ansys_signal])
+
+    def ready(self):
+        if self.waiter == None or self.waiter.poll() == None:
+            return False
+        ret = self.waiter.returncode
+        self.waiter = None
+        return ret == 0
+
+    def abandon(self):
+        pass # signal_ansys waits for self.waiter
+
+    def stop_message(self, instancefile):
+        return 'Put -1 in ' + instancefile + '\nthen execute\nWAITFOR /S ' + self.hostname + \
+            ' /SI ' + self.to_ansys_signal + '\n'
+
+    def dump(self):
+        return 'handshake waitfor, signals ' + self.from_ansys_signal + ' ' + self.to_ansys_signal
+
+
+class FifoHandshake(Handshake):
+    """A pair of named pipes.  ANSYS writes to <name>_from.fifo when it is ready, and waits
+       by reading <name>_to.fifo until the runner writes to it."""
+    kind = 'fifo'
+
+    def __init__(self, poll_interval = 0.001):
+        self.poll_interval = poll_interval
+        self.owed = 0 # ready signals from waits that timed out
+        self.fd = None # from fifo, opened by start_wait
+
+    def setup(self, name, workingdir, hostname, timeout):
+        super(FifoHandshake, self).setup(name, workingdir, hostname, timeout)
+        self.from_fifo = name + '_from.fifo'
+        self.to_fifo = name + '_to.fifo'
+        self.from_path = os.path.join(workingdir, self.from_fifo)
+        self.to_path = os.path.join(workingdir, self.to_fifo)
+        for path in (self.from_path, self.to_path):
+            if os.path.exists(path):
+                os.remove(path)
+            os.mkfifo(path)
+
+    def ansys_ready_commands(self):
+        return ['/SYS, echo 1 > ' + self.from_fifo]
+
+    def ansys_wait_commands(self):
+        return ['/SYS, timeout ' + str(self.timeout) + ' cat ' + self.to_fifo + ' > /dev/null']
+
+    def signal_ansys(self):
+        while self.owed: # ANSYS cannot read the signal until it has said it is ready
+            if not self._wait(float(self.timeout), None):
+                break
+            self.owed -= 1
+        deadline = time.time() + float(self.timeout)
+        while True:
+            try:
+                fd = os.open(self.to_path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as oe:
+                if oe.errno != errno.ENXIO or time.time() > deadline: # ENXIO: ANSYS not reading yet
+                    raise
+                time.sleep(self.poll_interval)
+        try:
+            os.write(fd, '1\n')
+        finally:
+            os.close(fd)
+
+    def _wait(self, timeout, alive):
+        deadline = time.time() + float(timeout)
+        fd = os.open(self.from_path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            while True:
+                if poller.poll(500) and os.read(fd, 64):
+                    return True
+                if (alive and not alive()) or time.time() > deadline:
+                    return False
+        finally:
+            os.close(fd)
+
+    def wait_for_ansys(self, timeout, alive = None):
+        ret = self._wait(timeout, alive)
+        if not ret:
+            self.owed += 1
+        return ret
+
+    def start_wait(self):
+        self.fd = os.open(self.from_path, os.O_RDONLY | os.O_NONBLOCK)
+
+    def ready(self):
+        if self.fd == None:
+            return False
+        r, w, x = select.select([self.fd], [], [], 0)
+        if r and os.read(self.fd, 64):
+            os.close(self.fd)
+            self.fd = None
+            return True
+        return False
+
+    def fileno(self):
+        return self.fd
+
+    def abandon(self):
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+            self.owed += 1
+
+    def cleanup(self):
+        for path in (self.from_path, self.to_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stop_message(self, instancefile):
+        return 'Put -1 in ' + instancefile + '\nthen execute\necho 1 > ' + self.to_path + '\n'
+
+    def dump(self):
+        return 'handshake fifo, ' + self.from_path + ' ' + self.to_path
+
+
+class _Inotify(object):
+    """Minimal ctypes binding to Linux inotify, used to watch a directory for new files."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init')
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, path, mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch ' + path)
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for any event in the directory."""
+        r, w, x = select.select([self.fd], [], [], timeout)
+        if r:
+            os.read(self.fd, 4096)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileHandshake(Handshake):
+    """A pair of flag files.  ANSYS writes its ready count to <name>_from.flag, and waits for
+       the runner to create <name>_to.flag.  The runner watches for the from flag with inotify
+       if use_inotify and it is available, and otherwise polls every poll_interval seconds.
+       ansys_wait is 'shell' to wait with a /SYS shell loop, or 'apdl' to wait with /INQUIRE
+       and /WAIT; the default is 'apdl' on Windows and 'shell' elsewhere."""
+    kind = 'file'
+
+    def __init__(self, poll_interval = 0.005, use_inotify = True, ansys_wait = None):
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        if ansys_wait == None:
+            if sys.platform == 'win32':
+                ansys_wait = 'apdl'
+            else:
+                ansys_wait = 'shell'
+        self.ansys_wait = ansys_wait
+        self.count = 0 # ready signals expected so far
+        self.inotify = None # _Inotify of workingdir, None when polling
+
+    def setup(self, name, workingdir, hostname, timeout):
+        super(FileHandshake, self).setup(name, workingdir, hostname, timeout)
+        self.from_flag = name + '_from'
+        self.to_flag = name + '_to'
+        self.from_path = os.path.join(workingdir, self.from_flag + '.flag')
+        self.to_path = os.path.join(workingdir, self.to_flag + '.flag')
+        self.cleanup()
+        if self.use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.inotify = _Inotify(workingdir)
+            except (OSError, AttributeError, TypeError):
+                self.inotify = None # fall back to polling
+
+    def ansys_init_commands(self):
+        return ['MSI_HS_COUNT = 0']
+
+    def ansys_ready_commands(self):
+        return ['MSI_HS_COUNT = MSI_HS_COUNT + 1',
+                '*CFOPEN,' + self.from_flag + ',flag',
+                '*VWRITE,MSI_HS_COUNT',
+                '%I',
+                '*CFCLOSE']
+
+    def ansys_wait_commands(self):
+        nwait = int(float(self.timeout) / self.poll_interval)
+        if self.ansys_wait == 'shell':
+            f = self.to_flag + '.flag'
+            return ['/SYS, n=0; while [ ! -e ' + f + ' ] && [ $n -lt ' + str(nwait) + ' ]; do sleep ' +
+                    str(self.poll_interval) + '; n=$((n+1)); done; rm -f ' + f]
+        return ['MSI_HS_WAIT = 1',
+                'MSI_HS_N = 0',
+                '*DOWHILE,MSI_HS_WAIT',
+                '/INQUIRE,MSI_HS_GO,EXIST,' + self.to_flag + ',flag',
+                '*IF,MSI_HS_GO,EQ,1,THEN',
+                'MSI_HS_WAIT = 0',
+                '*ELSEIF,MSI_HS_N,GE,' + str(nwait) + ',THEN',
+                'MSI_HS_WAIT = 0',
+                '*ELSE',
+                'MSI_HS_N = MSI_HS_N + 1',
+                '/WAIT,' + str(self.poll_interval),
+                '*ENDIF',
+                '*ENDDO',
+                '/DELETE,' + self.to_flag + ',flag']
+
+    def signal_ansys(self):
+        try:
+            os.close(os.open(self.to_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        except OSError as oe:
+            if oe.errno != errno.EEXIST:
+                raise
+            # ANSYS has not yet seen the signal of an abandoned wait, so it runs once for both
+            self.count -= 1
+
+    def _ready(self):
+        try:
+            f = open(self.from_path, 'r')
+            s = f.read()
+            f.close()
+            return int(s.split()[0]) >= self.count
+        except (IOError, ValueError, IndexError): # not there, or still being written
+            return False
+
+    def wait_for_ansys(self, timeout, alive = None):
+        self.count += 1
+        deadline = time.time() + float(timeout)
+        check = time.time() + 0.5
+        while not self._ready():
+            now = time.time()
+            if now > deadline:
+                return False
+            if alive and now > check:
+                if not alive():
+                    return False
+                check = now + 0.5
+            if self.inotify:
+                self.inotify.wait(min(0.5, deadline - now))
+            else:
+                time.sleep(self.poll_interval)
+        return True
+
+    def start_wait(self):
+        self.count += 1
+
+    def ready(self):
+        if self.inotify:
+            self.inotify.wait(0) # clear events seen so far
+        return self._ready()
+
+    def fileno(self):
+        if self.inotify:
+            return self.inotify.fileno()
+        return None
+
+    def abandon(self):
+        pass # the count of the next wait includes the abandoned signal
+
+    def cleanup(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        for path in (self.from_path, self.to_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stop_message(self, instancefile):
+        return 'Put -1 in ' + instancefile + '\nthen create the file ' + self.to_path + '\n'
+
+    def dump(self):
+        if self.inotify:
+            watch = ' (inotify)'
+        else:
+            watch = ' (polling)'
+        return 'handshake file, ' + self.from_path + ' ' + self.to_path + watch
+
+
+handshakes = {
+    'waitfor' : WaitforHandshake,
+    'fifo' : FifoHandshake,
+    'file' : FileHandshake,
+    }
+
+def create(handshake = None):
+    """Return a new handshake.  handshake is a key of handshakes, an existing Handshake,
+       or None for the platform default: waitfor on Windows, file elsewhere."""
+    if handshake == None:
+        if sys.platform == 'win32':
+            handshake = 'waitfor'
+        else:
+            handshake = 'file'
+    if isinstance(handshake, basestring):
+        return handshakes[handshake]()
+    return handshake
@@ -2,43 +2,49 @@
 
 #Information about input variables of an OpenMDAO ANSYS Component
 # %N% is name of component, %V% is value
+# the third item removes the load again: for global inputs, %V% is the initial value
 # keys much match those in AnsysUnitsInfo
 surfaceinputtypes = { 
-    'PRESS_i' : ['sfa,%N%,1,pres,%V%', 'pressure'],
+    'PRESS_i' : ['sfa,%N%,1,pres,%V%', 'pressure', 'sfadele,%N%,1,pres'],
 #    'TEMP_i'  : ['da,%N%,temp,%V%', 'temperature']
     }
 keypointinputtypes = {
-    'FX_i' : ['fk,%N%,fx,%V%', 'force'],
-    'FY_i' : ['fk,%N%,fy,%V%', 'force'],
-    'FZ_i' : ['fk,%N%,fz,%V%', 'force'],
-    'TEMP_i' : ['dk,%N%,all,%V%', 'temperature'],
-    'UX_i' : ['dk,%N%,ux,%V%', 'length'],
-    'UY_i' : ['dk,%N%,uy,%V%', 'length'],
-    'UZ_i' : ['dk,%N%,uz,%V%', 'length']
+    'FX_i' : ['fk,%N%,fx,%V%', 'force', 'fkdele,%N%,fx'],
+    'FY_i' : ['fk,%N%,fy,%V%', 'force', 'fkdele,%N%,fy'],
+    'FZ_i' : ['fk,%N%,fz,%V%', 'force', 'fkdele,%N%,fz'],
+    'TEMP_i' : ['dk,%N%,all,%V%', 'temperature', 'dkdele,%N%,all'],
+    'UX_i' : ['dk,%N%,ux,%V%', 'length', 'dkdele,%N%,ux'],
+    'UY_i' : ['dk,%N%,uy,%V%', 'length', 'dkdele,%N%,uy'],
+    'UZ_i' : ['dk,%N%,uz,%V%', 'length', 'dkdele,%N%,uz']
     }
 nodeinputtypes = {
-    'FX_i' : ['f,%N%,fx,%V%','force'],
-    'FY_i' : ['f,%N%,fy,%V%','force'],
-    'FZ_i' : ['f,%N%,fz,%V%','force'],
-    'TEMP_i' : ['d,%N%,all,%V%', 'temperature'],
-    'UX_i' : ['d,%N%,ux,%V%', 'length'],
-    'UY_i' : ['d,%N%,uy,%V%', 'length'],
-    'UZ_i' : ['d,%N%,uz,%V%', 'length']
+    'FX_i' : ['f,%N%,fx,%V%','force', 'fdele,%N%,fx'],
+    'FY_i' : ['f,%N%,fy,%V%','force', 'fdele,%N%,fy'],
+    'FZ_i' : ['f,%N%,fz,%V%','force', 'fdele,%N%,fz'],
+    'TEMP_i' : ['d,%N%,all,%V%', 'temperature', 'ddele,%N%,all'],
+    'UX_i' : ['d,%N%,ux,%V%', 'length', 'ddele,%N%,ux'],
+    'UY_i' : ['d,%N%,uy,%V%', 'length', 'ddele,%N%,uy'],
+    'UZ_i' : ['d,%N%,uz,%V%', 'length', 'ddele,%N%,uz']
     }
 coordinputtypes  = { # for applying deflection at individual nodes
-    'UX_i' : ['d,%N%,ux,%V%', 'length'],
-    'UY_i' : ['d,%N%,uy,%V%', 'length'],
-    'UZ_i' : ['d,%N%,uz,%V%', 'length']
+    'UX_i' : ['d,%N%,ux,%V%', 'length', 'ddele,%N%,ux'],
+    'UY_i' : ['d,%N%,uy,%V%', 'length', 'ddele,%N%,uy'],
+    'UZ_i' : ['d,%N%,uz,%V%', 'length', 'ddele,%N%,uz']
     }
 globalinputtypes = {
-    'omega_Z' : ['OMEGA,,,%V%','speed'],
-    'temp_ref' : ['TREF,%V%','temperature'],
-    'temp_unif' : ['TUNIF,%V%','temperature']
+    'omega_Z' : ['OMEGA,,,%V%','speed', 'OMEGA,,,%V%'],
+    'temp_ref' : ['TREF,%V%','temperature', 'TREF,%V%'],
+    'temp_unif' : ['TUNIF,%V%','temperature', 'TUNIF,%V%']
     }
 # if any items are added to globalinputtypes, their initial_ parameters should be added to ansysWrapperGenerator __init__
 
 #TO_CHECK: complete above, and add nodeinputtypes
 
+#Input types whose results, in a linear static model, are proportional to the value,
+# so can be superposed (see ansyssuperposition).  Imposed displacements and temperatures
+# change which degrees of freedom are constrained, so are not included.
+linearinputtypes = ['FX_i', 'FY_i', 'FZ_i', 'PRESS_i']
+
 #Information about output variables of an OpenMDAO ANSYS Component
 # values must  match those in AnsysUnitsInfo
 outputtypes = {'number': '',
@@ -50,10 +56,10 @@ calctypes = ['max', 'min', 'avg']
 #Information about unit strings
 class AnsysUnitsInfo:
     """Information about units used in ANSYS."""
-    info = {} # empty dictionary
     def __init__(self, length = 'm', mass = 'kg', time = 's',
                  temperature = 'degK', speed = 'rad/s', ok = True):
         self.ok = ok
+        self.info = {} # empty dictionary, of this instance: a class attribute would be shared by every units system
         if self.ok:
             self.info['length'] = length
             self.info['mass'] = mass
@@ -116,3 +122,15 @@ def dump_unitsinfodict():
 #Utility functions
 def _make_name(name, extension):
     return name + '_' + extension
+
+def split_output_name(name):
+    """Return (component name, output type) of an output name <component>_<output type>, with or without
+       _<calc type> after it, or None if it is not the name of an output."""
+    for ctype in calctypes:
+        if name.endswith('_' + ctype):
+            name = name[:-len(ctype) - 1]
+            break
+    for otype in outputtypes:
+        if name.endswith('_' + otype) and len(name) > len(otype) + 1:
+            return name[:-len(otype) - 1], otype
+    return None
@@ -0,0 +1,231 @@
+"""Timings and counters of ANSYSRunner, ANSYSRunnerPool and ANSYSWrapperBase.
+
+Pass a Metrics to the runner (and, if it should be different, to the wrapper) to see where the time
+of a campaign goes.  Each phase of a run is timed with a monotonic clock as a span:
+
+    execute          all of ANSYSWrapperBase.execute
+    cache_lookup     computing the cache key and looking it up
+    write_input      writing the loads file
+    write_solution   writing the solution file
+    run              ANSYSRunner.run or run_batch, from signalling ANSYS until it is done
+    signal           signalling ANSYS to run
+    wait             waiting for ANSYS to signal it is done
+    ansys_resume     in ANSYS: resuming the db (or removing the loads of a resident model) and applying the loads
+    ansys_solve      in ANSYS: solving
+    ansys_post       in ANSYS: post-processing and writing the results file
+    read_results     reading the results file
+    outputs          computing the outputs from the results
+    cache_put        writing the outputs to the cache
+    picklecache      flushing the cache
+    start_ansys      starting ANSYS and waiting until it is ready
+
+The ansys_ phases are measured by ANSYS itself, which writes them to <runner>_MSI.tim when the runner
+was created with metrics enabled.  Counters are kept of cache_hits, cache_misses, superposed, runs,
+failures, bytes_written, bytes_read and loads_kept, the loads a resident runner did not send again
+because they had not changed, and gauges (last and largest value) of queue_depth, the runs
+waiting for an idle process of an ANSYSRunnerPool, and pipeline_depth, the jobs waiting in an ANSYSPipeline.
+
+Each span, count and gauge is an event, a dictionary such as
+
+    {'event': 'span', 'name': 'wait', 'time': 1349712345.25, 'seconds': 0.51, 'instance': 'wing'}
+
+passed to callback, if any, and written as one line of JSON to trace, if any.  summary() and report()
+aggregate them.  Without a Metrics the runner and wrapper use NULL, which does nothing.
+"""
+
+import ctypes
+import json
+import sys
+import threading
+import time
+
+def _monotonic_clock():
+    """Return a function that returns seconds from a clock that never goes backwards."""
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if sys.platform == 'win32':
+        return time.clock #QueryPerformanceCounter
+    if sys.platform.startswith('linux'):
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+        try:
+            clock_gettime = ctypes.CDLL(None, use_errno = True).clock_gettime
+            clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+            CLOCK_MONOTONIC = 1
+            def monotonic():
+                t = timespec() #one per call: ctypes releases the GIL, so threads must not share it
+                clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t))
+                return t.tv_sec + t.tv_nsec * 1e-9
+            monotonic()
+            return monotonic
+        except (AttributeError, OSError):
+            pass
+    return time.time
+
+clock = _monotonic_clock()
+
+class _Span(object):
+    """Times the block of a with statement.  Only used internally by Metrics."""
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.time = time.time()
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_span(self.name, clock() - self.start, self.time, **self.fields)
+        return False
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_span = _NullSpan()
+
+class NullMetrics(object):
+    """Metrics that are not kept.  Every method does nothing, so leaving metrics off costs almost nothing."""
+    enabled = False
+
+    def span(self, name, **fields):
+        return _null_span
+
+    def add_span(self, name, seconds, start = None, **fields):
+        pass
+
+    def count(self, name, n = 1, **fields):
+        pass
+
+    def gauge(self, name, value, **fields):
+        pass
+
+    def summary(self):
+        return {'spans': {}, 'counters': {}, 'gauges': {}}
+
+    def report(self):
+        return ''
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+NULL = NullMetrics()
+
+class Metrics(NullMetrics):
+    """Timings and counters, shared by the runners and wrappers it is passed to.  Safe to use from several threads.
+
+       *Parameters*
+
+           callback: function (optional)
+               Called with each event, a dictionary.  Default None.
+
+           trace: string (optional)
+               Full path of a file to append each event to, as one line of JSON.  Default None.
+    """
+    enabled = True
+
+    def __init__(self, callback = None, trace = None):
+        self.callback = callback
+        self.trace = None
+        if trace:
+            self.trace = open(trace, 'a')
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the spans, counters and gauges seen so far."""
+        self.spans = {}    #name to [count, total, min, max] seconds
+        self.counters = {} #name to total
+        self.gauges = {}   #name to [last, max]
+
+    def span(self, name, **fields):
+        """Return a context manager that times its block as span name.  fields are added to the event."""
+        return _Span(self, name, fields)
+
+    def add_span(self, name, seconds, start = None, **fields):
+        """Add span name, timed elsewhere, that took seconds and started at time.time() start (default now)."""
+        with self.lock:
+            s = self.spans.get(name)
+            if s == None:
+                self.spans[name] = [1, seconds, seconds, seconds]
+            else:
+                s[0] += 1
+                s[1] += seconds
+                s[2] = min(s[2], seconds)
+                s[3] = max(s[3], seconds)
+        if self.callback != None or self.trace != None:
+            if start == None:
+                start = time.time() - seconds
+            fields.update(event = 'span', name = name, time = start, seconds = seconds)
+            self._emit(fields)
+
+    def count(self, name, n = 1, **fields):
+        """Add n to counter name."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback != None or self.trace != None:
+            fields.update(event = 'count', name = name, time = time.time(), value = n)
+            self._emit(fields)
+
+    def gauge(self, name, value, **fields):
+        """Set gauge name to value."""
+        with self.lock:
+            g = self.gauges.get(name)
+            if g == None:
+                self.gauges[name] = [value, value]
+            else:
+                g[0] = value
+                g[1] = max(g[1], value)
+        if self.callback != None or self.trace != None:
+            fields.update(event = 'gauge', name = name, time = time.time(), value = value)
+            self._emit(fields)
+
+    def _emit(self, event):
+        if self.callback != None:
+            self.callback(event)
+        if self.trace != None:
+            line = json.dumps(event) + '\n'
+            with self.lock:
+                self.trace.write(line)
+
+    def summary(self):
+        """Return a dictionary of
+               'spans': name to a dictionary of count, total, mean, min and max seconds
+               'counters': name to total
+               'gauges': name to a dictionary of last and max value"""
+        with self.lock:
+            spans = {}
+            for name, (n, total, least, most) in self.spans.iteritems():
+                spans[name] = {'count': n, 'total': total, 'mean': total / n, 'min': least, 'max': most}
+            gauges = {}
+            for name, (last, most) in self.gauges.iteritems():
+                gauges[name] = {'last': last, 'max': most}
+            return {'spans': spans, 'counters': dict(self.counters), 'gauges': gauges}
+
+    def report(self):
+        """Return the summary as a table, spans by total time."""
+        summary = self.summary()
+        lines = ['%-16s %8s %12s %12s %12s %12s' % ('span', 'count', 'total (s)', 'mean (s)', 'min (s)', 'max (s)')]
+        for name, s in sorted(summary['spans'].iteritems(), key = lambda item: -item[1]['total']):
+            lines.append('%-16s %8d %12.6f %12.6f %12.6f %12.6f' % (name, s['count'], s['total'], s['mean'],
+                                                                   s['min'], s['max']))
+        for name, n in sorted(summary['counters'].iteritems()):
+            lines.append('%-16s %8d' % (name, n))
+        for name, g in sorted(summary['gauges'].iteritems()):
+            lines.append('%-16s %8s last %s max %s' % (name, '', g['last'], g['max']))
+        return '\n'.join(lines)
+
+    def close(self):
+        """Close the trace file."""
+        if self.trace != None:
+            with self.lock:
+                self.trace.close()
+                self.trace = None
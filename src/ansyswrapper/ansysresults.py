@@ -0,0 +1,190 @@
+"""Reads the results files written by the ANSYS control script of ANSYSRunner.
+
+There are two formats, chosen by the results_format of ANSYSRunner:
+
+    python
+        Python source defining class FeaPropertiesInPythonFormat, read with exec.
+    numeric
+        A small text header followed by one block of numbers per component,
+        one row per node, written with 17 significant digits so no precision
+        is lost.  Each block is read straight into a NumPy array:
+
+            MSI_RESULTS 1
+            UNITS <units>
+            LABELS number UX_o UY_o ...
+            COMPONENT <name> <number of nodes>
+            <one row per node, one column per label>
+            ...
+            END
+
+A batch of load steps (see ANSYSRunner.run_batch) writes a STEP <number> line
+before the components of each step.
+
+The components file that WrapperGenerator has ANSYS write, Python source defining class
+FeaModelInPythonFormat, is read by read_components_file line by line, without exec.
+"""
+
+import numpy
+
+#File extension of each results format
+extensions = {
+    'python' : 'py',
+    'numeric' : 'res',
+    }
+
+NUMERIC_MAGIC = 'MSI_RESULTS 1'
+def numeric_row_format(ncols):
+    """Return the *VWRITE format for a row of node number and ncols - 1 values."""
+    return '%I' + ' %25.17E' * (ncols - 1)
+
+#*VWRITE format for a row of node number and 8 values
+NUMERIC_ROW_FORMAT = numeric_row_format(9)
+
+class FeaResults(object):
+    """Results of one solve, with the same attributes as FeaPropertiesInPythonFormat.
+       nodeMap is a dictionary of component name to an array with one row per node
+       and one column per label in nodeLabels."""
+    def __init__(self):
+        self.nodeLabels = []
+        self.units = None
+        self.coordinateSystem = "Cartesian"
+        self.nodeMap = {}
+
+def read_python_results(fname):
+    """Read a results file written in the python format."""
+    f = open(fname, 'r')
+    try:
+        namespace = {}
+        exec f.read() in namespace
+    finally:
+        f.close()
+    return namespace['FeaPropertiesInPythonFormat']()
+
+def read_numeric_steps(fname):
+    """Read a results file written in the numeric format, returning a list of FeaResults,
+       one for each load step."""
+    f = open(fname, 'rb')
+    try:
+        if f.readline().strip() != NUMERIC_MAGIC:
+            raise ValueError(fname + ' is not a numeric results file')
+        steps = []
+        stepped = False
+        results = FeaResults()
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(fname + ' ends before END')
+            words = line.split()
+            if not words:
+                continue #rest of the last row of a block
+            if words[0] == 'UNITS':
+                try:
+                    results.units = int(words[1])
+                except (IndexError, ValueError):
+                    results.units = None
+            elif words[0] == 'LABELS':
+                results.nodeLabels = words[1:]
+            elif words[0] == 'STEP':
+                if stepped:
+                    steps.append(results)
+                    header = results
+                    results = FeaResults()
+                    results.units = header.units
+                    results.nodeLabels = header.nodeLabels
+                stepped = True
+            elif words[0] == 'COMPONENT':
+                name = words[1]
+                count = int(words[2])
+                ncols = len(results.nodeLabels)
+                if count:
+                    values = numpy.fromfile(f, dtype = numpy.float64, count = count * ncols, sep = ' ')
+                    if values.size != count * ncols:
+                        raise ValueError(fname + ' component ' + name + ' is truncated')
+                else:
+                    values = numpy.zeros(0)
+                results.nodeMap[name] = values.reshape(count, ncols)
+            elif words[0] == 'END':
+                break
+            else:
+                raise ValueError(fname + ' unexpected line ' + line)
+    finally:
+        f.close()
+    steps.append(results)
+    return steps
+
+def read_numeric_results(fname):
+    """Read a results file written in the numeric format."""
+    return read_numeric_steps(fname)[0]
+
+class FeaComponents(object):
+    """Components of a components file.
+       nodes is a dictionary of component name to an int32 array of its node numbers,
+       coords of component name to an array with one row of X, Y and Z per node, and
+       facets of area component name to an int32 array with one row of element and face number per face."""
+    def __init__(self):
+        self.units = None
+        self.nodes = {}
+        self.coords = {}
+        self.facets = {}
+
+def _component_rows(rows, ncols, dtype, fname, name):
+    """Return the rows [a, b, ...,], of a component of a components file as an array with ncols columns,
+       by default as many as in the first row."""
+    if ncols == None:
+        ncols = len(rows[0].strip('[],').split(',')) if rows else 0
+    text = ' '.join(rows).replace('[', ' ').replace(']', ' ').replace(',', ' ')
+    values = numpy.fromstring(text, dtype = dtype, sep = ' ')
+    if values.size != len(rows) * ncols:
+        raise ValueError(fname + ' component ' + name + ' has rows that are not ' + str(ncols) + ' numbers')
+    return values.reshape(len(rows), ncols)
+
+def read_components_file(fname):
+    """Read a components file written by the APDL script of WrapperGenerator, returning a FeaComponents.
+       Only the rows of one component are held at a time, as text, before they become arrays."""
+    components = FeaComponents()
+    section = None #'nodes' or 'facets'
+    name = None
+    rows = None
+    f = open(fname, 'r')
+    try:
+        for line in f:
+            line = line.strip()
+            if rows != None:
+                if line.startswith('],'):
+                    if section == 'nodes':
+                        values = _component_rows(rows, 4, numpy.float64, fname, name)
+                        components.nodes[name] = values[:, 0].astype(numpy.int32)
+                        components.coords[name] = values[:, 1:]
+                    else:
+                        #element and face number, and in older files the nodes of the face
+                        values = _component_rows(rows, None, numpy.int32, fname, name)
+                        if len(values):
+                            values = values[values[:, 1] > 0, :2] #face 0: no face of the element is on the area
+                        components.facets[name] = values.reshape(len(values), 2)
+                    rows = None
+                elif line.startswith('['):
+                    rows.append(line)
+            elif line.startswith('self.units'):
+                try:
+                    components.units = int(line.split('=')[1])
+                except (IndexError, ValueError):
+                    components.units = None
+            elif line.startswith('self.nodeMap'):
+                section = 'nodes'
+            elif line.startswith('self.facetMap'):
+                section = 'facets'
+            elif line.startswith('"') and section != None:
+                name = line.split('"')[1]
+            elif line == '[' and name != None:
+                rows = []
+    finally:
+        f.close()
+    if rows != None:
+        raise ValueError(fname + ' ends inside component ' + name)
+    return components
+
+def read_results(fname, results_format = 'python'):
+    """Read a results file written in results_format."""
+    if results_format == 'numeric':
+        return read_numeric_results(fname)
+    return read_python_results(fname)
@@ -0,0 +1,230 @@
+"""Answers linear static runs of an ANSYSWrapperBase by superposing unit load cases.
+
+The loads of a run are split into linear loads (see ansysinfo.linearinputtypes) and
+the rest, the context: imposed displacements and temperatures, global inputs such
+as FEA_omega_Z and any extra inputs.  The first run of a context is solved by ANSYS
+as it is.  When a context comes again, ANSYS solves once with no linear loads (the
+base case), and once for each linear load with value 1 (its unit case), the first
+time the load is used.  The results for any values of the linear loads are then
+
+    base + sum(value * (unit case - base))
+
+computed with NumPy.  UR_o, which is not linear, is computed again from UX_o and UY_o.
+So a context that keeps changing, as when an optimizer varies FEA_omega_Z, costs one
+solve per run, as without superposition.  Only the bases of the max_bases most recently
+used contexts are kept.
+
+Differences of results are only as precise as the results file, so use the
+'numeric' results_format of ANSYSRunner.
+"""
+
+import collections
+import logging
+
+import numpy
+
+import ansysevents
+import ansysinfo
+import ansysresults
+
+def is_linear_input(name):
+    """Return True if input name is of one of ansysinfo.linearinputtypes."""
+    for t in ansysinfo.linearinputtypes:
+        if name.endswith('_' + t):
+            return True
+    return False
+
+def _as_arrays(feaModel):
+    """Return feaModel with each nodeMap entry as a 2-D array, one row per node."""
+    ncols = len(feaModel.nodeLabels)
+    for c, nodes in feaModel.nodeMap.items():
+        feaModel.nodeMap[c] = numpy.asarray(nodes, dtype = numpy.float64).reshape(len(nodes), ncols)
+    return feaModel
+
+def _set_radial(values, labels):
+    """Set the UR_o column of values from UX_o and UY_o, as the ANSYS control script does:
+       sqrt(UX**2 + UY**2) with the sign of whichever of UX, UY is larger in magnitude."""
+    try:
+        ix = labels.index('UX_o')
+        iy = labels.index('UY_o')
+        ir = labels.index('UR_o')
+    except ValueError:
+        return
+    ux = values[:, ix]
+    uy = values[:, iy]
+    larger = numpy.where(numpy.abs(ux) > numpy.abs(uy), ux, uy)
+    values[:, ir] = numpy.where(larger < 0, -1.0, 1.0) * numpy.hypot(ux, uy)
+
+class _Basis(object):
+    """Base case and unit cases of one context."""
+    def __init__(self, base):
+        self.base = base
+        self.units = {} #input name to dictionary of component name to unit case - base
+
+class Superposition(object):
+    """Superposes unit load cases of an ANSYSWrapperBase.  Used by ANSYSWrapperBase when
+       created with superposition = True.
+
+       *Parameters*
+
+           wrapper: ANSYSWrapperBase
+               The wrapper whose model is solved.
+
+           nonlinear_inputs: list of strings (optional)
+               Names of inputs of the linear input types that must be solved by ANSYS
+               rather than superposed, for example because of contact.  Default [].
+
+           validate_every: integer (optional)
+               If more than 0, every validate_every'th superposed result is also solved by
+               ANSYS and compared; if they differ by more than rtol a warning is logged and the
+               ANSYS result is used.  Default 0, no validation.
+
+           rtol: float (optional)
+               Relative tolerance of validation, relative to the largest magnitude of each
+               output.  Default 1e-6.
+
+           max_bases: integer (optional)
+               Number of contexts whose bases are kept; the least recently used is dropped
+               when there are more; 0 to solve every run by ANSYS.  Default 8.
+
+           logger_name:
+               Name of an existing logging::logger to use, if any.  Default None.
+
+           quiet: boolean (optional)
+               Set to True to print nothing to stdout (see ansysevents).  Default False.
+    """
+    def __init__(self, wrapper, nonlinear_inputs = [], validate_every = 0, rtol = 1e-6, max_bases = 8,
+                 logger_name = None, quiet = False):
+        if logger_name == None:
+            self.logger = logging.getLogger("MSI")
+        else:
+            self.logger = logging.getLogger(logger_name)
+        self.events = ansysevents.EventLog(self.logger, quiet)
+        self.wrapper = wrapper
+        self.nonlinear_inputs = set(nonlinear_inputs)
+        self.validate_every = validate_every
+        self.rtol = rtol
+        self.max_bases = max_bases
+        self.bases = collections.OrderedDict() #context key to _Basis, least recently used first
+        self.seen = collections.OrderedDict() #keys of the last 8 * max_bases contexts solved once without a basis
+        self.count = 0 #superposed results
+        self.direct = 0 #results solved by ANSYS as they are
+        self.solves = 0 #ANSYS solves
+        self.mismatches = 0 #failed validations
+
+    def is_linear(self, name):
+        return name not in self.nonlinear_inputs and is_linear_input(name)
+
+    def _solve(self, loads, inputs):
+        self.solves = self.solves + 1
+        feaModel = self.wrapper.solve_fea_model(loads, inputs)
+        if feaModel == None:
+            return None
+        return _as_arrays(feaModel)
+
+    def _basis(self, key, context, linear, inputs):
+        """Return the basis of context, whose key is key, with unit cases of every load in linear,
+           solving what is missing."""
+        basis = self.bases.pop(key, None)
+        if basis == None:
+            self.events.info('superposition', '%s superposition: solve base case', self.wrapper.my_name,
+                             instance = self.wrapper.my_name)
+            base = self._solve(context, inputs)
+            if base == None:
+                return None
+            basis = _Basis(base)
+            while len(self.bases) >= self.max_bases:
+                self.bases.popitem(last = False)
+        self.bases[key] = basis
+        for load in linear:
+            n = load.name
+            if n not in basis.units:
+                self.events.info('superposition', '%s superposition: solve unit case %s', self.wrapper.my_name, n,
+                                 instance = self.wrapper.my_name)
+                unit = load.at(1.0, '!unit load case ' + n)
+                results = self._solve(context + [unit], inputs)
+                if results == None:
+                    return None
+                basis.units[n] = dict((c, results.nodeMap[c] - a)
+                                      for c, a in basis.base.nodeMap.iteritems())
+        return basis
+
+    def fea_model(self, loads, inputs = []):
+        """Return the results of solving with loads (ANSYSLoad, as from ANSYSWrapperBase.input_loads) and
+           extra inputs, as ansysresults.FeaResults.  Returns None if ANSYS fails.
+           The first run of a context is solved by ANSYS as it is; later runs of it are superposed."""
+        linear = []
+        context = []
+        for load in loads:
+            if self.is_linear(load.name):
+                linear.append(load)
+            else:
+                context.append(load)
+        key = self.wrapper.cache_key(context, inputs)
+        if self.max_bases <= 0 or (key not in self.bases and key not in self.seen):
+            self.seen[key] = True
+            while len(self.seen) > 8 * self.max_bases:
+                self.seen.popitem(last = False)
+            self.direct = self.direct + 1
+            return self._solve(loads, inputs)
+        self.seen.pop(key, None)
+        basis = self._basis(key, context, linear, inputs)
+        if basis == None:
+            return None
+        base = basis.base
+        result = ansysresults.FeaResults()
+        result.nodeLabels = base.nodeLabels
+        result.units = base.units
+        result.coordinateSystem = base.coordinateSystem
+        for c, a in base.nodeMap.iteritems():
+            values = a.copy()
+            for load in linear:
+                values += float(load.value) * basis.units[load.name][c]
+            _set_radial(values, base.nodeLabels)
+            result.nodeMap[c] = values
+        self.count = self.count + 1
+        if self.validate_every > 0 and self.count % self.validate_every == 0:
+            checked = self._solve(loads, inputs)
+            if checked != None and not self._agrees(result, checked):
+                self.mismatches = self.mismatches + 1
+                return checked
+        return result
+
+    def _agrees(self, result, checked):
+        """Compare superposed result with checked, solved by ANSYS; log a warning if they differ."""
+        ok = True
+        for c, expected in checked.nodeMap.iteritems():
+            values = result.nodeMap.get(c)
+            if values is None or values.shape != expected.shape:
+                ok = False
+                self.events.warning('superposition_mismatch', '%s superposition: component %s has different nodes',
+                                    self.wrapper.my_name, c, instance = self.wrapper.my_name)
+                continue
+            if not len(expected):
+                continue
+            scale = numpy.abs(expected).max(axis = 0)
+            diff = numpy.abs(values - expected).max(axis = 0)
+            bad = diff > self.rtol * numpy.maximum(scale, 1e-300)
+            for i in numpy.nonzero(bad)[0]:
+                ok = False
+                self.events.warning('superposition_mismatch', '%s superposition differs from ANSYS for %s %s by %s of %s',
+                                    self.wrapper.my_name, c, _label(checked, i), diff[i], scale[i],
+                                    instance = self.wrapper.my_name)
+        if ok:
+            self.events.info('superposition', '%s superposition agrees with ANSYS', self.wrapper.my_name,
+                             instance = self.wrapper.my_name)
+        return ok
+
+    def dump(self):
+        s = 'Superposition of ' + self.wrapper.my_name + '\n'
+        s = s + '   contexts ' + str(len(self.bases)) + '\n'
+        s = s + '   superposed results ' + str(self.count) + '\n'
+        s = s + '   results solved as they are ' + str(self.direct) + '\n'
+        s = s + '   ANSYS solves ' + str(self.solves) + '\n'
+        s = s + '   failed validations ' + str(self.mismatches) + '\n'
+        return s
+
+def _label(feaModel, i):
+    if i < len(feaModel.nodeLabels):
+        return feaModel.nodeLabels[i]
+    return str(i)
@@ -1,14 +1,21 @@
 
 __all__ = ['ANSYSWrapperBase']
 
+import collections
+import hashlib
+import itertools
 import logging
-import operator
 import math
+import numpy
 import os
 import pickle
+import Queue
+import select
+import shutil
 import socket
 import subprocess
 import sys
+import threading
 import time
 
 from openmdao.main.api import Component
@@ -17,20 +24,70 @@ from openmdao.lib.datatypes.api import Float
 from openmdao.lib.components.api import ExternalCode
 from openmdao.util.filewrap import FileParser
 
+import ansyscache
+import ansyshandshake
+import ansysevents
 import ansysinfo
+import ansysmetrics
+import ansysresults
+import ansyssuperposition
 
 #ANSYS_VER = "ANSYS140"
 #ANSYS_VER = "ANSYS130"
 
+_components_files = {} #full path of components file to ((size, mtime), its components)
+_components_lock = threading.Lock()
+
+def load_components(fname):
+    """Return the components saved by WrapperGenerator in the .npz file fname: a dictionary of component type
+       ('nodes', 'surfaces') to a dictionary of component name to a read only array of node numbers (or of element
+       and face numbers).  The file is read once per process, unless it changes.  The dictionary returned is new,
+       so a wrapper may add component types to it, but the dictionaries in it and their arrays are shared."""
+    fname = os.path.abspath(fname)
+    st = os.stat(fname)
+    stamp = (st.st_size, st.st_mtime)
+    with _components_lock:
+        known = _components_files.get(fname)
+        if known == None or known[0] != stamp:
+            components = {}
+            arrays = numpy.load(fname)
+            try:
+                for key in arrays.files:
+                    k, name = key.split('/', 1)
+                    a = arrays[key]
+                    a.flags.writeable = False
+                    components.setdefault(k, {})[name] = a
+            finally:
+                arrays.close()
+            known = (stamp, components)
+            _components_files[fname] = known
+    return dict(known[1])
+
 class ANSYSInstance:
     """Holds information about an instance to be solved by ANSYS Classical Structural. Only used internally by ANSYSRunner."""
-    def __init__(self, name, dbfile, index, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33]):
+    def __init__(self, name, dbfile, index, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33],
+                 outputs = None):
         self.name = name
         self.dbfile = dbfile
         self.index = index
         self.cdbfile = cdbfile
         self.elasticity = elasticity
         self.poisson = poisson
+        self.outputs = outputs
+        #output types and component names (upper case, as ANSYS has them) of outputs; None for all
+        self.outputtypes = None
+        self.componentnames = None
+        if outputs != None:
+            self.outputtypes = set()
+            self.componentnames = []
+            for n in outputs:
+                split = ansysinfo.split_output_name(n)
+                if split == None:
+                    continue
+                self.outputtypes.add(split[1])
+                c = split[0].upper()
+                if c not in self.componentnames:
+                    self.componentnames.append(c)
 
     def dump(self):
         s = 'ANSYSInstance ' + self.name
@@ -39,13 +96,121 @@ class ANSYSInstance:
         s = s +'\nindex ' + str(self.index)
         if self.cdbfile:
             s = s +'\ncdbfile ' + str(self.cdbfile)
+        if self.outputs != None:
+            s = s +'\noutputs ' + str(self.outputs)
         return s
 
+class ANSYSLoad(object):
+    """A load applied by ANSYSWrapperBase, with the commands that apply and remove it. Only used internally."""
+    def __init__(self, name, value, template, undo, comment):
+        self.name = name         #input name
+        self.value = value
+        self.template = template #command with %V% in place of the value
+        self.undo = undo         #command that removes the load
+        self.comment = comment
+        self.command = template.replace('%V%', str(value))
+
+    def at(self, value, comment):
+        """Return the same load with another value."""
+        return ANSYSLoad(self.name, value, self.template, self.undo, comment)
+
+class ANSYSRun(object):
+    """A run started without blocking, by ANSYSRunner.start, ANSYSRunnerPool.start or ANSYSWrapperBase.start_execute.
+       Nothing happens in the background: the run moves on only when poll(), done(), wait() or wait_runs is called,
+       so an event loop can keep many runs in flight from one thread.  To wait for several runs, select() on
+       their fileno(), where they have one, or call wait_runs.
+
+       ok is None while the run is in progress, then True if it succeeded or False if it failed, was cancelled
+       or passed its deadline."""
+    def __init__(self, name, deadline = None):
+        self.name = name         #instance name
+        self.deadline = deadline #time.time() after which the run is cancelled, or None
+        self.owner = None        #ANSYSRunner or ANSYSRunnerPool the run is waiting on
+        self.ok = None
+        self.callbacks = []
+
+    def add_done_callback(self, fn):
+        """Call fn(run) when the run is done; at once if it is already done.  fn may set run.ok to False."""
+        if self.ok == None:
+            self.callbacks.append(fn)
+        else:
+            fn(self)
+
+    def _finish(self, ok):
+        if self.ok != None:
+            return
+        self.ok = ok
+        self.owner = None
+        callbacks = self.callbacks
+        self.callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+    def poll(self):
+        """Check without blocking if the run is done.  Returns ok."""
+        if self.ok == None and self.owner != None:
+            self.owner._poll_run(self)
+        return self.ok
+
+    def done(self):
+        return self.poll() != None
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable when the run may be done, or None if there is none."""
+        if self.ok == None and self.owner != None:
+            return self.owner._fileno_run(self)
+        return None
+
+    def cancel(self):
+        """Stop waiting for the run.  ANSYS cannot be interrupted, so its process finishes the run before it
+           starts the next one.  Returns True if the run was cancelled, False if it was already done."""
+        if self.ok != None:
+            return False
+        if self.owner != None:
+            self.owner._cancel_run(self)
+        self._finish(False)
+        return True
+
+    def wait(self, timeout = None):
+        """Block until the run is done, or timeout seconds have passed.  Returns ok, None on timeout."""
+        wait_runs([self], timeout)
+        return self.ok
+
+def wait_runs(runs, timeout = None):
+    """Block until at least one of runs (ANSYSRun) is done, or timeout seconds have passed.
+       Returns the list of runs that are done, which is empty on timeout."""
+    end = None
+    if timeout != None:
+        end = time.time() + timeout
+    while True:
+        done = [run for run in runs if run.poll() != None]
+        if done or not runs:
+            return done
+        wait = 0.5
+        if end != None:
+            wait = end - time.time()
+            if wait <= 0:
+                return done
+            wait = min(wait, 0.5)
+        for run in runs:
+            if run.deadline != None:
+                wait = max(0, min(wait, run.deadline - time.time()))
+        fds = [run.fileno() for run in runs]
+        if None in fds:
+            wait = min(wait, 0.005) #some runs can only be polled
+        fds = [fd for fd in fds if fd != None]
+        if fds:
+            select.select(fds, [], [], wait)
+        else:
+            time.sleep(wait)
+
 
 class ANSYSRunner():
     """Runs ANSYS Classical Structural, possibly for multiple instances of ANSYSWrapperBase.
        There should be only one instance of this class: create it and pass it to the constructor of ANSYSWrapperBase.
        When finished, the user MUST call shutdown() - it is a good idea to put the call to shutdown in a finally clause.
+       To solve several instances at once, use ANSYSRunnerPool, which manages one ANSYSRunner per ANSYS process.
+       To run without blocking, use start(), which returns an ANSYSRun.
        
        *Parameters*
        
@@ -67,26 +232,64 @@ class ANSYSRunner():
             logger_name:
                 Name of an existing logging::logger to use, if any.  Default None.  If None, a logger will be created with an internal name.
                 
+            handshake: string (optional)
+                How ANSYSRunner and ANSYS signal each other: 'waitfor', 'fifo' or 'file' (see ansyshandshake).
+                Default None, which is 'waitfor' on Windows and 'file' elsewhere.
+                
+            results_format: string (optional)
+                How ANSYS writes results: 'python', as Python source, or 'numeric', as blocks of numbers with
+                full double precision that are read straight into NumPy arrays (see ansysresults).  Default 'python'.
+                
+            resident: boolean (optional)
+                Set to True to keep the model in ANSYS between runs of the same instance: instead of resuming
+                the db again, the loads of the last run that changed are removed and only the loads that changed
+                are applied again, so a run that changes one or two inputs sends only those.  Only used when
+                the wrapper can remove every load it applies (it has no extra inputs), and the loads must not
+                replace loads stored in the db.  Default False.
+                
+            metrics: ansysmetrics.Metrics (optional)
+                Where to keep the timings of each phase of a run and counters (see ansysmetrics).
+                Default None, which keeps none.
+                
+            quiet: boolean (optional)
+                Set to True to print nothing to stdout; messages still go to the logger (see ansysevents).
+                Default False, which prints warnings and errors.
+                
        """
     ansys_instances = {} #empty dictionary #TO_CHECK:  can we assume an order????
     name = 'ANSYSWrapperBase'
 
 
-    def __init__(self, name, workingdir, timeout = '1000', ANSYS_VER = "ANSYS145", run_under_wing = False, logger_name = None):
+    def __init__(self, name, workingdir, timeout = '1000', ANSYS_VER = "ANSYS145", run_under_wing = False, logger_name = None,
+                 handshake = None, results_format = 'python', resident = False, metrics = None, quiet = False):
         if logger_name == None:
             self.logger = logging.getLogger("MSI")
         else:
             self.logger = logging.getLogger(logger_name)
+        self.events = ansysevents.EventLog(self.logger, quiet)
+        if metrics == None:
+            metrics = ansysmetrics.NULL
+        self.metrics = metrics
+        self.timed = False #if True, ANSYS writes the times of its phases of each run to <name>_MSI.tim
+        self.lock = threading.RLock() #held while starting, running or stopping ANSYS, so threads may share the runner
         if len(name) > 20:
-            print 'ANSYSRunner name must be < 20 characters'
-            self.logger.warning('ANSYSRunner name must be < 20 characters: ' +
-                                name)
+            self.events.warning('runner_error', 'ANSYSRunner name must be < 20 characters: %s', name)
             self.ok = False
             return
 
         self.name = name.replace(' ', '')
         self.workingdir = workingdir
         self.timeout = timeout
+        self.ansys_instances = {}
+        self.local_db = False #if True, dbfiles made from cdbfiles are saved in workingdir
+        self.input_exts = ['inp', 'sol', 'dlt']
+        self.max_batch = 99 #most load steps in one run_batch
+        self.resident = resident
+        self.resident_instance = None #instance whose model and loads are in ANSYS, if they can be removed
+        self.resident_loads = [] #(command, undo command) of each load of resident_instance
+        self.current = None #ANSYSRun started by start() and not yet done
+        self.results_format = results_format
+        self.results_ext = ansysresults.extensions[results_format]
         self.ansys_inited = False
         self.ok = False
         self.ANSYS_VER = ANSYS_VER
@@ -95,19 +298,13 @@ class ANSYSRunner():
         try:
             ansysdir =  os.environ[self.ANSYS_VER + '_DIR']
         except KeyError as ke:
-            print 'Cannot find ' + self.ANSYS_VER + '_DIR in environment'
-            self.logger.warning('Cannot find ' + self.ANSYS_VER + '_DIR in environment')
-            print sys.exc_info()[0]
-            print str(ke)
+            self.events.warning('runner_error', 'Cannot find %s_DIR in environment', self.ANSYS_VER, runner = self.name)
             self.ok = False
             return
         try:
             ansysdir2 =  os.environ['ANSYS_SYSDIR']
         except KeyError as ke:
-            print 'Cannot find ANSYS_SYSDIR in environment'
-            self.logger.warning('Cannot find ANSYS_SYSDIR in environment')
-            print sys.exc_info()[0]
-            print str(ke)
+            self.events.warning('runner_error', 'Cannot find ANSYS_SYSDIR in environment', runner = self.name)
             self.ok = False
             return
         self.ansys_exe = os.path.join(ansysdir, 'bin', ansysdir2, self.ANSYS_VER)
@@ -116,11 +313,8 @@ class ANSYSRunner():
             if not os.path.exists(workingdir):
                 os.makedirs(self.workingdir)
         except OSError as oe:
-            print 'Error trying to create workingdir ' + self.workingdir
-            self.logger.warning('Error trying to create workingdir ' +
-                                self.workingdir)
-            print sys.exc_info()[0]
-            print str(oe)
+            self.events.warning('runner_error', 'Error trying to create workingdir %s\n%s', self.workingdir, oe,
+                                runner = self.name)
             self.ok = False
             return
 
@@ -128,177 +322,144 @@ class ANSYSRunner():
         try:
             self.ansysfd = open(self.ansysfile, 'w', 1)
         except IOError as ioe:
-            print 'Error trying to create file ' + self.ansysfile
-            self.logger.warning('Error trying to create file ' + self.ansysfile)
-            print sys.exc_info()[0]
-            print str(ioe)
+            self.events.warning('runner_error', 'Error trying to create file %s\n%s', self.ansysfile, ioe,
+                                runner = self.name)
             self.ok = False
             return
         self.hostname = socket.gethostname()
-        signame = ''
-        #Fix signame so is a legal signal name 
-        #The signal cannot contain characters other than a-z, A-Z, 0-9 and ASCII characters in the range 128-255
-        l1 = range(ord('A'), ord('Z')+1)
-        l2 = range(ord('a'), ord('z')+1)
-        l3 = range(ord('0'), ord('9')+1)
-        l4 = range(128, 256)
-        l1.extend(l2)
-        l1.extend(l3)
-        l1.extend(l4)
-        for c  in self.name:
-            if ord(c) in l1:
-                signame += c
-            else:
-                signame += '0' #an arbitrary substitution of a legal character
-        self.from_ansys_signal = 'MSI' + signame + 'fromansyssignal'
-        self.to_ansys_signal = 'MSI' + signame + 'toansyssignal'
 
         self.ansysout = os.path.join(self.workingdir, self.name + '_MSI.out')
         self.instancefile_basename = 'MSI_' + self.name + '_inst'
         self.instancefile_ext = 'txt'
+
+        try:
+            self.handshake = ansyshandshake.create(handshake)
+            self.handshake.setup(self.name, self.workingdir, self.hostname, self.timeout)
+        except (KeyError, OSError) as e:
+            self.events.warning('runner_error', 'Error setting up handshake %s\n%s', handshake, e, runner = self.name)
+            self.ok = False
+            return
         self.ok = True
 
-        msg = 'TO FORCIBLY STOP ANSYS:\n'
         fname = os.path.join(self.workingdir, 
                              self.instancefile_basename + '.' + self.instancefile_ext)
-        msg = msg + 'Put -1 in ' + fname + '\n'
-        msg = msg + 'then execute\nWAITFOR /S ' + self.hostname + \
-            ' /SI ' + self.to_ansys_signal + '\n'
-        print msg
-        self.logger.warning(msg)
+        self.events.warning('stop_message', 'TO FORCIBLY STOP ANSYS:\n%s', self.handshake.stop_message(fname),
+                            runner = self.name)
+
+    def _ansys_alive(self):
+        return self.run_under_wing or self.ansys_po.poll() == None
 
-    def _wait_for_ansys(self, timeout):
+    def _wait_for_ansys(self, timeout, phase = 'wait'):
+        with self.metrics.span(phase, runner = self.name):
+            self._wait_for_ansys_signal(timeout)
+
+    def _wait_for_ansys_signal(self, timeout):
         self._check_if_ansys_done()
-        if self.logger.isEnabledFor(logging.DEBUG): print 'before wait, ok ' + str(self.ok) + ' timeout ' + str(timeout)
-        self.logger.debug('before wait_for_ansys, ok ' + str(self.ok) + ' timeout ' + str(timeout))
+        self.events.debug('wait', 'before wait_for_ansys, ok %s timeout %s', self.ok, timeout, runner = self.name)
         if not self.ok:
-            print 'Not self.ok, not _wait_for_ansys'
-            self.logger.debug('Not self.ok, not _wait_for_ansys')
+            self.events.debug('wait', 'Not self.ok, not _wait_for_ansys', runner = self.name)
             return
-        if sys.platform == 'win32':
-            try:
-                ret = subprocess.call(['WAITFOR', '/T', str(timeout),
-                                       self.from_ansys_signal])
-                if self.logger.isEnabledFor(logging.DEBUG): print '_wait_for_ansys: ret ' + str(ret)
-                self.logger.debug('wait_for_ansys ret ' + str(ret))
-            except:
-                print 'Error wait for ansys ' + self.from_ansys_signal
-                print sys.exc_info()[0]
-                self.logger.warning('Error wait for ansys ' +
-                                    str(self.from_ansys_signal) + '\n' + str(sys.exc_info()[0]))
-                self.ok = False
-        else:
-            print 'Wrong platform'
-            self.logger.debug('wait_for_ansys WRONG PLATFORM')
-        if self.logger.isEnabledFor(logging.DEBUG): print 'after wait'
-        self.logger.debug('after wait_for_ansys, ok ' + str(self.ok))
+        try:
+            ret = self.handshake.wait_for_ansys(timeout, self._ansys_alive)
+            self.events.debug('wait', 'wait_for_ansys ret %s', ret, runner = self.name)
+            if not ret:
+                self._check_if_ansys_done()
+                self.events.warning('wait_timeout', 'wait_for_ansys: no signal from ANSYS within %s seconds', timeout,
+                                    runner = self.name)
+        except:
+            self.events.warning('wait_error', 'Error wait for ansys %s\n%s', self.handshake.dump(), sys.exc_info()[0],
+                                runner = self.name)
+            self.ok = False
+        self.events.debug('wait', 'after wait_for_ansys, ok %s', self.ok, runner = self.name)
 
     def _signal_ansys(self):
-        if self.logger.isEnabledFor(logging.DEBUG): print 'before send'
-        self.logger.debug('before signal_ansys')
-        if sys.platform == 'win32':
-            subprocess.call(['WAITFOR', '/S', self.hostname, '/SI',
-                             self.to_ansys_signal])
-        else:
-            print 'Wrong platform'
-            self.logger.debug('signal_ansys WRONG PLATFORM')
-        if self.logger.isEnabledFor(logging.DEBUG): print 'after send'
-        self.logger.debug('after signal_ansys')
+        self.events.debug('signal', 'before signal_ansys', runner = self.name)
+        try:
+            with self.metrics.span('signal', runner = self.name):
+                self.handshake.signal_ansys()
+        except (IOError, OSError) as e:
+            self.events.warning('signal_error', 'Error signalling ansys %s\n%s', self.handshake.dump(), e,
+                                runner = self.name)
+            self.ok = False
+        self.events.debug('signal', 'after signal_ansys', runner = self.name)
 
     def _start_ansys(self, timeout, productvar = None):
-        if self.logger.isEnabledFor(logging.DEBUG): print 'before start ansys'
-        self.logger.debug('before start_ansys')
+        self.events.debug('start_ansys', 'before start_ansys', runner = self.name)
 
         try:
             args = [self.ansys_exe, '-dir', self.workingdir, '-b',
                     '-i', self.ansysfile, '-o', self.ansysout,
                     '-MSI_INSTFILE', self.instancefile_basename,
                     '-MSI_INSTEXT', self.instancefile_ext]                      
-            if self.logger.isEnabledFor(logging.DEBUG): print args
-            self.logger.info('Starting ANSYS, args: ' + str(args))
+            self.events.info('start_ansys', 'Starting ANSYS, args: %s', args, runner = self.name)
             if self.run_under_wing:
                 self.ansys_po = None
-                print 'MANUALLY START ANSYS'
+                self.events.warning('start_ansys', 'MANUALLY START ANSYS', runner = self.name)
             else:
                 self.ansys_po = subprocess.Popen(args)
         except OSError as oe:
-            print 'Error trying to start ansys ' + self.ansys_exe
-            print sys.exc_info()[0]
-            print str(oe)
-            self.logger.warning('OSError trying to start ansys ' + self.ansys_exe +
-                                '\n' + str(oe))
+            self.events.warning('start_error', 'OSError trying to start ansys %s\n%s', self.ansys_exe, oe,
+                                runner = self.name)
             self.ok = False
             return
         except:
             #import pdb; pdb.set_trace()
-            print 'Error trying to start ansys ' + self.ansys_exe
-            print sys.exc_info()[0]
-            self.logger.warning('Error trying to start ansys ' + self.ansys_exe +
-                                '\n' + str(sys.exc_info()[0]))
+            self.events.warning('start_error', 'Error trying to start ansys %s\n%s', self.ansys_exe, sys.exc_info()[0],
+                                runner = self.name)
             self.ok = False
             return
 
-        self._wait_for_ansys(timeout)
+        self._wait_for_ansys(timeout, 'start_ansys')
         #import pdb; pdb.set_trace()
-        if self.logger.isEnabledFor(logging.DEBUG): print 'after start ansys'
-        self.logger.debug('after start_ansys')
+        self.events.debug('start_ansys', 'after start_ansys', runner = self.name)
 ##        time.sleep(1) #make sure ansys is really ready
 ##        print 'after sleep'
         self._check_if_ansys_done()
 
     def _check_if_ansys_done(self):
         if self.run_under_wing:
-            print 'MANUALLY CHECK IF ANSYS RUNNING, if not, set self.ok to False'
+            self.events.warning('ansys_exited', 'MANUALLY CHECK IF ANSYS RUNNING, if not, set self.ok to False',
+                                runner = self.name)
             return
         ret = self.ansys_po.poll()
         if ret != None: # has returned
-            print 'ANSYS exited with retcode ' + str(ret) + \
-                  ' Probably a licensing issue'
-            self.logger.warning('ANSYS exited with retcode ' + str(ret) + 
-                                ' Probably a licensing issue')
+            self.events.warning('ansys_exited', 'ANSYS exited with retcode %s Probably a licensing issue', ret,
+                                runner = self.name)
             self.ok = False
 
-    def _send_index_to_ansys(self, index, fname):
-        currdir = os.getcwd()
+    def _send_index_to_ansys(self, index, fname, nsteps = 0, resident = 0):
+        fname = os.path.join(self.workingdir, fname)
         try:
-            os.chdir(self.workingdir)
-            try:
-                f = open(fname, 'w')
-                f.write(str(index) + '\n')
-                f.close()
-                time.sleep(1) #TO_CHECK:  - why????
-                self._signal_ansys() #tell ansys to run instance
-                if index >= 0: #not telling ansys to quit
-                    self._wait_for_ansys(self.timeout) #wait for ansys to run instance
-            except IOError as ioe:
-                print 'Error trying to create file ' + fname
-                print sys.exc_info()[0]
-                print str(ioe)
-                self.logger.warning('Error trying to create file ' + fname +
-                                    '\n' + str(ioe))
-                self.ok = False
-        finally:
-            os.chdir(currdir)
-            print 'After _send_index_to_ansys, ok ' + str(self.ok)
-            self.logger.debug('After _send_index_to_ansys, ok ' + str(self.ok))
-
-    def add_instance(self, name, dbfile, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33]):
-        """Add an instance to be solved by ANSYS Classical Structural."""
+            f = open(fname, 'w')
+            f.write('%10d%10d%10d\n' % (index, nsteps, resident)) #read by *VREAD as (3F10.0)
+            f.close()
+            self._signal_ansys() #tell ansys to run instance
+            if index >= 0: #not telling ansys to quit
+                self._wait_for_ansys(self.timeout) #wait for ansys to run instance
+        except IOError as ioe:
+            self.events.warning('runner_error', 'Error trying to create file %s\n%s', fname, ioe, runner = self.name)
+            self.ok = False
+        self.events.debug('sent_index', 'After _send_index_to_ansys, ok %s', self.ok, runner = self.name, index = index)
+
+    def add_instance(self, name, dbfile, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33],
+                     outputs = None):
+        """Add an instance to be solved by ANSYS Classical Structural.
+           outputs is a list of the names of the outputs the instance uses, such as tip_UR_o_max;
+           ANSYS then gets and writes only those output types, for only those components.
+           Default None, which is every output of every component."""
         index = -1
         if self.ansys_inited:
-            print 'ERROR: attempt to add_instance ' + name + ' after calling init_ansys for ANSYSRunner ' + self.name
-            self.logger.error('ERROR: attempt to add_instance ' + name + ' after calling init_ansys for ANSYSRunner ' + self.name)
+            self.events.error('runner_error', 'ERROR: attempt to add_instance %s after calling init_ansys for ANSYSRunner %s',
+                              name, self.name, runner = self.name, instance = name)
             self.ok = False
             return index
         if name in self.ansys_instances:
-            print 'ERROR:' + name + \
-                  ' already used for an ANSYS instance. IGNORED'
-            self.logger.warning('ERROR:' + name + 
-                                ' already used for an ANSYS instance. IGNORED')
+            self.events.warning('runner_error', 'ERROR:%s already used for an ANSYS instance. IGNORED', name,
+                                runner = self.name, instance = name)
         else:
             index = len(self.ansys_instances) + 1
-            self.ansys_instances[name] = ANSYSInstance(name, dbfile, index, cdbfile, elasticity, poisson)
-            self.logger.debug('added instance ' + name)
+            self.ansys_instances[name] = ANSYSInstance(name, dbfile, index, cdbfile, elasticity, poisson, outputs)
+            self.events.debug('add_instance', 'added instance %s', name, runner = self.name, instance = name)
         return index
 
     def dump(self):
@@ -314,8 +475,7 @@ class ANSYSRunner():
             s = s + '\nansysout  ' + self.ansysout 
             s = s + '\ninstancefile_basename  ' + self.instancefile_basename 
             s = s + '\ninstancefile_ext  ' + self.instancefile_ext 
-            s = s + '\nsignals ' + self.from_ansys_signal + ' ' + \
-                self.to_ansys_signal
+            s = s + '\n' + self.handshake.dump()
             s = s + '\nInstances:'
             for k, v in self.ansys_instances.iteritems():
                 s = s + '\n' + v.dump()
@@ -325,12 +485,15 @@ class ANSYSRunner():
 
     def init_ansys(self, prep7=[], solution=[], post=[], productvar = None, timeout = 10):
         """Initialize the ANSYS Mechanical APDL run.  This method should be called AFTER all ansys_instances have been added."""
+        with self.lock:
+            return self._init_ansys(prep7, solution, post, productvar, timeout)
+
+    def _init_ansys(self, prep7=[], solution=[], post=[], productvar = None, timeout = 10):
         if self.ansys_inited:
-            print 'WARNING: attempt to init ANSYS twice for ' + self.name +\
-                  ' - IGNORED'
-            self.logger.warning('WARNING: attempt to init ANSYS twice for ' +
-                                self.name + ' - IGNORED')
+            self.events.warning('runner_error', 'WARNING: attempt to init ANSYS twice for %s - IGNORED', self.name,
+                                runner = self.name)
         else:
+            self.timed = self.metrics.enabled
             self.ansysfd.write('/batch\n')
             self.ansysfd.write('/TITLE, ' + 'ANSYSRunner ' + self.name + '\n')
 
@@ -351,11 +514,15 @@ class ANSYSRunner():
                 if v.dbfile:
                     if len(v.dbfile) > maxlen: maxlen = len(v.dbfile)
                 else: # we need to start by making the dbfile, as in CDREAD,DB,'Block01','cdb',,'',''
-                    (r,e) = os.path.splitext(v.cdbfile)
-                    v.dbfile = r + '.db'
+                    (c,e) = os.path.splitext(v.cdbfile)
                     if len(e): e = e[1:]   
+                    r = c
+                    if self.local_db: # keep each process of an ANSYSRunnerPool from writing the same db
+                        r = os.path.join(self.workingdir, os.path.basename(c))
+                    v.dbfile = r + '.db'
+                    if len(v.dbfile) > maxlen: maxlen = len(v.dbfile)
                     self.ansysfd.write('/COM, make db file ' + r + '.db for ' + v.name + '\n')
-                    self.ansysfd.write('CDREAD,DB,' + r + ',' + e + '\n')
+                    self.ansysfd.write('CDREAD,DB,' + c + ',' + e + '\n')
                     self.ansysfd.write('/COM, MATERIAL TYPE INFO\n')
                     self.ansysfd.write('MP,EX,1,' + str(v.elasticity[0]) + '\n')
                     self.ansysfd.write('MP,EY,1,' + str(v.elasticity[1]) + '\n')
@@ -391,27 +558,53 @@ class ANSYSRunner():
                 self.ansysfd.write(instance_info_array +
                                    '(1,' + col + ',3) = \'' + e + '\'\n')
 
+            self.keylist = self._output_keys()
+            self.subscribed = [v for v in self.ansys_instances.itervalues() if v.componentnames != None]
+            if self.subscribed:
+                self.ansysfd.write('/COM, components whose outputs each instance uses, none for all of them\n')
+                maxcomps = max([1] + [len(v.componentnames) for v in self.subscribed])
+                self.ansysfd.write('*DIM,MSI_NCMP,ARRAY,' + str(numinstance) + '\n')
+                self.ansysfd.write('*DIM,MSI_CMPN,STRING,32,' + str(maxcomps) + ',' + str(numinstance) + '\n')
+                for v in self.subscribed:
+                    col = str(v.index)
+                    self.ansysfd.write('MSI_NCMP(' + col + ') = ' + str(len(v.componentnames)) + '\n')
+                    for j, c in enumerate(v.componentnames):
+                        self.ansysfd.write('MSI_CMPN(1,' + str(j + 1) + ',' + col + ') = \'' + c + '\'\n')
+
             instance_var_name = 'MSI_' + self.name + '_ivn'
-            self.ansysfd.write('/COM, array to read instance index from file\n')
-            self.ansysfd.write('*DIM,' + instance_var_name + ',ARRAY,' + '1\n')
+            self.ansysfd.write('/COM, array to read instance index, number of load steps and resident flag from file\n')
+            self.ansysfd.write('*DIM,' + instance_var_name + ',ARRAY,' + '3\n')
+            if self.results_format == 'numeric':
+                self.ansysfd.write('/COM, extensions of the load step files of a batch\n')
+                self.ansysfd.write('*DIM,MSI_STEPEXT,STRING,3,' + str(self.max_batch) + '\n')
+                for k in range(1, self.max_batch + 1):
+                    self.ansysfd.write('MSI_STEPEXT(1,' + str(k) + ') = \'' + self.step_ext(k) + '\'\n')
+
+            self.ansysfd.write('/COM, Handshake ' + self.handshake.kind + '\n')
+            for s in self.handshake.ansys_init_commands():
+                self.ansysfd.write(s + '\n')
 
             doparm = 'MSI_DO_PARM'
             self.ansysfd.write(doparm + '=1\n')
             self.ansysfd.write('*DOWHILE,' + doparm + '\n')
             self.ansysfd.write('/COM, Signal ANSYSRunner that ANSYS is ready, then wait\n')
-            self.ansysfd.write('/SYS, C:\\Windows\\System32\\waitfor.exe /S ' + self.hostname + ' /SI ' + self.from_ansys_signal + '\n')
+            for s in self.handshake.ansys_ready_commands():
+                self.ansysfd.write(s + '\n')
 
             self.ansysfd.write('/COM, Wait for Signal from OpenMDAO\n')
-            self.ansysfd.write('/SYS, C:\\Windows\\System32\\waitfor.exe /T ' + self.timeout + ' ' + self.to_ansys_signal + '\n')            
+            for s in self.handshake.ansys_wait_commands():
+                self.ansysfd.write(s + '\n')
             instfname = 'MSI_INSTFILE'
             instename = 'MSI_INSTEXT'
 
             self.ansysfd.write('/COM, Read instance index from -' + instfname + ' ' +
                                instename + '\n')
             self.ansysfd.write('*VREAD,' + instance_var_name + '(1),' +
-                               instfname + ',' + instename  + '\n')
-            self.ansysfd.write('(F2.0)\n')
+                               instfname + ',' + instename  + ',,IJK,3\n')
+            self.ansysfd.write('(3F10.0)\n')
             self.ansysfd.write('iv=' + instance_var_name + '(1)\n')
+            self.ansysfd.write('MSI_NSTEPS=' + instance_var_name + '(2)\n')
+            self.ansysfd.write('MSI_RESIDENT=' + instance_var_name + '(3)\n')
             self.ansysfd.write('PARSAV,ALL,\'' + self.name + '\',\'prm\'\n')
 
             self.ansysfd.write('*IF,iv,LT,0,THEN\n')
@@ -419,7 +612,9 @@ class ANSYSRunner():
             self.ansysfd.write('*ELSE\n')
             self.ansysfd.write('MSI_I_Name = ' + instance_info_array +
                                '(1,iv,1)\n')
+            self._write_time('MSI_TM0')
             self.ansysfd.write('finish\n')
+            self.ansysfd.write('*IF,MSI_RESIDENT,EQ,0,THEN\n')
             self.ansysfd.write('/FILNAME,STRCAT(\'MSI_ANSYS_\',MSI_I_Name),0\n')
 
             #  RESUME IT
@@ -429,30 +624,204 @@ class ANSYSRunner():
                                instance_info_array + '(1,iv,3)\n')
             self.ansysfd.write('allsel\n')
             self.ansysfd.write('PARRES,CHANGE,\'' + self.name + '\',\'prm\'\n')
+            self.ansysfd.write('*ELSE\n')
+            self.ansysfd.write('/COM, The model of the last run is still resident: remove its loads\n')
+            self.ansysfd.write('/prep7\n')
+            self.ansysfd.write('allsel\n')
+            self.ansysfd.write('/INPUT,' + instance_info_array +
+                               '(1,iv,1), und\n')
+            self.ansysfd.write('/COM, Apply only the loads that changed\n')
+            self.ansysfd.write('/INPUT,' + instance_info_array +
+                               '(1,iv,1), dif\n')
+            self.ansysfd.write('*ENDIF\n')
+            self.ansysfd.write('*IF,MSI_RESIDENT,EQ,0,THEN\n')
             self.ansysfd.write('/COM, Read loads, etc.\n')
             self.ansysfd.write('/INPUT,' + instance_info_array +
                                '(1,iv,1), inp\n')
-            for s in prep7:
-                self.ansysfd.write(s + '\n');
+            self.ansysfd.write('*ENDIF\n')
+            if prep7:
+                self.ansysfd.write('*IF,MSI_RESIDENT,EQ,0,THEN ! a resident model already has these\n')
+                for s in prep7:
+                    self.ansysfd.write(s + '\n');
+                self.ansysfd.write('*ENDIF\n')
             self.ansysfd.write('!finish preprocessing\n')
             self.ansysfd.write('finish\n')
+            self._write_time('MSI_TM1')
             self.ansysfd.write('/COM, Re-solve the model\n')
             self.ansysfd.write('/sol\n')
+            if self.results_format == 'numeric':
+                self.ansysfd.write('*IF,MSI_NSTEPS,GT,0,THEN\n')
+                self.ansysfd.write('/COM, Batch: each load step file changes the loads, then solve again\n')
+                self.ansysfd.write('/COM, the solver reuses the factored matrix when the stiffness is unchanged\n')
+                self.ansysfd.write('*DO,MSI_K,1,MSI_NSTEPS,1\n')
+                self.ansysfd.write('/INPUT,' + instance_info_array +
+                                   '(1,iv,1), MSI_STEPEXT(1,MSI_K)\n')
+                self.ansysfd.write('/INPUT,' + instance_info_array +
+                                   '(1,iv,1), sol\n')
+                self.ansysfd.write('*ENDDO\n')
+                self.ansysfd.write('finish\n')
+                self._write_time('MSI_TM2')
+                self.ansysfd.write('/COM, Post-process each load step to get outputs\n')
+                self.ansysfd.write('/post1\n')
+                self._write_step_results(instance_info_array, post)
+                self.ansysfd.write('*ELSE\n')
             self.ansysfd.write('/INPUT,' + instance_info_array +
                                '(1,iv,1), sol\n')
+            self._write_time('MSI_TM2')
             self.ansysfd.write('/COM, Post-process to get outputs\n')
             self.ansysfd.write('/post1\n')
+            self.ansysfd.write('*IF,MSI_RESIDENT,EQ,0,THEN\n')
             self.ansysfd.write('set,first\n')
+            self.ansysfd.write('*ELSE\n')
+            self.ansysfd.write('set,last ! results of earlier runs are still in the results file\n')
+            self.ansysfd.write('*ENDIF\n')
             for s in post:
                 self.ansysfd.write(s + '\n');
-            self.ansysfd.write('*cfopen,' + instance_info_array + '(1,iv,1), ' +
-                               'py\n')
+            self._write_results(instance_info_array)
+            if self.results_format == 'numeric':
+                self.ansysfd.write('*ENDIF\n')
+            self.ansysfd.write('finish\n')
+            self._write_phase_times()
+
+            self.ansysfd.write('*ENDIF\n')
+            self.ansysfd.write('*ENDDO\n')
+            #self.ansysfd.write('exit\n')
+            self.ansysfd.close()
+            self._start_ansys(timeout = timeout, productvar = productvar)
+        self.ansys_inited = True
+        self.events.info('ansys_inited', 'ansys_inited done', runner = self.name)
+
+    def _write_time(self, par):
+        """If timed, write APDL that sets par to the wall clock time in seconds."""
+        if self.timed:
+            self.ansysfd.write('*GET,' + par + ',ACTIVE,0,TIME,WALL\n')
+
+    def _write_phase_times(self):
+        """If timed, write APDL that writes the seconds taken to resume, solve and post-process the run
+           to <name>_MSI.tim, read by _read_phase_times."""
+        if not self.timed:
+            return
+        self._write_time('MSI_TM3')
+        self.ansysfd.write('/COM, Phase times to ' + self.name + '_MSI.tim\n')
+        self.ansysfd.write('MSI_TR = MSI_TM1 - MSI_TM0\n')
+        self.ansysfd.write('MSI_TS = MSI_TM2 - MSI_TM1\n')
+        self.ansysfd.write('MSI_TP = MSI_TM3 - MSI_TM2\n')
+        self.ansysfd.write('*cfopen,' + self.name + '_MSI,tim\n')
+        self.ansysfd.write('*vwrite,MSI_TR,MSI_TS,MSI_TP\n')
+        self.ansysfd.write('(3F16.6)\n')
+        self.ansysfd.write('*cfclose\n')
+
+    def _read_phase_times(self, instancename):
+        """Add the times ANSYS took to resume, solve and post-process the last run to the metrics."""
+        if not self.timed:
+            return
+        try:
+            f = open(os.path.join(self.workingdir, self.name + '_MSI.tim'), 'r')
+            try:
+                times = [float(x) for x in f.read().split()]
+            finally:
+                f.close()
+        except (IOError, ValueError) as e:
+            self.events.warning('runner_error', 'AnsysRunner %s cannot read the phase times of %s\n%s',
+                                self.name, instancename, e, runner = self.name, instance = instancename)
+            return
+        for phase, seconds in zip(('ansys_resume', 'ansys_solve', 'ansys_post'), times):
+            self.metrics.add_span(phase, seconds, runner = self.name, instance = instancename)
+
+    def _output_keys(self):
+        """Return the columns of the results file: the output types some instance uses, in the order of keylist.
+           UR_o is written with UX_o and UY_o, which superposition needs to compute it."""
+        used = set(['number'])
+        for v in self.ansys_instances.itervalues():
+            if v.outputtypes == None:
+                return list(ANSYSRunner.keylist)
+            used.update(v.outputtypes)
+        if 'UR_o' in used:
+            used.update(['UX_o', 'UY_o'])
+        return [k for k in ANSYSRunner.keylist if k in used]
+
+    def _write_nodal_values(self):
+        """Write APDL that gets the results for every node of the model into MSI_NV, one array operation per quantity.
+           Columns match ANSYSRunner.keylist; rows are node numbers.  Only the columns in self.keylist are filled."""
+        keys = self.keylist
+        self.ansysfd.write('/COM, Get results for all nodes at once\n')
+        self.ansysfd.write('allsel\n')
+        self.ansysfd.write('*get,MSI_NMAX,node,,num,maxd ! highest node number\n')
+        self.ansysfd.write('*del,MSI_NV,,nopr\n')
+        self.ansysfd.write('*dim,MSI_NV,array,MSI_NMAX,9\n')
+        self.ansysfd.write('*del,MSI_T1,,nopr\n')
+        self.ansysfd.write('*dim,MSI_T1,array,MSI_NMAX\n')
+        self.ansysfd.write('*del,MSI_T2,,nopr\n')
+        self.ansysfd.write('*dim,MSI_T2,array,MSI_NMAX\n')
+        self.ansysfd.write('*del,MSI_SEL,,nopr\n')
+        self.ansysfd.write('*dim,MSI_SEL,array,MSI_NMAX\n')
+        self.ansysfd.write('*vfill,MSI_NV(1,1),ramp,1,1 ! node number\n')
+        for key, col, item in (('UX_o', 2, 'u,x ! x-displ'), ('UY_o', 3, 'u,y ! y-displ'), ('UZ_o', 4, 'u,z ! z-displ'),
+                               ('TEMP_o', 6, 'temp ! TEMP'), ('FX_o', 7, 'rf,fx ! X Reaction Load'),
+                               ('FY_o', 8, 'rf,fy ! Y Reaction Load'), ('FZ_o', 9, 'rf,fz ! Z Reaction Load')):
+            if key in keys:
+                self.ansysfd.write('*vget,MSI_NV(1,' + str(col) + '),node,1,' + item + '\n')
+        if 'UR_o' not in keys:
+            return
+        self.ansysfd.write('!We need radial displacement as a signed value:\n')
+        self.ansysfd.write('!sqrt(UX**2 + UY**2) with the sign of whichever of UX, UY is larger in magnitude\n')
+        self.ansysfd.write('*voper,MSI_NV(1,5),MSI_NV(1,2),mult,MSI_NV(1,2)\n')
+        self.ansysfd.write('*voper,MSI_T1(1),MSI_NV(1,3),mult,MSI_NV(1,3)\n')
+        self.ansysfd.write('*voper,MSI_NV(1,5),MSI_NV(1,5),add,MSI_T1(1)\n')
+        self.ansysfd.write('*vfun,MSI_NV(1,5),sqrt,MSI_NV(1,5)\n')
+        self.ansysfd.write('*vabs,0,1,1\n')
+        self.ansysfd.write('*voper,MSI_T1(1),MSI_NV(1,2),gt,MSI_NV(1,3) ! 1 where abs(UX) > abs(UY)\n')
+        self.ansysfd.write('*voper,MSI_T2(1),MSI_NV(1,2),sub,MSI_NV(1,3)\n')
+        self.ansysfd.write('*voper,MSI_T2(1),MSI_T1(1),mult,MSI_T2(1)\n')
+        self.ansysfd.write('*voper,MSI_T2(1),MSI_T2(1),add,MSI_NV(1,3) ! UX or UY, whichever is larger\n')
+        self.ansysfd.write('*voper,MSI_T1(1),MSI_T2(1),lt,0 ! 1 where it is negative\n')
+        self.ansysfd.write('*vfact,-2\n')
+        self.ansysfd.write('*vfun,MSI_T1(1),copy,MSI_T1(1)\n')
+        self.ansysfd.write('*voper,MSI_T1(1),MSI_T1(1),add,1 ! -1 where negative, 1 elsewhere\n')
+        self.ansysfd.write('*voper,MSI_NV(1,5),MSI_NV(1,5),mult,MSI_T1(1)\n')
+
+    #columns of results, these must match ansysinfo.outputtypes keys
+    keylist = ['number', 'UX_o', 'UY_o', 'UZ_o', 'UR_o', 'TEMP_o', 'FX_o', 'FY_o', 'FZ_o']
+
+    def _write_results(self, instance_info_array):
+        """Write APDL that writes the results for each component to the results file of the current instance."""
+        self._write_nodal_values()
+        self._write_results_header(instance_info_array)
+        self._write_components()
+        self._write_results_footer()
+
+    def _write_step_results(self, instance_info_array, post):
+        """Write APDL that writes the results of each of the MSI_NSTEPS load steps of a batch,
+           each after a STEP line, to the numeric results file of the current instance."""
+        self._write_results_header(instance_info_array)
+        self.ansysfd.write('*DO,MSI_K,1,MSI_NSTEPS,1\n')
+        self.ansysfd.write('set,MSI_K\n')
+        for s in post:
+            self.ansysfd.write(s + '\n');
+        self._write_nodal_values()
+        self.ansysfd.write('*VWRITE, MSI_K\n')
+        self.ansysfd.write('STEP %I\n')
+        self._write_components()
+        self.ansysfd.write('*ENDDO\n')
+        self._write_results_footer()
+
+    def _write_results_header(self, instance_info_array):
+        keylist = self.keylist #columns written
+        self.ansysfd.write('*cfopen,' + instance_info_array + '(1,iv,1), ' +
+                           self.results_ext + '\n')
+        if self.results_format == 'numeric':
+            self.ansysfd.write('*vwrite\n')
+            self.ansysfd.write(ansysresults.NUMERIC_MAGIC + '\n')
+            self.ansysfd.write('*vwrite, units\n')
+            self.ansysfd.write('UNITS %I\n')
+            self.ansysfd.write('*vwrite\n')
+            self.ansysfd.write('LABELS ' + ' '.join(keylist) + '\n')
+        else:
             self.ansysfd.write('*vwrite\n')
             self.ansysfd.write('class FeaPropertiesInPythonFormat:\n')
             self.ansysfd.write('*vwrite\n')
             self.ansysfd.write('	def __init__(self):\n')
             self.ansysfd.write('*vwrite\n')
-            keylist = ['number', 'UX_o', 'UY_o', 'UZ_o', 'UR_o', 'TEMP_o', 'FX_o', 'FY_o', 'FZ_o'] #these must match ansysinfo.outputtypes keys
             s = str(keylist)
             self.ansysfd.write('		self.nodeLabels = ' + s + '\n')
             self.ansysfd.write('*vwrite, units\n')
@@ -461,171 +830,962 @@ class ANSYSRunner():
             self.ansysfd.write('		self.coordinateSystem = "Cartesian"\n')
             self.ansysfd.write('*vwrite\n')
             self.ansysfd.write('		self.nodeMap = {\n')
-            self.ansysfd.write('*get,nComps,COMP,,ncomp\n')
-            self.ansysfd.write('*do,J,1,nComps,1\n')
-            self.ansysfd.write('*get,compName,comp,J,name '+
-                               '! get the name of the nth component\n')
-            self.ansysfd.write('*get,nType,comp,compName,type ' +
-                               '! get the type #\n')
-
-            self.ansysfd.write('GETVALS=0\n')
-            self.ansysfd.write('allsel\n')
-            self.ansysfd.write('cmsel,,compName\n')
-            self.ansysfd.write('*IF,nType,EQ,1,THEN !type 1 Nodes\n') 
-            self.ansysfd.write('GETVALS=1\n')
-            #self.ansysfd.write('prnsol,u,comp ' + '!not needed but useful for debugging\n')
-            self.ansysfd.write('*ELSEIF,nType,EQ,6,THEN !type 6 keypoints\n') 
-            self.ansysfd.write('allsel\n')
-            self.ansysfd.write('cmsel,,compName\n')
-            self.ansysfd.write('nslk,S\n')
-            self.ansysfd.write('GETVALS=1\n')
-            self.ansysfd.write('*ELSEIF,nType,EQ,8,THEN !type 8 surfaces\n') 
-            self.ansysfd.write('allsel\n')
-            self.ansysfd.write('cmsel,,compName\n')
-            self.ansysfd.write('nsla,s,1\n')
-            self.ansysfd.write('GETVALS=1\n')
+
+    def _write_components(self):
+        """Write APDL that writes the columns in self.keylist of MSI_NV for the nodes of each component,
+           or of the components of the instance if it has any in MSI_CMPN."""
+        self.ansysfd.write('*get,nComps,COMP,,ncomp\n')
+        if self.subscribed:
+            self.ansysfd.write('*IF,MSI_NCMP(iv),GT,0,THEN\n')
+            self.ansysfd.write('nComps = MSI_NCMP(iv)\n')
+            self.ansysfd.write('*ENDIF\n')
+        self.ansysfd.write('*do,J,1,nComps,1\n')
+        if self.subscribed:
+            self.ansysfd.write('*IF,MSI_NCMP(iv),GT,0,THEN\n')
+            self.ansysfd.write('compName = MSI_CMPN(1,J,iv)\n')
+            self.ansysfd.write('*ELSE\n')
+        self.ansysfd.write('*get,compName,comp,J,name '+
+                           '! get the name of the nth component\n')
+        if self.subscribed:
             self.ansysfd.write('*ENDIF\n')
-            self.ansysfd.write('*IF,GETVALS,EQ,1,THEN !get values\n')
-            self.ansysfd.write('*get,NCOUNT,node,,count ' +
-                               '! Get total number of selected nodes\n')
+        self.ansysfd.write('*get,nType,comp,compName,type ' +
+                           '! get the type #\n')
+
+        self.ansysfd.write('GETVALS=0\n')
+        self.ansysfd.write('allsel\n')
+        self.ansysfd.write('cmsel,,compName\n')
+        self.ansysfd.write('*IF,nType,EQ,1,THEN !type 1 Nodes\n') 
+        self.ansysfd.write('GETVALS=1\n')
+        #self.ansysfd.write('prnsol,u,comp ' + '!not needed but useful for debugging\n')
+        self.ansysfd.write('*ELSEIF,nType,EQ,6,THEN !type 6 keypoints\n') 
+        self.ansysfd.write('allsel\n')
+        self.ansysfd.write('cmsel,,compName\n')
+        self.ansysfd.write('nslk,S\n')
+        self.ansysfd.write('GETVALS=1\n')
+        self.ansysfd.write('*ELSEIF,nType,EQ,8,THEN !type 8 surfaces\n') 
+        self.ansysfd.write('allsel\n')
+        self.ansysfd.write('cmsel,,compName\n')
+        self.ansysfd.write('nsla,s,1\n')
+        self.ansysfd.write('GETVALS=1\n')
+        self.ansysfd.write('*ENDIF\n')
+        self.ansysfd.write('*IF,GETVALS,EQ,1,THEN !get values\n')
+        self.ansysfd.write('*get,NCOUNT,node,,count ' +
+                           '! Get total number of selected nodes\n')
+        if self.results_format == 'numeric':
+            self.ansysfd.write('*VWRITE, compName, NCOUNT\n')
+            self.ansysfd.write('COMPONENT %s %I\n')
+        else:
             self.ansysfd.write('*VWRITE, compName\n')
             self.ansysfd.write('			"%s":\n')
             self.ansysfd.write('*vwrite\n')
             self.ansysfd.write('			[\n')
-            self.ansysfd.write('*dim,NARRAY,array,NCOUNT,9 ' +
-                               '! Create NCOUNT x 9 array\n')
-            #self.ansysfd.write('*vwrite ! Writes a column header\n')
-            #self.ansysfd.write('NODE UX UY UZ TEMP FX FY FZ\n')
-            self.ansysfd.write('*vget,NARRAY(1,1),node,1,nlist ' +
-                               '! Fill first column with node number\n')
-            self.ansysfd.write('*DO,I,1,NCOUNT,1 !loop on nodes\n')
-            self.ansysfd.write('N = NARRAY(I,1)\n')
-            self.ansysfd.write('NARRAY(I,2) = UX(N) ' +
-                               '! Fill second column with x-displ\n')
-            self.ansysfd.write('NARRAY(I,3) = UY(N) ' +
-                               '! Fill third column with y-displ\n')
-            self.ansysfd.write('NARRAY(I,4) = UZ(N) ' +
-                               '! Fill fourth column with z-displ\n')
-            self.ansysfd.write('!We need radial displacement as a signed value\n')
-            self.ansysfd.write('rdisp = sqrt(UX(N)**2 + UY(N)**2)\n')
-            self.ansysfd.write('*IF,abs(UX(N)), GT, abs(UY(N)), THEN\n')
-            self.ansysfd.write('    rdisp = sign(rdisp, UX(N))\n')
-            self.ansysfd.write('*else\n')
-            self.ansysfd.write('    rdisp = sign(rdisp, UY(N))\n')
-            self.ansysfd.write('*endif \n')
-            self.ansysfd.write('NARRAY(I,5) = rdisp\n')
-            self.ansysfd.write('NARRAY(I,6) = TEMP(N) ' +
-                               '! Fill sixth column with TEMP\n')
-            self.ansysfd.write('*GET, NARRAY(I,7), NODE, N, RF, FX' +
-                               '! Fill seventh column with X Reaction Load\n')
-            self.ansysfd.write('*GET, NARRAY(I,8), NODE, N, RF, FY ' +
-                               '! Fill eighth column with Y Reaction Load\n')
-            self.ansysfd.write('*GET, NARRAY(I,9), NODE, N, RF, FZ ' +
-                               '! Fill ninth column with Z Reaction Load\n')
-            self.ansysfd.write('*ENDDO\n')
-            self.ansysfd.write('*vwrite,' +
-                               'NARRAY(1,1),NARRAY(1,2),NARRAY(1,3),NARRAY(1,4),' +
-                               'NARRAY(1,5),NARRAY(1,6),NARRAY(1,7),NARRAY(1,8), NARRAY(1,9)  ' +
-                               '! Write columns to file\n')
-            self.ansysfd.write('			[%I, %G, %G, %G, %G, %G, %G, %G, %G,],\n')
+        self.ansysfd.write('*IF,NCOUNT,GT,0,THEN\n')
+        ncols = len(self.keylist)
+        self.ansysfd.write('*del,NARRAY,,nopr\n')
+        self.ansysfd.write('*dim,NARRAY,array,NCOUNT,' + str(ncols) + ' ' +
+                           '! Create NCOUNT x ' + str(ncols) + ' array\n')
+        self.ansysfd.write('*vget,MSI_SEL(1),node,1,nsel ' +
+                           '! 1 for selected nodes\n')
+        for k, key in enumerate(self.keylist):
+            self.ansysfd.write('*vmask,MSI_SEL(1)\n')
+            self.ansysfd.write('*vfun,NARRAY(1,' + str(k + 1) + '),comp,MSI_NV(1,' +
+                               str(ANSYSRunner.keylist.index(key) + 1) + ') ' +
+                               '! Fill column with the ' + key + ' of the selected nodes\n')
+        self.ansysfd.write('*vwrite,' +
+                           ','.join('NARRAY(1,' + str(k + 1) + ')' for k in range(ncols)) + '  ' +
+                           '! Write columns to file\n')
+        if self.results_format == 'numeric':
+            self.ansysfd.write(ansysresults.numeric_row_format(ncols) + '\n')
+        else:
+            self.ansysfd.write('			[%I' + ', %G' * (ncols - 1) + ',],\n')
+        self.ansysfd.write('*ENDIF\n')
+        if self.results_format != 'numeric':
             self.ansysfd.write('*vwrite\n')
             self.ansysfd.write('			],\n')
 
-            self.ansysfd.write('*ENDIF\n')
-            self.ansysfd.write('*enddo\n')
+        self.ansysfd.write('*ENDIF\n')
+        self.ansysfd.write('*enddo\n')
+
+    def _write_results_footer(self):
+        if self.results_format == 'numeric':
+            self.ansysfd.write('*vwrite\n')
+            self.ansysfd.write('END\n')
+        else:
             self.ansysfd.write('*vwrite	\n')
             self.ansysfd.write('			}\n') 
-            self.ansysfd.write('*cfclose\n')
-            self.ansysfd.write('finish\n')
-            #self.ansysfd.write('/COM, Signal ANSYSRunner that ANSYS is ready\n')
-            #self.ansysfd.write('/SYS,WAITFOR /S ' + self.hostname +
-                #' /SI ' + self.from_ansys_signal + '\n')
+        self.ansysfd.write('*cfclose\n')
 
-            self.ansysfd.write('*ENDIF\n')
-            self.ansysfd.write('*ENDDO\n')
-            #self.ansysfd.write('exit\n')
-            self.ansysfd.close()
-            self._start_ansys(timeout = timeout, productvar = productvar)
-        self.ansys_inited = True
-        self.logger.debug('ansys_inited done')
-        print 'ansys_inited done'
-
-    def run(self, instancename, prep7=[], solution=[], post=[]):
-        """Run instancename.  Assumes input file has been written."""
+    def _check_run(self, instancename, prep7, solution, post):
+        """Check instancename can be run, starting ANSYS if needed."""
         if not self.ok:
-            print 'ERROR: in AnsysRunner.\n' + self.dump()
-            self.logger.warning('ERROR: in AnsysRunner.\n' + self.dump())
+            self.events.warning('runner_error', 'ERROR: in AnsysRunner.\n%s', ansysevents.lazy(self.dump),
+                                runner = self.name, instance = instancename)
+            return False
+        if self.current != None and not self.current.done():
+            self.events.warning('runner_busy', 'ERROR: AnsysRunner %s is still running %s, cannot run %s',
+                                self.name, self.current.name, instancename, runner = self.name, instance = instancename)
             return False
         if not instancename in self.ansys_instances:
-            print 'ERROR: ' + instancename + ' not in ansys_instances.\n' + \
-                  self.dump()
-            self.logger.warning('ERROR: ' + instancename +
-                                ' not in ansys_instances.\n' + self.dump())
+            self.events.warning('runner_error', 'ERROR: %s not in ansys_instances.\n%s', instancename,
+                                ansysevents.lazy(self.dump), runner = self.name, instance = instancename)
             return False
         if not self.ansys_inited:
-            print 'Calling init_ansys from run'
+            self.events.info('init_ansys', 'Calling init_ansys from run', runner = self.name)
             self.init_ansys(prep7, solution, post)
             if not self.ok:
-                print 'ERROR: in AnsysRunner init_ansys.\n' + self.dump()
-                self.logger.warning('ERROR: in AnsysRunner  init_ansys.\n' +
-                                    self.dump())
+                self.events.warning('runner_error', 'ERROR: in AnsysRunner init_ansys.\n%s', ansysevents.lazy(self.dump),
+                                    runner = self.name)
                 return False
+        return True
+
+    def run(self, instancename, prep7=[], solution=[], post=[]):
+        """Run instancename.  Assumes input file has been written."""
+        with self.lock:
+            return self._run_instance(instancename, prep7, solution, post)
+
+    def _run_instance(self, instancename, prep7=[], solution=[], post=[]):
+        if not self._check_run(instancename, prep7, solution, post):
+            return False
+        instance = self.ansys_instances[instancename]
+        self.events.debug('run', 'AnsysRunner start run %s', ansysevents.lazy(instance.dump),
+                          runner = self.name, instance = instancename)
+        loads, resident = self._resident_loads(instancename)
+        fname = self.instancefile_basename + '.' + self.instancefile_ext
+        with self.metrics.span('run', runner = self.name, instance = instancename):
+            self._send_index_to_ansys(instance.index, fname, 0, resident)
+        self.events.debug('run_done', 'AnsysRunner after _send_index_to_ansys, ok %s resident %s', self.ok, resident,
+                          runner = self.name, instance = instancename)
+        self._count_run(instancename)
+        if self.ok and loads != None:
+            self.resident_instance = instancename
+            self.resident_loads = loads
+        return self.ok
+
+    def _count_run(self, instancename):
+        if self.ok:
+            self.metrics.count('runs', runner = self.name, instance = instancename)
+            self._read_phase_times(instancename)
+        else:
+            self.metrics.count('failures', runner = self.name, instance = instancename)
+
+    def _resident_loads(self, instancename):
+        """Return the (command, undo command) of each load of instancename, from <name>.dlt (None if there is no such
+           file or the runner is not resident), and 1 if ANSYS is to change the loads of the resident model instead of
+           resuming the db, else 0.  Then <name>.und removes the resident loads that changed and <name>.dif applies
+           the new ones."""
+        loads = None
+        resident = 0
+        if self.resident:
+            lines = self._read_lines(instancename + '.dlt')
+            if lines != None:
+                loads = [tuple(line.split('\t', 1)) for line in lines]
+            if loads != None and self.resident_instance == instancename:
+                applied = set(command for command, undo in loads)
+                kept = set(command for command, undo in self.resident_loads)
+                resident = self._write_lines(instancename + '.und',
+                                             [undo for command, undo in self.resident_loads if command not in applied])
+                if resident:
+                    delta = [command for command, undo in loads if command not in kept]
+                    resident = self._write_lines(instancename + '.dif', delta)
+                    self.metrics.count('loads_kept', len(applied) - len(delta), runner = self.name, instance = instancename)
+        self.resident_instance = None
+        return loads, resident
+
+    def start(self, instancename, prep7=[], solution=[], post=[], timeout = None):
+        """Start running instancename without blocking.  Assumes input file has been written.
+           Returns an ANSYSRun, which fails if it is not done within timeout seconds (default self.timeout).
+           The runner runs one instance at a time: run, run_batch and start fail until the run is done."""
+        with self.lock:
+            return self._start(instancename, prep7, solution, post, timeout)
+
+    def _start(self, instancename, prep7=[], solution=[], post=[], timeout = None):
+        run = ANSYSRun(instancename)
+        if not self._check_run(instancename, prep7, solution, post):
+            run._finish(False)
+            return run
+        instance = self.ansys_instances[instancename]
+        self.events.debug('start', 'AnsysRunner start %s', instancename, runner = self.name, instance = instancename)
+        loads, resident = self._resident_loads(instancename)
+        fname = os.path.join(self.workingdir, self.instancefile_basename + '.' + self.instancefile_ext)
+        try:
+            f = open(fname, 'w')
+            f.write('%10d%10d%10d\n' % (instance.index, 0, resident))
+            f.close()
+        except IOError as ioe:
+            self.events.warning('runner_error', 'Error trying to create file %s\n%s', fname, ioe,
+                                runner = self.name, instance = instancename)
+            self.ok = False
+            run._finish(False)
+            return run
+        self._signal_ansys()
+        if self.ok:
+            try:
+                self.handshake.start_wait()
+            except (IOError, OSError) as e:
+                self.events.warning('wait_error', 'Error waiting for ansys %s\n%s', self.handshake.dump(), e,
+                                    runner = self.name, instance = instancename)
+                self.ok = False
+        if not self.ok:
+            run._finish(False)
+            return run
+        if timeout == None:
+            timeout = self.timeout
+        run.deadline = time.time() + float(timeout)
+        run.owner = self
+        run.loads = loads
+        run.started = ansysmetrics.clock()
+        self.current = run
+        return run
+
+    def _poll_run(self, run):
+        if run is not self.current:
+            return
+        try:
+            ready = self.handshake.ready()
+        except (IOError, OSError) as e:
+            self.events.warning('wait_error', 'Error wait for ansys %s\n%s', self.handshake.dump(), e,
+                                runner = self.name, instance = run.name)
+            self.ok = False
+            ready = False
+        if ready:
+            self.current = None
+            if run.loads != None:
+                self.resident_instance = run.name
+                self.resident_loads = run.loads
+            self.events.debug('run_done', 'AnsysRunner %s done %s', self.name, run.name, runner = self.name, instance = run.name)
+            self.metrics.add_span('run', ansysmetrics.clock() - run.started, runner = self.name, instance = run.name)
+            self._count_run(run.name)
+            run._finish(True)
+        elif not self.ok or not self._ansys_alive():
+            self._check_if_ansys_done()
+            self.current = None
+            self._count_run(run.name)
+            run._finish(False)
+        elif time.time() > run.deadline:
+            self.events.warning('wait_timeout', 'AnsysRunner %s: no signal from ANSYS for %s by its deadline',
+                                self.name, run.name, runner = self.name, instance = run.name)
+            run.cancel()
+
+    def _fileno_run(self, run):
+        if run is not self.current:
+            return None
+        return self.handshake.fileno()
+
+    def _cancel_run(self, run):
+        if run is not self.current:
+            return
+        self.events.warning('cancelled', 'AnsysRunner %s cancelled %s', self.name, run.name, runner = self.name, instance = run.name)
+        self.handshake.abandon()
+        self.current = None
+        self.resident_instance = None #the loads in ANSYS are not known
+
+    def _read_lines(self, fname):
+        """Return the lines of fname in workingdir, or None if there is no such file."""
+        fname = os.path.join(self.workingdir, fname)
+        if not os.path.exists(fname):
+            return None
+        f = open(fname, 'r')
+        try:
+            return [line.rstrip('\n') for line in f]
+        finally:
+            f.close()
+
+    def _write_lines(self, fname, lines):
+        """Write lines to fname in workingdir.  Returns 1 if written, 0 if not."""
+        try:
+            f = open(os.path.join(self.workingdir, fname), 'w')
+            try:
+                for line in lines:
+                    f.write(line + '\n')
+            finally:
+                f.close()
+            return 1
+        except IOError as ioe:
+            self.events.warning('runner_error', 'Error trying to write %s\n%s', fname, ioe, runner = self.name)
+            return 0
+
+    def step_ext(self, k):
+        """Extension of the file of load step k (from 1) of a batch."""
+        return 's%02d' % k
+
+    def run_batch(self, instancename, steps, prep7=[], solution=[], post=[]):
+        """Solve instancename once for each load step in steps, resuming its db only once.
+           Assumes input file has been written: it is read before the first step.
+           steps is a list of at most max_batch lists of APDL commands; each is applied on top of
+           the loads of the step before, then the solution file is read.  Needs results_format 'numeric':
+           the results file holds the results of every step (see ansysresults.read_numeric_steps)."""
+        with self.lock:
+            return self._run_batch(instancename, steps, prep7, solution, post)
+
+    def _run_batch(self, instancename, steps, prep7=[], solution=[], post=[]):
+        if self.results_format != 'numeric':
+            self.events.warning('runner_error', 'ERROR: AnsysRunner %s run_batch needs results_format numeric', self.name,
+                                runner = self.name, instance = instancename)
+            return False
+        if not steps or len(steps) > self.max_batch:
+            self.events.warning('runner_error', 'ERROR: AnsysRunner %s run_batch needs 1 to %s load steps, not %s',
+                                self.name, self.max_batch, len(steps), runner = self.name, instance = instancename)
+            return False
+        if not self._check_run(instancename, prep7, solution, post):
+            return False
         instance = self.ansys_instances[instancename]
-        if self.logger.isEnabledFor(logging.DEBUG): print 'Running instance ' + instance.dump()
-        self.logger.debug('AnsysRunner start run ' + instancename)
+        try:
+            for k, step in enumerate(steps):
+                f = open(os.path.join(self.workingdir, instancename + '.' + self.step_ext(k + 1)), 'w')
+                try:
+                    for line in step:
+                        f.write(line + '\n')
+                finally:
+                    f.close()
+        except IOError as ioe:
+            self.events.warning('runner_error', 'Error writing load step files of %s\n%s', instancename, ioe,
+                                runner = self.name, instance = instancename)
+            return False
+        self.events.debug('run', 'AnsysRunner start run_batch %s of %s load steps', instancename, len(steps),
+                          runner = self.name, instance = instancename)
+        self.resident_instance = None #the loads of the steps are not known
         fname = self.instancefile_basename + '.' + self.instancefile_ext
-        self._send_index_to_ansys(instance.index, fname)
-        self.logger.debug('AnsysRunner after _send_index_to_ansys, ok ' + str(self.ok))
+        with self.metrics.span('run', runner = self.name, instance = instancename, steps = len(steps)):
+            self._send_index_to_ansys(instance.index, fname, len(steps))
+        self.events.debug('run_done', 'AnsysRunner after _send_index_to_ansys, ok %s', self.ok,
+                          runner = self.name, instance = instancename)
+        self._count_run(instancename)
         return self.ok
 
+    def pipeline(self, depth = 2):
+        """Return an ANSYSPipeline that solves design points on this runner."""
+        return ANSYSPipeline(self, depth)
+
     def shutdown(self):
-        if self.ansys_inited:
-            if self.logger.isEnabledFor(logging.DEBUG): print 'Shutting down'
-            self.logger.debug('AnsysRunner shutting down')
-            fname = self.instancefile_basename + '.' + self.instancefile_ext
-            self._send_index_to_ansys(-1, fname)
-            self.ansys_inited = False
+        with self.lock:
+            if self.current != None:
+                self.current.cancel()
+            if self.ansys_inited:
+                self.events.debug('shutdown', 'AnsysRunner shutting down', runner = self.name)
+                fname = self.instancefile_basename + '.' + self.instancefile_ext
+                self._send_index_to_ansys(-1, fname)
+                self._wait_for_exit(min(float(self.timeout), 30.0))
+                self.ansys_inited = False
+            if getattr(self, 'handshake', None) != None:
+                self.handshake.cleanup()
+
+    def _wait_for_exit(self, timeout):
+        """Wait up to timeout seconds for ANSYS to exit, so that it has seen the signal to stop before the
+           handshake is cleaned up."""
+        if self.run_under_wing or getattr(self, 'ansys_po', None) == None:
+            return
+        deadline = time.time() + timeout
+        while self.ansys_po.poll() == None and time.time() < deadline:
+            time.sleep(0.01)
 
     def __del__(self):
         #TO_CHECK:  this doesn't seem to get called....
-        print 'DELETING AnsysRunner'
+        self.events.debug('deleted', 'DELETING AnsysRunner', runner = getattr(self, 'name', None))
         self.shutdown()
 
+class ANSYSRunnerPool():
+    """Runs ANSYS Classical Structural in several processes at once, so that independent instances can be solved in parallel.
+       Each process is run by its own ANSYSRunner, with its own working subdirectory, control script and signals.
+       It can be passed to the constructor of ANSYSWrapperBase in place of an ANSYSRunner: wrappers write their input
+       files to workingdir, and run() copies them to an idle process and moves the results back when it is done.
+       With nworkers = 1 the single ANSYSRunner runs directly in workingdir, exactly as a plain ANSYSRunner would.
+       When finished, the user MUST call shutdown() - it is a good idea to put the call to shutdown in a finally clause.
+
+       *Parameters*
+
+           name: string
+               Name used to identify the ANSYSRunnerPool. Each process appends W<n> to it, so keep it < 17 characters.
+
+            workingdir: string
+                Full path to directory in which wrappers write their files.  Each process runs ANSYS in a subdirectory.
+
+            nworkers: integer (optional)
+                Number of ANSYS processes to run.  Default 1.
+
+            timeout, ANSYS_VER, run_under_wing, logger_name, handshake, results_format, resident, metrics, quiet:
+                As for ANSYSRunner.
+
+       """
+    def __init__(self, name, workingdir, nworkers = 1, timeout = '1000', ANSYS_VER = "ANSYS145", run_under_wing = False, logger_name = None,
+                 handshake = None, results_format = 'python', resident = False, metrics = None, quiet = False):
+        if logger_name == None:
+            self.logger = logging.getLogger("MSI")
+        else:
+            self.logger = logging.getLogger(logger_name)
+        self.events = ansysevents.EventLog(self.logger, quiet)
+        if metrics == None:
+            metrics = ansysmetrics.NULL
+        self.metrics = metrics
+        self.name = name.replace(' ', '')
+        self.workingdir = workingdir
+        self.nworkers = max(1, int(nworkers))
+        self.results_format = results_format
+        self.results_ext = ansysresults.extensions[results_format]
+        self.resident = resident
+        self.ansys_inited = False
+        self.ok = True
+        self.workers = []
+        self.idle = Queue.Queue()
+        self.init_lock = threading.Lock()
+        self.lock = threading.RLock() #guards pending
+        self.max_batch = 99
+        self.input_exts = ['inp', 'sol', 'dlt']
+        self.pending = collections.deque() #ANSYSRun started by start() waiting for an idle process
+        for i in range(self.nworkers):
+            if self.nworkers == 1:
+                wname = self.name
+                wdir = self.workingdir
+            else:
+                wname = self.name + 'W' + str(i)
+                wdir = os.path.join(self.workingdir, wname)
+            worker = ANSYSRunner(wname, wdir, timeout, ANSYS_VER, run_under_wing, logger_name, handshake, results_format,
+                                 resident, metrics, quiet)
+            worker.local_db = self.nworkers > 1
+            if not worker.ok:
+                self.ok = False
+            self.workers.append(worker)
+            self.idle.put(worker)
+
+    def add_instance(self, name, dbfile, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33],
+                     outputs = None):
+        """Add an instance to be solved by every process in the pool."""
+        index = -1
+        for worker in self.workers:
+            index = worker.add_instance(name, dbfile, cdbfile, elasticity, poisson, outputs)
+            if not worker.ok:
+                self.ok = False
+        return index
+
+    def dump(self):
+        s = 'ANSYSRunnerPool ' + self.name + ' nworkers ' + str(self.nworkers)
+        if not self.ok:
+            s = s + ' NOT OK'
+        s = s + '\nworkingdir ' + self.workingdir
+        for worker in self.workers:
+            s = s + '\n' + worker.dump()
+        return s
+
+    def init_ansys(self, prep7=[], solution=[], post=[], productvar = None, timeout = 10):
+        """Start every ANSYS process in the pool.  This method should be called AFTER all instances have been added."""
+        with self.init_lock:
+            if self.ansys_inited:
+                return
+            threads = []
+            for worker in self.workers:
+                t = threading.Thread(target = worker.init_ansys,
+                                     args = (prep7, solution, post, productvar, timeout))
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+            for worker in self.workers:
+                if not worker.ok:
+                    self.ok = False
+            self.ansys_inited = True
+        self.events.info('ansys_inited', 'ANSYSRunnerPool %s ansys_inited done', self.name, runner = self.name)
+
+    def _copy_files(self, fromdir, todir, basename, exts, move = False):
+        for ext in exts:
+            src = os.path.join(fromdir, basename + '.' + ext)
+            dst = os.path.join(todir, basename + '.' + ext)
+            if not os.path.exists(src):
+                if not move and os.path.exists(dst):
+                    os.remove(dst) #do not leave an old input behind
+                continue
+            if move:
+                if os.path.exists(dst):
+                    os.remove(dst)
+                shutil.move(src, dst)
+            else:
+                shutil.copyfile(src, dst)
+
+    def run(self, instancename, prep7=[], solution=[], post=[]):
+        """Run instancename on the next idle process, blocking until it is done.  Assumes input files have been written.
+           May be called from several threads at once, as long as each thread runs a different instance."""
+        return self._run(instancename, None, prep7, solution, post)
+
+    def run_batch(self, instancename, steps, prep7=[], solution=[], post=[]):
+        """As ANSYSRunner.run_batch, on the next idle process."""
+        return self._run(instancename, steps, prep7, solution, post)
+
+    def _run(self, instancename, steps, prep7, solution, post):
+        if not self.ok:
+            self.events.warning('runner_error', 'ERROR: in AnsysRunnerPool.\n%s', ansysevents.lazy(self.dump),
+                                runner = self.name, instance = instancename)
+            return False
+        if not self.ansys_inited:
+            self.init_ansys(prep7, solution, post)
+        worker = self.idle.get()
+        try:
+            local = worker.workingdir != self.workingdir
+            try:
+                if local:
+                    self._copy_files(self.workingdir, worker.workingdir, instancename, worker.input_exts)
+                if steps == None:
+                    ok = worker.run(instancename, prep7, solution, post)
+                else:
+                    ok = worker.run_batch(instancename, steps, prep7, solution, post)
+                if ok and local:
+                    self._copy_files(worker.workingdir, self.workingdir, instancename,
+                                     [worker.results_ext], move = True)
+            except (IOError, OSError) as e:
+                self.events.warning('pool_error', 'ANSYSRunnerPool %s error moving files of %s for %s\n%s',
+                                    self.name, instancename, worker.name, e, runner = self.name, instance = instancename)
+                ok = False
+            return ok
+        finally:
+            self.idle.put(worker)
+
+    def start(self, instancename, prep7=[], solution=[], post=[], timeout = None):
+        """As ANSYSRunner.start, on the next idle process.  If every process is busy the run waits for one,
+           and starts when a run before it is found to be done.  The timeout includes the time waiting."""
+        if timeout == None:
+            timeout = self.workers[0].timeout
+        run = ANSYSRun(instancename, time.time() + float(timeout))
+        if not self.ok:
+            self.events.warning('runner_error', 'ERROR: in AnsysRunnerPool.\n%s', ansysevents.lazy(self.dump),
+                                runner = self.name, instance = instancename)
+            run._finish(False)
+            return run
+        if not self.ansys_inited:
+            self.init_ansys(prep7, solution, post)
+        run.owner = self
+        run.args = (prep7, solution, post)
+        run.inner = None #ANSYSRun of the process, once started
+        with self.lock:
+            self.pending.append(run)
+            self.metrics.gauge('queue_depth', len(self.pending), runner = self.name)
+        self._dispatch()
+        return run
+
+    def _dispatch(self):
+        """Start pending runs on idle processes."""
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                try:
+                    worker = self.idle.get_nowait()
+                except Queue.Empty:
+                    return
+                pool_run = self.pending.popleft()
+            instancename = pool_run.name
+            local = worker.workingdir != self.workingdir
+            try:
+                if local:
+                    self._copy_files(self.workingdir, worker.workingdir, instancename, worker.input_exts)
+            except (IOError, OSError) as e:
+                self.events.warning('pool_error', 'ANSYSRunnerPool %s error copying files of %s for %s\n%s',
+                                    self.name, instancename, worker.name, e, runner = self.name, instance = instancename)
+                self.idle.put(worker)
+                pool_run._finish(False)
+                continue
+            prep7, solution, post = pool_run.args
+            run = worker.start(instancename, prep7, solution, post, max(0, pool_run.deadline - time.time()))
+            pool_run.inner = run
+            run.add_done_callback(lambda run, worker = worker, pool_run = pool_run: self._finish_run(worker, run, pool_run))
+
+    def _finish_run(self, worker, run, pool_run):
+        ok = run.ok
+        if ok and worker.workingdir != self.workingdir:
+            try:
+                self._copy_files(worker.workingdir, self.workingdir, pool_run.name, [worker.results_ext], move = True)
+            except (IOError, OSError) as e:
+                self.events.warning('pool_error', 'ANSYSRunnerPool %s error moving files of %s for %s\n%s',
+                                    self.name, pool_run.name, worker.name, e, runner = self.name, instance = pool_run.name)
+                ok = False
+        self.idle.put(worker)
+        pool_run._finish(ok)
+        self._dispatch()
+
+    def _poll_run(self, run):
+        if run.inner != None:
+            run.inner.poll()
+            return
+        #waiting for an idle process: the runs that hold the processes may be done
+        for worker in self.workers:
+            if worker.current != None:
+                worker.current.poll()
+        if run.ok == None and run.inner == None and time.time() > run.deadline:
+            self.events.warning('wait_timeout', 'ANSYSRunnerPool %s: %s did not start by its deadline', self.name, run.name,
+                                runner = self.name, instance = run.name)
+            run.cancel()
+
+    def _fileno_run(self, run):
+        if run.inner != None:
+            return run.inner.fileno()
+        return None
+
+    def _cancel_run(self, run):
+        if run.inner != None:
+            run.inner.cancel()
+        else:
+            with self.lock:
+                if run in self.pending:
+                    self.pending.remove(run)
+
+    def run_unordered(self, instancenames, prep7=[], solution=[], post=[]):
+        """Run each of instancenames, yielding (instancename, ok) in the order the runs finish."""
+        jobs = Queue.Queue()
+        for instancename in instancenames:
+            jobs.put(instancename)
+        results = Queue.Queue()
+        def dispatch():
+            while True:
+                try:
+                    instancename = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    ok = self.run(instancename, prep7, solution, post)
+                except:
+                    self.events.warning('pool_error', 'ANSYSRunnerPool %s exception running %s\n%s', self.name,
+                                        instancename, sys.exc_info()[0], runner = self.name, instance = instancename)
+                    ok = False
+                results.put((instancename, ok))
+        if not self.ansys_inited:
+            self.init_ansys(prep7, solution, post)
+        for i in range(min(self.nworkers, len(instancenames))):
+            t = threading.Thread(target = dispatch)
+            t.daemon = True
+            t.start()
+        for i in range(len(instancenames)):
+            yield results.get()
+
+    def pipeline(self, depth = 2):
+        """Return an ANSYSPipeline that solves design points on the processes of this pool."""
+        return ANSYSPipeline(self, depth)
+
+    def shutdown(self):
+        while self.pending:
+            self.pending[0].cancel()
+        for worker in self.workers:
+            worker.shutdown()
+        self.ansys_inited = False
+
+class ANSYSPipelineJob(object):
+    """A design point submitted to an ANSYSPipeline.  ok is None until its outputs have been read,
+       then True, or False if it failed."""
+    def __init__(self, wrapper, key, seq):
+        self.wrapper = wrapper
+        self.key = key      #cache key of the inputs
+        self.seq = seq      #suffix of its staged input and results files
+        self.ok = None
+        self.outputs = None #tuple of dictionaries of output name to value
+        self.results = None #results file, moved aside so the next run of the wrapper does not overwrite it
+        self.event = threading.Event()
+
+    def _finish(self, ok, outputs = None):
+        self.ok = ok
+        self.outputs = outputs
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout = None):
+        """Block until the outputs have been read, or timeout seconds have passed.
+           Returns the outputs, or None if the job failed or is not done."""
+        self.event.wait(timeout)
+        return self.outputs
+
+    def apply(self):
+        """Set the outputs of the wrapper to those of the job, which must be done.  Returns ok."""
+        if self.ok:
+            for o in self.outputs:
+                for k, v in o.iteritems():
+                    self.wrapper.__setattr__(k, v)
+        return bool(self.ok)
+
+class _Wakeup(object):
+    """Looks to wait_runs like a run, done once set() is called, so that another thread can end a wait.
+       On posix its fileno() is a pipe, so the wait ends at once; elsewhere it is polled."""
+    deadline = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.isset = False
+        self.fds = None
+        if os.name == 'posix':
+            self.fds = os.pipe()
+
+    def set(self):
+        with self.lock:
+            if not self.isset:
+                self.isset = True
+                if self.fds != None:
+                    os.write(self.fds[1], 'x')
+
+    def clear(self):
+        with self.lock:
+            if self.isset:
+                self.isset = False
+                if self.fds != None:
+                    os.read(self.fds[0], 1)
+
+    def poll(self):
+        if self.isset:
+            return True
+        return None
+
+    def fileno(self):
+        if self.fds != None:
+            return self.fds[0]
+        return None
+
+    def close(self):
+        if self.fds != None:
+            for fd in self.fds:
+                os.close(fd)
+            self.fds = None
+
+class ANSYSPipeline(object):
+    """Solves a stream of design points on an ANSYSRunner or ANSYSRunnerPool, overlapping the work of Python with
+       the solves of ANSYS.  Create it with runner.pipeline(); call close() when finished.
+       Each job goes through four stages:
+
+           submit (the caller's thread)
+               Computes the loads, looks them up in the wrapper's cache and writes the input files, staged under
+               <file>.<seq> so that they do not disturb the run in progress.  Blocks while depth jobs are waiting.
+
+           solve (a background thread)
+               Moves the staged files of the next job into place and starts it the moment ANSYS signals the run
+               before it is done; then moves the results file aside to <file>.<seq>.
+
+           parse (a background thread)
+               Reads the results file and computes the outputs, without setting them: call job.apply().
+
+           cache (a background thread)
+               Writes the outputs to the wrapper's cache.
+
+       *Parameters*
+
+           runner: ANSYSRunner or ANSYSRunnerPool
+               Runs ANSYS.  A pool keeps every process busy.
+
+           depth: integer (optional)
+               Largest number of jobs staged and waiting for ANSYS.  Default 2.
+    """
+    def __init__(self, runner, depth = 2):
+        self.runner = runner
+        self.logger = runner.logger
+        self.events = runner.events
+        self.slots = getattr(runner, 'nworkers', 1) #runs in flight at once
+        self.seq = itertools.count(1)
+        self.jobs = Queue.Queue(max(1, depth))
+        self.parsed = Queue.Queue()
+        self.cached = Queue.Queue()
+        self.wakeup = _Wakeup() #set by submit, so that a job submitted while runs are in flight starts at once
+        self.threads = []
+        for target in (self._solve, self._parse, self._cache):
+            t = threading.Thread(target = target)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, wrapper):
+        """Submit the current inputs of wrapper.  Returns an ANSYSPipelineJob, which is already done
+           if the inputs were found in the cache."""
+        inputs = wrapper.extra_inputs()
+        loads = wrapper.input_loads()
+        key = wrapper.cache_key(loads, inputs)
+        job = ANSYSPipelineJob(wrapper, key, str(self.seq.next()))
+        if not (wrapper.ok and self.runner.ok):
+            job._finish(False)
+            return job
+        outputs = wrapper.cache.get(key)
+        if outputs != None:
+            wrapper.metrics.count('cache_hits', instance = wrapper.my_name)
+            job._finish(True, outputs)
+            return job
+        wrapper.metrics.count('cache_misses', instance = wrapper.my_name)
+        base = os.path.join(self.runner.workingdir, wrapper.my_name)
+        try:
+            f = open(base + '.inp.' + job.seq, 'w')
+            try:
+                wrapper._write_loads(f, inputs, loads)
+            finally:
+                f.close()
+            f = open(base + '.sol.' + job.seq, 'w')
+            try:
+                for line in wrapper.solution():
+                    f.write(line + '\n')
+            finally:
+                f.close()
+            wrapper._write_undo(inputs, loads, base + '.dlt.' + job.seq)
+        except IOError as ioe:
+            self.events.warning('pipeline_error', 'ANSYSPipeline error staging input files of %s\n%s', wrapper.my_name, ioe,
+                                instance = wrapper.my_name)
+            job._finish(False)
+            return job
+        self.jobs.put(job)
+        self.wakeup.set()
+        self.runner.metrics.gauge('pipeline_depth', self.jobs.qsize(), runner = self.runner.name)
+        return job
+
+    def close(self):
+        """Finish the jobs submitted, then stop the background threads."""
+        if self.threads:
+            self.jobs.put(None)
+            self.wakeup.set()
+            for t in self.threads:
+                t.join()
+            self.threads = []
+            self.wakeup.close()
+
+    def _start(self, job):
+        """Move the staged files of job into place and start its run."""
+        wrapper = job.wrapper
+        base = os.path.join(self.runner.workingdir, wrapper.my_name)
+        for ext in self.runner.input_exts:
+            staged = base + '.' + ext + '.' + job.seq
+            fname = base + '.' + ext
+            if os.path.exists(fname):
+                os.remove(fname)
+            if os.path.exists(staged):
+                os.rename(staged, fname)
+        run = self.runner.start(wrapper.my_name, wrapper.prep7(), wrapper.solution(), wrapper.post())
+        run.add_done_callback(lambda run: self._finished(job, run))
+        return run
+
+    def _finished(self, job, run):
+        if run.ok:
+            fname = os.path.join(self.runner.workingdir, job.wrapper.my_name + '.' + self.runner.results_ext)
+            job.results = fname + '.' + job.seq
+            try:
+                os.rename(fname, job.results)
+            except OSError as oe:
+                self.events.warning('pipeline_error', 'ANSYSPipeline error moving %s\n%s', fname, oe,
+                                    instance = job.wrapper.my_name)
+                job.results = None
+        else:
+            self.events.warning('run_failed', 'ANSYSPipeline %s not ok after run', job.wrapper.my_name,
+                                instance = job.wrapper.my_name)
+        self.parsed.put(job)
+
+    def _solve(self):
+        running = []
+        stopping = False
+        while running or not stopping:
+            self.wakeup.clear()
+            while not stopping and len(running) < self.slots:
+                try:
+                    job = self.jobs.get(not running)
+                except Queue.Empty:
+                    break
+                if job == None:
+                    stopping = True
+                    break
+                try:
+                    running.append(self._start(job))
+                except (IOError, OSError) as e:
+                    self.events.warning('pipeline_error', 'ANSYSPipeline error starting %s\n%s', job.wrapper.my_name, e,
+                                        instance = job.wrapper.my_name)
+                    self.parsed.put(job)
+            if running:
+                waiting = running
+                if not stopping and len(running) < self.slots:
+                    waiting = running + [self.wakeup] #a worker is free: also wait for the next job
+                for run in wait_runs(waiting):
+                    if run is not self.wakeup:
+                        running.remove(run)
+        self.parsed.put(None)
+
+    def _parse(self):
+        while True:
+            job = self.parsed.get()
+            if job == None:
+                self.cached.put(None)
+                return
+            if job.results == None:
+                job._finish(False)
+                continue
+            metrics = job.wrapper.metrics
+            try:
+                with metrics.span('read_results', instance = job.wrapper.my_name):
+                    feaModel = ansysresults.read_results(job.results, self.runner.results_format)
+                job.wrapper._count_bytes('bytes_read', job.results)
+                with metrics.span('outputs', instance = job.wrapper.my_name):
+                    outputs = tuple(job.wrapper.fea_outputs(feaModel))
+            except:
+                self.events.warning('pipeline_error', 'ANSYSPipeline %s exception reading %s\n%s', job.wrapper.my_name,
+                                    job.results, sys.exc_info()[0], instance = job.wrapper.my_name)
+                outputs = None
+            finally:
+                os.remove(job.results)
+            job._finish(outputs != None, outputs)
+            if outputs != None:
+                self.cached.put(job)
+
+    def _cache(self):
+        while True:
+            job = self.cached.get()
+            if job == None:
+                return
+            job.wrapper._cache_put(job.key, job.outputs)
+
 class ANSYSWrapperBase(ExternalCode):
-    """Base class for wrappers for ANSYS Classical Structural. Used internally by ANSYSWrapperGenerator."""
+    """Base class for wrappers for ANSYS Classical Structural. Used internally by ANSYSWrapperGenerator.
+       Results are cached in <name>_cache.db in the runner's workingdir (see ansyscache);
+       pass cache_size to keep at most that many, dropping the least recently used.
+       A result is found in the cache when the model is unchanged and every input value is
+       the same to a relative tolerance of cache_rtol (0 for exact matches only).
+       For linear static models, pass superposition = True to solve unit load cases once and
+       answer later runs by superposing them (see ansyssuperposition); nonlinear_inputs and
+       validate_every are passed to ansyssuperposition.Superposition.
+       Pass outputs, a list of output names such as tip_UR_o_max, to have ANSYS extract only
+       the output types and components they use (see ANSYSRunner.add_instance).
+       Timings and counters go to metrics, by default those of the runner (see ansysmetrics).
+       Pass quiet = True to print nothing to stdout; by default the wrapper is as quiet as the runner
+       (see ansysevents)."""
     components = {} #empty dictionary of dictionaries of node numbers
-                    # set by subclass when it parses the components file
+                    # replaced by the subclass with its own (see load_components): changing this one changes every wrapper
     values = {} #empty dictionary of dictionaries of values
-    def __init__(self, name, runner, dbfile, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33], logger_name = None):
+    def __init__(self, name, runner, dbfile, cdbfile = None, elasticity = [100, 100, 100], poisson = [0.33, 0.33, 0.33], logger_name = None,
+                 cache_size = None, cache_rtol = 1e-9, superposition = False, nonlinear_inputs = [], validate_every = 0,
+                 outputs = None, metrics = None, quiet = None):
         super(ANSYSWrapperBase, self).__init__()
         if logger_name == None:
             self.logger = logging.getLogger("MSI")
         else:
             self.logger = logging.getLogger(logger_name)
+        if quiet == None:
+            quiet = getattr(runner, 'events', None) != None and runner.events.quiet
+        self.events = ansysevents.EventLog(self.logger, quiet)
+        if metrics == None:
+            metrics = getattr(runner, 'metrics', ansysmetrics.NULL)
+        self.metrics = metrics
         self.my_name = name.replace(' ', '_')
         self.runner = runner
         self.loadsfile = self.my_name + '.inp'
         self.solutionfile = self.my_name + '.sol'
+        self.dbfile = dbfile
+        self.cdbfile = cdbfile
+        self.elasticity = elasticity
+        self.poisson = poisson
+        self.cache_rtol = cache_rtol
+        self.subscribed_outputs = outputs
         if not dbfile and not cdbfile:
-            print 'ERROR:' + name + ' must have one of dbfile or cdbfile. IGNORED'
-            self.logger.warning('ERROR:' + name + ' must have one of dbfile or cdbfile. IGNORED')
+            self.events.warning('wrapper_error', 'ERROR:%s must have one of dbfile or cdbfile. IGNORED', name,
+                                instance = self.my_name)
             self.ok = False
         else:
             if dbfile:
                 self.deflection_only = False
             else:
                 self.deflection_only = True
-            self.index = runner.add_instance(self.my_name, dbfile, cdbfile, elasticity, poisson)
+            self.index = runner.add_instance(self.my_name, dbfile, cdbfile, elasticity, poisson, outputs)
             self.ok = True
-            self.cachefile = os.path.join(self.runner.workingdir, self.my_name + '_cache.txt')
-            if os.path.exists(self.cachefile):
-                cachepickle = open(self.cachefile, 'r')
-                self.cache = pickle.load(cachepickle)
-                cachepickle.close()
-                print 'ANSYSWrapper ' + self.my_name + ' loaded cache ' + self.cachefile + '\n' + self.dump_cache()  
+            self.cachefile = os.path.join(self.runner.workingdir, self.my_name + '_cache.db')
+            self.cache = ansyscache.ResultCache(self.cachefile, cache_size, logger_name)
+            if superposition:
+                self.superposition = ansyssuperposition.Superposition(self, nonlinear_inputs, validate_every,
+                                                                      logger_name = logger_name, quiet = self.events.quiet)
             else:
-                self.cache = {} #empty dictionary
-            self.logger.debug('ANSYSWrapperBase ' + self.dump())
+                self.superposition = None
+            self.events.info('opened_cache', 'ANSYSWrapper %s opened cache %s with %s entries', self.my_name, self.cachefile,
+                             len(self.cache), instance = self.my_name)
+            self.events.debug('wrapper', 'ANSYSWrapperBase %s', ansysevents.lazy(self.dump), instance = self.my_name)
             os.environ['ANSYS_LOCK'] = 'OFF'
             os.environ['ANS_CONSEC'] = 'YES'
 
@@ -637,7 +1797,7 @@ class ANSYSWrapperBase(ExternalCode):
             for v1 in v:
                 for i, o in v1.iteritems():
                     s = s + '\t\t' + str(i) + ': '
-                    if isinstance(o, list):
+                    if isinstance(o, (list, numpy.ndarray)):
                         if len(o) > 10:
                             s = s + str(o[0:10]) + '...\n'
                         else:
@@ -655,8 +1815,7 @@ class ANSYSWrapperBase(ExternalCode):
             s = s + k + '\n'
             for n, e in c.iteritems():
                 s = s + '\t' + n + ': ' + repr(e) + '\n'
-        s = s + 'cache(' + self.cachefile + ')\n'
-        s = s + self.dump_cache()
+        s = s + 'cache(' + self.cachefile + ') ' + str(len(self.cache)) + ' entries\n'
         return s
 
     #def __setattr__(self, name, value):
@@ -664,25 +1823,41 @@ class ANSYSWrapperBase(ExternalCode):
         ## TO_CHECK:  - why did we need this???? self.__dict__[name] = value
 
     def _set_value_list(self, name, lst):
-        self.logger.debug('AnsysWrapper _set_value_list ' + str(name) + ' to list of len ' + str(len(lst)))
-        value_dict = {name: lst}
-        self.__setattr__(name, lst)
-        if len(lst):
-            val = max(lst)
-            nm = name + '_max'
-            self.__setattr__(nm, val)
-            value_dict[nm] = val
-            self.logger.info(nm +'= ' + str(val))
-            val = min(lst)
-            nm = name + '_min'
-            self.__setattr__(nm, val)
-            value_dict[nm] = val
-            self.logger.info(nm + ' = ' + str(val))
-            val = reduce(operator.add, lst)/len(lst)
-            nm = name+'_avg'
-            self.__setattr__(nm, val)
-            value_dict[nm] = val
-            self.logger.info(nm +' = ' + str(val))
+        """Set output name to lst, and name_max, name_min and name_avg to its aggregates.
+           Returns a dictionary of the values set."""
+        self.events.debug('set_value', 'AnsysWrapper _set_value_list %s to list of len %s', name, len(lst),
+                          instance = self.my_name)
+        values = numpy.asarray(lst, dtype = numpy.float64)
+        return self._set_columns([name], values.reshape(len(values), 1))
+
+    def _set_columns(self, names, values):
+        """Set output names[i] to column i of the 2-D array values, and its _max, _min
+           and _avg outputs.  Returns a dictionary of the values set."""
+        value_dict = self._column_values(names, values)
+        for k, v in value_dict.iteritems():
+            self.__setattr__(k, v)
+        return value_dict
+
+    def _column_values(self, names, values):
+        """Return a dictionary of output names[i] to column i of the 2-D array values, and of
+           its _max, _min and _avg outputs, reducing all columns at once.
+           The columns are views of values, not copies."""
+        value_dict = {}
+        if len(values):
+            maxs = values.max(axis = 0)
+            mins = values.min(axis = 0)
+            avgs = values.mean(axis = 0)
+        logged = self.events.enabled(logging.INFO)
+        for i, name in enumerate(names):
+            value_dict[name] = values[:, i]
+            if len(values):
+                for nm, val in ((name + '_max', float(maxs[i])),
+                                (name + '_min', float(mins[i])),
+                                (name + '_avg', float(avgs[i]))):
+                    value_dict[nm] = val
+                if logged:
+                    self.events.info('output', '%s max = %s min = %s avg = %s', name, value_dict[name + '_max'],
+                                     value_dict[name + '_min'], value_dict[name + '_avg'], instance = self.my_name)
         return value_dict
 
     def get_attr_value(self, name, default = 0.0):
@@ -692,128 +1867,189 @@ class ANSYSWrapperBase(ExternalCode):
         else:
             return a
 
-    def write_input(self, inputs=[]):
-        """Write input file self.loadsfile."""
-        currdir = os.getcwd()
-        input_cmds = []
-        try:
-            os.chdir(self.runner.workingdir)
+    #component type to (input types, description used in comments)
+    _component_inputtypes = {
+        'surfaces' : (ansysinfo.surfaceinputtypes, 'surface'),
+        'keypoints' : (ansysinfo.keypointinputtypes, 'keypoint'),
+        'nodes' : (ansysinfo.nodeinputtypes, 'node'),
+        'global' : (ansysinfo.globalinputtypes, 'global'),
+        }
+
+    #(wrapper class, component names) to the table compiled by _compile_loads
+    _load_tables = {}
+
+    def _load_table(self):
+        """Return the table of the inputs of self.components (see _compile_loads), compiled once per wrapper
+           class and set of component names, and kept by the wrapper until self.components is replaced."""
+        compiled = getattr(self, '_compiled_loads', None)
+        if compiled != None and compiled[0] is self.components:
+            return compiled[1]
+        names = tuple((k, tuple(sorted(self.components[k])))
+                      for k in sorted(self.components) if k in self._component_inputtypes)
+        key = (self.__class__, names)
+        table = self._load_tables.get(key)
+        if table == None:
+            table = self._compile_loads(names)
+            self._load_tables[key] = table
+        self._compiled_loads = (self.components, table)
+        return table
+
+    def _compile_loads(self, names):
+        """Return a list with, for each input of the components names, a tuple of
+               input name
+               name of its initial value, for global inputs, or None (the load is unset at 0.0)
+               command template, with %V% in place of the value
+               undo command, with %V% in place of the initial value for global inputs
+               comment before and after the value
+               True if an exception getting the value is to be ignored"""
+        table = []
+        for k, component_names in names:
+            inputtypes, what = self._component_inputtypes[k]
+            for name in component_names:
+                for i, s in sorted(inputtypes.iteritems()):
+                    n = ansysinfo._make_name(name, i)
+                    initial = None
+                    if k == 'global':
+                        initial = 'initial_' + n
+                    table.append((n, initial, s[0].replace('%N%', name), s[2].replace('%N%', name),
+                                  '!apply ' + i + ' ', ' to  ' + what + ' component ' + name, k == 'nodes'))
+        return table
+
+    def input_loads(self):
+        """Return a list of ANSYSLoad for each load to apply.
+           Uses self.components, through the table of _load_table."""
+        loads = []
+        for n, initial, template, undo, before, after, guarded in self._load_table():
+            try:
+                v = self.get_attr_value(n)
+            except:
+                if not guarded:
+                    raise
+                self.events.warning('wrapper_error', 'Exception in gettattr %s', n, instance = self.my_name)
+                v = 0.0
+            if initial == None:
+                if v != 0.0: #write new value
+                    loads.append(ANSYSLoad(n, v, template, undo, before + str(v) + after))
+            else:
+                unset = self.get_attr_value(initial)
+                if v != unset:
+                    loads.append(ANSYSLoad(n, v, template, undo.replace('%V%', str(unset)), before + str(v) + after))
+        vv = self.components.get('coordinputtypes')
+        if vv:
+            keys = sorted(ansysinfo.coordinputtypes)
+            subs = [ansysinfo.coordinputtypes[k] for k in keys]
+            for bnd, vvv in vv.iteritems():
+                for node, defls in vvv.iteritems(): # node is node number, delfs is list [UX, UY, UZ]
+                    for key, defl, sub in zip(keys, defls, subs):
+                        if defl <> 0:
+                            l2 = '!apply deflection ' + str(defl) + ' to ' + ' node ' + str(node)
+                            loads.append(ANSYSLoad(ansysinfo._make_name(str(node), key), defl,
+                                                   sub[0].replace('%N%', str(node)),
+                                                   sub[2].replace('%N%', str(node)), l2))
+        return loads
+
+    def write_input(self, inputs=[], loads=None):
+        """Write input file self.loadsfile: the commands of loads (default self.input_loads())
+           followed by inputs verbatim.  Returns the list of commands written."""
+        if loads == None:
+            loads = self.input_loads()
+        with self.metrics.span('write_input', instance = self.my_name):
+            fname = os.path.join(self.runner.workingdir, self.loadsfile)
             try:
-                f = open(self.loadsfile, 'w')
+                f = open(fname, 'w')
             except IOError as ioe:
-                print 'Error opening loadsfile file ' + self.loadsfile
-                print sys.exc_info()[0]
-                print str(ioe)
+                self.events.warning('wrapper_error', 'Error opening loadsfile file %s\n%s', self.loadsfile, ioe,
+                                    instance = self.my_name)
                 self.ok = False
                 return False
-            self.logger.info(self.my_name + ' write input: ' + self.loadsfile)
-            self.logger.info('-------------------------------------\n')
-            #self.logger.debug('nodeinputtypes ' + str(ansysinfo.nodeinputtypes))
-            for k, vv in self.components.iteritems():
-                #self.logger.debug('component ' + str(k) + ' ' + str(vv.keys()))
-                for name, nodes in vv.iteritems():
-                    #self.logger.debug(name)
-                    if k == 'surfaces':
-                        for i, s in ansysinfo.surfaceinputtypes.iteritems():
-                            n = ansysinfo._make_name(name, i)
-                            v = self.get_attr_value(n)
-                            v = self.convert_units(n, v)
-                            #self.logger.debug(n + ' = ' + str(v))
-                            if v != 0.0: #write new value
-                                l = s[0].replace('%N%', name)
-                                l1 = l.replace('%V%', str(v))
-                                l2 = '!apply ' + i + ' ' + str(v) + ' to ' + \
-                                    ' surface component ' + name
-                                f.write(l2 + '\n')
-                                f.write(l1 + '\n')
-                                self.logger.info(l2)
-                                self.logger.info(l1)
-                                input_cmds.append(l1)
-                    elif k == 'keypoints':
-                        for i, s in ansysinfo.keypointinputtypes.iteritems():
-                            n = ansysinfo._make_name(name, i)
-                            v = self.get_attr_value(n)
-                            v = self.convert_units(n, v)
-                            #self.logger.debug(n + ' = ' + str(v))
-                            if v != 0.0: #write new value
-                                l = s[0].replace('%N%', name)
-                                l1 = l.replace('%V%', str(v))
-                                l2 = '!apply ' + i + ' ' + str(v) + ' to ' + \
-                                    ' keypoint component ' + name
-                                f.write(l2 + '\n')
-                                f.write(l1 + '\n')
-                                self.logger.info(l2)
-                                self.logger.info(l1)
-                                input_cmds.append(l1)
-                    elif k == 'nodes':
-                        #self.logger.debug('node ' + name)
-                        #import pdb; pdb.set_trace()
-                        for i, s in ansysinfo.nodeinputtypes.iteritems():
-                            n = ansysinfo._make_name(name, i)
-                            try:
-                                v = self.get_attr_value(n)
-                                v = self.convert_units(n, v)
-                            except:
-                                print 'Exception in gettattr ' + n
-                                v = 0.0
-                            #self.logger.debug(n + ' = ' + str(v))
-                            if v != 0.0: #write new value
-                                l = s[0].replace('%N%', name)
-                                l1 = l.replace('%V%', str(v))
-                                l2 = '!apply ' + i + ' ' + str(v) + ' to ' + \
-                                    ' node component ' + name
-                                f.write(l2 + '\n')
-                                f.write(l1 + '\n')
-                                self.logger.info(l2)
-                                self.logger.info(l1)
-                                input_cmds.append(l1)
-                    elif k == 'global':
-                        for i, s in ansysinfo.globalinputtypes.iteritems():
-                            n = ansysinfo._make_name(name, i)
-                            v = self.get_attr_value(n)
-                            v = self.convert_units(n, v)
-                            initial_v = self.get_attr_value('initial_' + n)
-                            if v != initial_v: #write new value
-                                l = s[0].replace('%N%', name)
-                                l1 = l.replace('%V%', str(v))
-                                l2 = '!apply ' + i + ' ' + str(v) + ' to ' + \
-                                    ' global component ' + name
-                                f.write(l2 + '\n')
-                                f.write(l1 + '\n')
-                                self.logger.info(l2)
-                                self.logger.info(l1)
-                                input_cmds.append(l1)
-
-
-                    elif k == 'coordinputtypes':
-                        keys = ansysinfo.coordinputtypes.keys()
-                        keys.sort()
-                        subs = [ansysinfo.coordinputtypes[k] for k in keys]
-                        for bnd, vvv in vv.iteritems():
-                            for node, defls in vvv.iteritems(): # node is node number, delfs is list [UX, UY, UZ]
-                                for defl, sub in zip(defls, subs):
-                                    if defl <> 0:
-                                        l = sub[0].replace('%N%', str(node))
-                                        l1 = l.replace('%V%', str(defl))
-                                        l2 = '!apply deflection ' + str(defl) + ' to ' + ' node ' + str(node)  
-                                        f.write(l2 + '\n')
-                                        f.write(l1 + '\n')
-                                        self.logger.info(l2)
-                                        self.logger.info(l1)
-                                        input_cmds.append(l1)
-
-            # extra_inputs, set elsewhere, get passed through verbatim
-            for line in inputs:
-                f.write(line)
-                input_cmds.append(line)
-
-            self.logger.info('-------------------------------------\n')
-            self.logger.info(self.my_name + ' write input done')
+            try:
+                self.events.info('write_input', '%s write input: %s', self.my_name, self.loadsfile, instance = self.my_name)
+                input_cmds = self._write_loads(f, inputs, loads)
+                self._write_undo(inputs, loads)
+            finally:
+                f.close()
+        self._count_bytes('bytes_written', fname)
+        return input_cmds
+
+    def _count_bytes(self, counter, fname):
+        """Add the size of fname to counter of the metrics, if they are kept."""
+        if self.metrics.enabled and os.path.exists(fname):
+            self.metrics.count(counter, os.path.getsize(fname), instance = self.my_name)
 
+    def _write_loads(self, f, inputs, loads):
+        """Write the commands of loads, then inputs verbatim, to the open file f.  Returns the list of commands written."""
+        input_cmds = []
+        logged = self.events.enabled(logging.INFO)
+        for load in loads:
+            f.write(load.comment + '\n')
+            f.write(load.command + '\n')
+            if logged:
+                self.events.info('load', '%s\n%s', load.comment, load.command, instance = self.my_name, name = load.name,
+                                 value = load.value)
+            input_cmds.append(load.command)
+
+        # extra_inputs, set elsewhere, get passed through verbatim
+        for line in inputs:
+            f.write(line)
+            input_cmds.append(line)
+
+        self.events.info('write_input', '%s write input done', self.my_name, instance = self.my_name)
+        return input_cmds
+
+    def _write_undo(self, inputs, loads, fname = None):
+        """For a resident runner, write the command that applies each of loads and the command that removes it,
+           separated by a tab, to fname, default <name>.dlt in workingdir.  The runner sends ANSYS only the loads
+           that changed since the last run.  Extra inputs cannot be removed, so then there is no such file and
+           ANSYS resumes the db."""
+        if not getattr(self.runner, 'resident', False):
+            return
+        if fname == None:
+            fname = os.path.join(self.runner.workingdir, self.my_name + '.dlt')
+        if inputs:
+            if os.path.exists(fname):
+                os.remove(fname)
+            return
+        f = open(fname, 'w')
+        try:
+            for load in loads:
+                f.write(load.command + '\t' + load.undo + '\n')
         finally:
             f.close()
-            os.chdir(currdir)
-            return input_cmds
+
+    def _quantize(self, v):
+        """Return v as a string rounded to a relative tolerance of self.cache_rtol."""
+        v = float(v) + 0.0 # -0.0 is 0.0
+        if self.cache_rtol <= 0:
+            return repr(v)
+        digits = max(0, int(math.ceil(-math.log10(self.cache_rtol))))
+        return '%.*e' % (digits, v)
+
+    def model_fingerprint(self):
+        """Return a digest of everything other than the inputs that determines the results:
+           the content of the db or cdb file, elasticity and poisson, the prep7, solution and post commands,
+           the subscribed outputs and the runner's results format."""
+        h = hashlib.sha1()
+        for fname in (self.dbfile, self.cdbfile):
+            if fname:
+                h.update(ansyscache.file_digest(fname))
+        h.update(repr(self.elasticity) + repr(self.poisson))
+        for section in (self.prep7(), self.solution(), self.post()):
+            h.update('\n'.join(section) + '\0')
+        if self.subscribed_outputs != None:
+            h.update('outputs ' + ','.join(sorted(self.subscribed_outputs)) + '\0')
+        h.update('format ' + self.runner.results_format)
+        return h.digest()
+
+    def cache_key(self, loads, inputs = []):
+        """Return the cache key of solving with loads (from input_loads) and extra inputs:
+           a digest of model_fingerprint() and the input values sorted by name and rounded to cache_rtol."""
+        h = hashlib.sha1(self.model_fingerprint())
+        for n, v in sorted((load.name, self._quantize(load.value)) for load in loads):
+            h.update(n + '=' + v + '\n')
+        for line in inputs:
+            h.update('\0' + line)
+        return h.hexdigest()
+
     def convert_units(self, n, v):
         if v.__class__ == UnitsAttrWrapper:
 
@@ -822,7 +2058,8 @@ class ANSYSWrapperBase(ExternalCode):
             try:    
                 v.pq.convert_to_unit(units)
             except:
-                print "Units are not set for", n, " in ", self.__class__
+                self.events.warning('wrapper_error', 'Units are not set for %s in %s', n, self.__class__,
+                                    instance = self.my_name)
 
             value = v.pq.value            
             return value
@@ -833,122 +2070,260 @@ class ANSYSWrapperBase(ExternalCode):
 
     def write_solution(self):
         """Write solution commands file self.solutionfile."""
-        currdir = os.getcwd()
-        needrun = False
-        try:
-            os.chdir(self.runner.workingdir)
+        with self.metrics.span('write_solution', instance = self.my_name):
+            fname = os.path.join(self.runner.workingdir, self.solutionfile)
             try:
-                f = open(self.solutionfile, 'w')
+                f = open(fname, 'w')
             except IOError as ioe:
-                print 'Error opening solutionfile file ' + self.solutionfile
-                print sys.exc_info()[0]
-                print str(ioe)
+                self.events.warning('wrapper_error', 'Error opening solutionfile file %s\n%s', self.solutionfile, ioe,
+                                    instance = self.my_name)
                 self.ok = False
                 return False
-
-            for s in self.solution():
-                f.write(s + '\n');
-            needrun = True
-            f.close()
-        finally:
-            os.chdir(currdir)
-            return needrun
+            try:
+                for s in self.solution():
+                    f.write(s + '\n');
+            finally:
+                f.close()
+        self._count_bytes('bytes_written', fname)
+        return True
 
     def process_output_from_fea_model(self, feaModel):
-        """Override if necessary in subclass."""
+        """Set the outputs from feaModel.  Returns a list of dictionaries of the values set."""
+        with self.metrics.span('outputs', instance = self.my_name):
+            outputs = self.fea_outputs(feaModel)
+        for o in outputs:
+            for k, v in o.iteritems():
+                self.__setattr__(k, v)
+        return outputs
+
+    def fea_outputs(self, feaModel):
+        """Return the outputs of feaModel, one dictionary of output name to value per component,
+           without setting them.  Override if necessary in subclass."""
         nodeLabels = feaModel.nodeLabels
-        self.logger.debug('nodeLabels: ' + str(nodeLabels))
+        self.events.debug('outputs', 'nodeLabels: %s', nodeLabels, instance = self.my_name)
         outputs = []
-        for component in feaModel.nodeMap:
-            self.logger.debug('component: ' + str(component))
-            for i, item in enumerate(nodeLabels):
-                results = []
-                for n in feaModel.nodeMap[component]:
-                    results.append( n[i] ) 
-                value_dict = self._set_value_list(component+'_'+item, results)
-                outputs.append(value_dict.copy())
+        for component, nodes in feaModel.nodeMap.iteritems():
+            self.events.debug('outputs', 'component: %s', component, instance = self.my_name)
+            # one row per node, one column per label
+            values = numpy.asarray(nodes, dtype = numpy.float64).reshape(len(nodes), len(nodeLabels))
+            names = [component + '_' + item for item in nodeLabels]
+            outputs.append(self._column_values(names, values))
         return outputs
 
+    def read_fea_model(self):
+        """Read the results file written by ANSYS.  Returns None if it cannot be read."""
+        fname = os.path.join(self.runner.workingdir, self.my_name + '.' + self.runner.results_ext)
+        self.events.debug('read_results', '%s read feaModel from %s', self.my_name, fname, instance = self.my_name)
+        feaModel = None
+        try:
+            with self.metrics.span('read_results', instance = self.my_name):
+                feaModel = ansysresults.read_results(fname, self.runner.results_format)
+            self._count_bytes('bytes_read', fname)
+        except IOError as ioe:
+            self.events.warning('read_error', '%s Error trying to read file %s\n%s', self.my_name, fname, ioe,
+                                instance = self.my_name)
+        except:
+            self.events.warning('read_error', '%s exception in read_fea_model\n%s', self.my_name, sys.exc_info()[0],
+                                instance = self.my_name)
+        return feaModel
+
     def read_output(self):
         """Read output file.
            Uses self.components."""
-        fname = os.path.join(self.runner.workingdir, self.my_name + '.py')
-        self.logger.debug(self.my_name + ' read feaModel from ' + str(fname))
         outputs = []
-        try:
-            f = open(fname, 'r')
-            exec(f)
-            f.close()
+        feaModel = self.read_fea_model()
+        if feaModel != None:
+            try:
+                outputs = self.process_output_from_fea_model(feaModel)
+            except:
+                self.events.warning('read_error', '%s exception in read_output\n%s', self.my_name, sys.exc_info()[0],
+                                    instance = self.my_name)
+        return outputs
 
-            feaModel = FeaPropertiesInPythonFormat()    
-            outputs = self.process_output_from_fea_model(feaModel)
-
-        except IOError as ioe:
-            s = self.my_name + ' Error trying to read file ' + fname
-            print s
-            self.logger.warning(s + str(ioe))
-            print sys.exc_info()[0]
-            print str(ioe)
-        except:
-            s = self.my_name + ' exception in read_output'
-            print s
-            self.logger.warning(s)
-        finally:
-            return outputs
+    def solve_fea_model(self, loads, inputs = []):
+        """Write loads (as from input_loads) and inputs, run ANSYS and return the results it wrote,
+           without setting any outputs.  Returns None if ANSYS fails."""
+        self.write_input(inputs, loads)
+        self.write_solution()
+        if not self.runner.run(self.my_name, self.prep7(), self.solution(), self.post()):
+            return None
+        return self.read_fea_model()
 
     def _log_values(self, k, name, lbl, vals):
-        self.logger.info(str(k))
-        self.logger.info('   ' + str(name))
-        self.logger.info('      ' + str(lbl))
-        s = '      '
-        i = 1
-        for v in vals:
-            s = s + str(v) + ' '
-            if i % 10 == 0:
-                self.logger.info(s)
-                s = '      '
-            i = i + 1
-        self.logger.info(s)
+        if not self.events.enabled(logging.INFO):
+            return
+        rows = ['      ' + ' '.join(str(v) for v in vals[i:i + 10]) for i in range(0, len(vals), 10)]
+        self.events.info('values', '%s\n   %s\n      %s\n%s', k, name, lbl, '\n'.join(rows), instance = self.my_name)
 
     def picklecache(self):
-        picklefile = open(self.cachefile, 'w')
-        pickle.dump(self.cache, picklefile)
-        picklefile.close()
+        """Make sure the cache is on disk.  Entries are written as they are added, so there is little to do."""
+        with self.metrics.span('picklecache', instance = self.my_name):
+            self.cache.flush()
+
+    def _cache_put(self, key, outputs):
+        with self.metrics.span('cache_put', instance = self.my_name):
+            self.cache.put(key, tuple(outputs))
 
     def execute(self):
-        """ Write input, signal ansys to run, read output """
-        print 'ANSYSWrapperBase: ' + self.my_name + ': execute start'
-        self.logger.debug('ANSYSWrapperBase: ' + self.my_name + ': execute start')    
+        """ Look up the inputs in the cache; if not found, write input, signal ansys to run, read output """
+        start = ansysmetrics.clock()
+        self.events.debug('execute', 'ANSYSWrapperBase: %s: execute start', self.my_name, instance = self.my_name)
         if self.ok and self.runner.ok:
-            self.logger.debug(self.my_name + ' execute')
-            input_cmds = tuple(self.write_input( self.extra_inputs() ))
-            if self.cache.has_key(input_cmds):
-                self.logger.debug(self.my_name + ' found in cache ' + str(input_cmds) )
-                output_tuple = self.cache[input_cmds]
+            with self.metrics.span('cache_lookup', instance = self.my_name):
+                inputs = self.extra_inputs()
+                loads = self.input_loads()
+                key = self.cache_key(loads, inputs)
+                output_tuple = self.cache.get(key)
+            if output_tuple != None:
+                self.metrics.count('cache_hits', instance = self.my_name)
+                self.events.debug('cache_hit', '%s found in cache %s', self.my_name, key, instance = self.my_name)
                 for o in output_tuple:
                     for k, v in o.iteritems():
                         self.__setattr__(k, v)
                 #get value from cache
+            elif self.superposition != None:
+                self.metrics.count('cache_misses', instance = self.my_name)
+                superposed = self.superposition.count
+                feaModel = self.superposition.fea_model(loads, inputs)
+                if feaModel != None:
+                    if self.superposition.count > superposed:
+                        self.metrics.count('superposed', instance = self.my_name)
+                    outputs = self.process_output_from_fea_model(feaModel)
+                    self._cache_put(key, outputs)
+                else:
+                    self.events.warning('run_failed', '%s not ok after superposition', self.my_name, instance = self.my_name)
             else:
+                #only write the loads file when ANSYS has to solve
+                self.metrics.count('cache_misses', instance = self.my_name)
+                self.write_input(inputs, loads)
                 self.write_solution()
                 ok = self.runner.run(self.my_name, self.prep7(), self.solution(), self.post())
                 if ok:
-                    s = self.my_name + ' ok after run'
-                    print s
-                    self.logger.debug(s)
+                    self.events.debug('run_done', '%s ok after run', self.my_name, instance = self.my_name)
                     outputs = self.read_output()
-                    s = self.my_name + ' after read_output'
-                    print s
-                    self.logger.debug(s)  
+                    self.events.debug('read_results', '%s after read_output', self.my_name, instance = self.my_name)
                     if outputs <> None:
-                        self.cache[input_cmds] = tuple(outputs)
-                        self.picklecache()
+                        self._cache_put(key, outputs)
+                else:
+                    self.events.warning('run_failed', '%s not ok after run', self.my_name, instance = self.my_name)
+        self.events.debug('execute', 'ANSYSWrapperBase: %s: execute end', self.my_name, instance = self.my_name)
+        self.metrics.add_span('execute', ansysmetrics.clock() - start, instance = self.my_name)
+
+    def start_execute(self, timeout = None):
+        """Start what execute() does without blocking, for a runner with start() (ANSYSRunner or ANSYSRunnerPool).
+           Returns an ANSYSRun; once it is done, the outputs are set and cached if it succeeded.
+           On a cache hit, and with superposition, the run is already done when it is returned.
+           Start one run at a time per wrapper: they share its files."""
+        run = ANSYSRun(self.my_name)
+        if not (self.ok and self.runner.ok):
+            run._finish(False)
+            return run
+        inputs = self.extra_inputs()
+        loads = self.input_loads()
+        key = self.cache_key(loads, inputs)
+        if self.superposition != None or key in self.cache:
+            self.execute()
+            run._finish(key in self.cache)
+            return run
+        self.metrics.count('cache_misses', instance = self.my_name)
+        self.write_input(inputs, loads)
+        self.write_solution()
+        run = self.runner.start(self.my_name, self.prep7(), self.solution(), self.post(), timeout)
+        run.add_done_callback(lambda run: self._finish_execute(run, key))
+        return run
+
+    def _finish_execute(self, run, key):
+        if not run.ok:
+            self.events.warning('run_failed', '%s not ok after run', self.my_name, instance = self.my_name)
+            return
+        outputs = self.read_output()
+        if outputs:
+            self._cache_put(key, outputs)
+        else:
+            run.ok = False
+
+    def execute_batch(self, points):
+        """Solve each of points, a list of dictionaries of input name to value, caching the results.
+           Points not in the cache that differ only in linear loads (see ansysinfo.linearinputtypes) are
+           solved as the load steps of one runner.run_batch, so the db is resumed once for all of them.
+           Needs results_format 'numeric'; otherwise each point is executed in turn.
+           Returns a list of the outputs of each point, as tuples of dictionaries of output name to value,
+           with None where ANSYS failed.  Inputs and outputs are left as those of the last point."""
+        results = [None] * len(points)
+        if not (self.ok and self.runner.ok):
+            return results
+        groups = {} #key of the other loads to (other loads, extra inputs, [(point index, linear loads, cache key)])
+        order = []
+        for i, point in enumerate(points):
+            for n, v in point.iteritems():
+                self.__setattr__(n, v)
+            if self.runner.results_format != 'numeric':
+                self.execute()
+                results[i] = self.cache.get(self.cache_key(self.input_loads(), self.extra_inputs()))
+                continue
+            inputs = self.extra_inputs()
+            loads = self.input_loads()
+            key = self.cache_key(loads, inputs)
+            results[i] = self.cache.get(key)
+            if results[i] != None:
+                self.metrics.count('cache_hits', instance = self.my_name)
+                continue
+            self.metrics.count('cache_misses', instance = self.my_name)
+            linear = []
+            context = []
+            for load in loads:
+                if ansyssuperposition.is_linear_input(load.name):
+                    linear.append(load)
                 else:
-                    s = self.my_name + ' not ok after run'
-                    self.logger.warning(s)
-                    print s
-        print 'ANSYSWrapperBase: ' + self.my_name + ': execute end'
-        self.logger.debug('ANSYSWrapperBase: ' + self.my_name + ': execute end')    
+                    context.append(load)
+            ckey = self.cache_key(context, inputs)
+            if ckey not in groups:
+                groups[ckey] = (context, inputs, [])
+                order.append(ckey)
+            groups[ckey][2].append((i, linear, key))
+        for ckey in order:
+            context, inputs, members = groups[ckey]
+            for start in range(0, len(members), self.runner.max_batch):
+                self._run_steps(context, inputs, members[start:start + self.runner.max_batch], results)
+        if results and results[-1] != None:
+            for o in results[-1]:
+                for k, v in o.iteritems():
+                    self.__setattr__(k, v)
+        return results
+
+    def _run_steps(self, context, inputs, members, results):
+        """Solve members, (point index, linear loads, cache key), as load steps on top of the context loads."""
+        steps = []
+        previous = []
+        for i, linear, key in members:
+            step = [load.undo for load in previous]
+            for load in linear:
+                step.append(load.comment)
+                step.append(load.command)
+            steps.append(step)
+            previous = linear
+        self.write_input(inputs, context)
+        self.write_solution()
+        if not self.runner.run_batch(self.my_name, steps, self.prep7(), self.solution(), self.post()):
+            self.events.warning('run_failed', '%s not ok after run_batch', self.my_name, instance = self.my_name)
+            return
+        fname = os.path.join(self.runner.workingdir, self.my_name + '.' + self.runner.results_ext)
+        try:
+            with self.metrics.span('read_results', instance = self.my_name, steps = len(members)):
+                feaModels = ansysresults.read_numeric_steps(fname)
+            self._count_bytes('bytes_read', fname)
+        except (IOError, ValueError) as e:
+            self.events.warning('read_error', '%s Error trying to read file %s\n%s', self.my_name, fname, e,
+                                instance = self.my_name)
+            return
+        if len(feaModels) != len(members):
+            self.events.warning('read_error', '%s expected %s load steps in %s, found %s', self.my_name, len(members),
+                                fname, len(feaModels), instance = self.my_name)
+            return
+        for (i, linear, key), feaModel in zip(members, feaModels):
+            outputs = tuple(self.process_output_from_fea_model(feaModel))
+            self._cache_put(key, outputs)
+            results[i] = outputs
 
     def prep7(self):
         """entry point for derived wrappers to add customization to the /PREP7 section"""
@@ -973,7 +2348,7 @@ class ANSYSWrapperBase(ExternalCode):
 
     def __del__(self):
         #TO_CHECK:  this doesn't seem to get called....
-        print 'DELETING AnsysWrapper ' + self.my_name
+        self.events.debug('deleted', 'DELETING AnsysWrapper %s', self.my_name, instance = self.my_name)
         self.runner.shutdown()
 
 if __name__ == "__main__": # pragma: no cover         
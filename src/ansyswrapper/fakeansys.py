@@ -0,0 +1,278 @@
+"""A stand-in for ANSYS Mechanical APDL, so that ANSYSRunner can be run and timed without an ANSYS install.
+
+It reads the control script written by ANSYSRunner.init_ansys and follows its protocol: it signals it is
+ready and waits with the 'file' or 'fifo' handshake (see ansyshandshake), reads the instance index file,
+applies the loads of <instance>.inp (or, to a resident model, <instance>.und and <instance>.dif) and the
+load step files of a batch, and writes a results file in the format and with the columns of the control
+script.  The results are synthetic but deterministic, and linear in the load values, so caching, batches and superposition can be checked:
+for node number i, with s the sum of the values of the loads applied,
+
+    UX = s * i * 1e-6, UY = -UX / 2, UZ = UX / 4, UR as the control script computes it,
+    TEMP = the TUNIF value, FX = s * 1e-3, FY = FZ = 0
+
+It is configured with environment variables:
+
+    FAKEANSYS_NODES
+        Number of nodes, shared out among the components.  Default 1000.
+    FAKEANSYS_COMPONENTS
+        Comma separated names of the components.  Default TIP,ROOT.
+    FAKEANSYS_DELAY
+        Seconds each solve (each load step of a batch) takes.  Default 0.
+
+It writes a line 'solved <instance> steps <n> in <seconds> s' to its -o file for each run, and the
+times of its phases to the file the control script names, as ANSYS does for ansysmetrics.
+
+Use install() to make an executable ANSYSRunner will start, then create the runner as usual:
+
+    fakeansys.install(tempdir)
+    runner = ANSYSRunner('bench', workingdir, handshake = 'file')
+"""
+
+import os
+import stat
+import sys
+import time
+
+import numpy
+
+#order of the columns ANSYSRunner can write
+_allkeys = ['number', 'UX_o', 'UY_o', 'UZ_o', 'UR_o', 'TEMP_o', 'FX_o', 'FY_o', 'FZ_o']
+
+def install(ansysdir, ANSYS_VER = 'ANSYS145', sysdir = 'fake'):
+    """Write an executable at <ansysdir>/bin/<sysdir>/<ANSYS_VER> that runs this module, and set
+       <ANSYS_VER>_DIR and ANSYS_SYSDIR in os.environ so that ANSYSRunner starts it.  Posix only.
+       Returns the full path of the executable."""
+    bindir = os.path.join(ansysdir, 'bin', sysdir)
+    if not os.path.exists(bindir):
+        os.makedirs(bindir)
+    exe = os.path.join(bindir, ANSYS_VER)
+    f = open(exe, 'w')
+    try:
+        f.write('#!/bin/sh\n')
+        f.write('exec "' + sys.executable + '" "' + os.path.abspath(__file__).replace('.pyc', '.py') + '" "$@"\n')
+    finally:
+        f.close()
+    os.chmod(exe, os.stat(exe).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ[ANSYS_VER + '_DIR'] = ansysdir
+    os.environ['ANSYS_SYSDIR'] = sysdir
+    return exe
+
+class ControlScript(object):
+    """What the fake needs from the control script of ANSYSRunner."""
+    def __init__(self, fname):
+        self.runner = ''
+        self.handshake = 'file'
+        self.instances = {}   #index to instance name
+        self.components = {} #index to the names of the components it writes
+        self.labels = list(_allkeys)
+        self.results_ext = 'py'
+        self.timefile = None #where to write the phase times of each run
+        f = open(fname, 'r')
+        try:
+            for line in f:
+                line = line.strip()
+                if line.startswith('/TITLE, ANSYSRunner '):
+                    self.runner = line.split()[-1]
+                elif line.startswith('/COM, Handshake '):
+                    self.handshake = line.split()[-1]
+                elif line.startswith('MSI_') and '_iia(1,' in line and line.split('=')[0].strip().endswith(',1)'):
+                    index = int(line.split('(1,')[1].split(',')[0])
+                    self.instances[index] = line.split('=', 1)[1].strip().strip("'")
+                elif line.startswith('MSI_CMPN(1,'):
+                    index = int(line.split(')')[0].split(',')[2])
+                    self.components.setdefault(index, []).append(line.split('=', 1)[1].strip().strip("'"))
+                elif line.startswith('LABELS '):
+                    self.labels = line.split()[1:]
+                    self.results_ext = 'res'
+                elif line.startswith('/COM, Phase times to '):
+                    self.timefile = line.split()[-1]
+                elif line.startswith('self.nodeLabels = '):
+                    self.labels = eval(line.split('=', 1)[1])
+        finally:
+            f.close()
+
+class FakeANSYS(object):
+    """Runs the protocol of a control script in directory workingdir."""
+    def __init__(self, workingdir, control, instfile, instext, out):
+        self.workingdir = workingdir
+        self.control = control
+        self.instfile = os.path.join(workingdir, instfile + '.' + instext)
+        self.out = out
+        self.nodes = int(os.environ.get('FAKEANSYS_NODES', '1000'))
+        self.names = os.environ.get('FAKEANSYS_COMPONENTS', 'TIP,ROOT').split(',')
+        self.delay = float(os.environ.get('FAKEANSYS_DELAY', '0'))
+        self.count = 0
+        self.loads = {} #(command, name, label) to value
+        name = control.runner
+        if control.handshake == 'fifo':
+            self.from_path = os.path.join(workingdir, name + '_from.fifo')
+            self.to_path = os.path.join(workingdir, name + '_to.fifo')
+        else:
+            self.from_path = os.path.join(workingdir, name + '_from.flag')
+            self.to_path = os.path.join(workingdir, name + '_to.flag')
+
+    def ready(self):
+        self.count += 1
+        if self.control.handshake == 'fifo':
+            f = open(self.from_path, 'w')
+            f.write('1\n')
+            f.close()
+        else:
+            tmp = self.from_path + '.tmp'
+            f = open(tmp, 'w')
+            f.write('%d\n' % self.count)
+            f.close()
+            os.rename(tmp, self.from_path)
+
+    def wait(self):
+        if self.control.handshake == 'fifo':
+            f = open(self.to_path, 'r')
+            f.read()
+            f.close()
+        else:
+            while not os.path.exists(self.to_path):
+                time.sleep(0.0005)
+            os.remove(self.to_path)
+
+    def apply(self, fname):
+        """Apply the load commands of fname, if it exists."""
+        if not os.path.exists(fname):
+            return
+        f = open(fname, 'r')
+        try:
+            for line in f:
+                line = line.split('!')[0].strip()
+                if not line:
+                    continue
+                fields = [x.strip() for x in line.split(',')]
+                verb = fields[0].lower()
+                if verb.endswith('dele'):
+                    self.loads.pop((verb[:-4],) + tuple(fields[1:3]), None)
+                    continue
+                try:
+                    value = float(fields[-1])
+                except ValueError:
+                    continue
+                self.loads[(verb,) + tuple(fields[1:-1])[:2]] = value
+        finally:
+            f.close()
+
+    def results(self, components):
+        """Return a list of (component, array with one row per node and one column per label)."""
+        s = sum(self.loads.values())
+        temp = self.loads.get(('tunif',), 0.0)
+        per = max(1, self.nodes // max(1, len(self.names)))
+        out = []
+        for j, c in enumerate(components):
+            if c in self.names:
+                first = self.names.index(c) * per + 1
+            else:
+                first = 1
+            number = numpy.arange(first, first + per, dtype = numpy.float64)
+            cols = {'number': number}
+            cols['UX_o'] = s * number * 1e-6
+            cols['UY_o'] = -0.5 * cols['UX_o']
+            cols['UZ_o'] = 0.25 * cols['UX_o']
+            larger = numpy.where(numpy.abs(cols['UX_o']) > numpy.abs(cols['UY_o']), cols['UX_o'], cols['UY_o'])
+            cols['UR_o'] = numpy.where(larger < 0, -1.0, 1.0) * numpy.hypot(cols['UX_o'], cols['UY_o'])
+            cols['TEMP_o'] = numpy.zeros(per) + temp
+            cols['FX_o'] = numpy.zeros(per) + s * 1e-3
+            cols['FY_o'] = numpy.zeros(per)
+            cols['FZ_o'] = numpy.zeros(per)
+            out.append((c, numpy.column_stack([cols[k] for k in self.control.labels])))
+        return out
+
+    def write_results(self, name, steps):
+        """Write the results of steps, a list of lists of (component, array), to the results file of name."""
+        fname = os.path.join(self.workingdir, name + '.' + self.control.results_ext)
+        f = open(fname, 'w')
+        try:
+            if self.control.results_ext == 'res':
+                f.write('MSI_RESULTS 1\nUNITS 1\nLABELS ' + ' '.join(self.control.labels) + '\n')
+                fmt = '%d' + ' %25.17E' * (len(self.control.labels) - 1)
+                for k, step in enumerate(steps):
+                    if len(steps) > 1:
+                        f.write('STEP %d\n' % (k + 1))
+                    for c, values in step:
+                        f.write('COMPONENT %s %d\n' % (c, len(values)))
+                        numpy.savetxt(f, values, fmt = fmt)
+                f.write('END\n')
+            else:
+                f.write('class FeaPropertiesInPythonFormat:\n')
+                f.write('\tdef __init__(self):\n')
+                f.write('\t\tself.nodeLabels = ' + str(self.control.labels) + '\n')
+                f.write('\t\tself.units = 1\n')
+                f.write('\t\tself.coordinateSystem = "Cartesian"\n')
+                f.write('\t\tself.nodeMap = {\n')
+                for c, values in steps[0]:
+                    f.write('\t\t\t"' + c + '":\n\t\t\t[\n')
+                    for row in values:
+                        f.write('\t\t\t[%d, ' % row[0] + ', '.join('%G' % v for v in row[1:]) + ',],\n')
+                    f.write('\t\t\t],\n')
+                f.write('\t\t\t}\n')
+        finally:
+            f.close()
+
+    def run(self, index, nsteps, resident):
+        start = time.time()
+        name = self.control.instances[index]
+        base = os.path.join(self.workingdir, name)
+        if resident:
+            self.apply(base + '.und')
+            self.apply(base + '.dif')
+        else:
+            self.loads = {} #resume the db
+            self.apply(base + '.inp')
+        loaded = time.time()
+        components = self.control.components.get(index, self.names)
+        steps = []
+        if nsteps > 0:
+            for k in range(1, nsteps + 1):
+                self.apply(base + '.s%02d' % k)
+                time.sleep(self.delay)
+                steps.append(self.results(components))
+        else:
+            time.sleep(self.delay)
+            steps.append(self.results(components))
+        solved = time.time()
+        self.write_results(name, steps)
+        if self.control.timefile:
+            f = open(os.path.join(self.workingdir, self.control.timefile), 'w')
+            f.write('%16.6f%16.6f%16.6f\n' % (loaded - start, solved - loaded, time.time() - solved))
+            f.close()
+        self.out.write('solved %s steps %d in %.6f s\n' % (name, nsteps, time.time() - start))
+        self.out.flush()
+
+    def main(self):
+        while True:
+            self.ready()
+            self.wait()
+            f = open(self.instfile, 'r')
+            line = f.read()
+            f.close()
+            index, nsteps, resident = [int(x) for x in line.split()[:3]]
+            if index < 0:
+                return
+            self.run(index, nsteps, resident)
+
+def main(args):
+    opts = {}
+    i = 0
+    while i < len(args):
+        if args[i].startswith('-') and i + 1 < len(args) and not args[i + 1].startswith('-'):
+            opts[args[i]] = args[i + 1]
+            i += 2
+        else:
+            opts[args[i]] = None
+            i += 1
+    workingdir = opts.get('-dir', os.getcwd())
+    out = open(opts.get('-o', os.devnull), 'w')
+    try:
+        fake = FakeANSYS(workingdir, ControlScript(opts['-i']), opts['-MSI_INSTFILE'], opts['-MSI_INSTEXT'], out)
+        fake.main()
+    finally:
+        out.close()
+    return 0
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""Times ANSYSRunner and ANSYSWrapperBase against fakeansys, the ANSYS stand-in, as models grow.
+
+For each number of nodes it reports
+    overhead     seconds per run spent outside the fake ANSYS, which logs how long it takes
+    throughput   runs per second
+    parse        seconds to read one results file
+Posix only.  Run with, for example:
+
+    python benchmark_runner.py --nodes 1000 10000 100000 1000000 --runs 20 --format numeric
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ansyswrapper import fakeansys
+from ansyswrapper import ansysresults
+from ansyswrapper.ansyswrapper import ANSYSRunner, ANSYSWrapperBase
+
+class BenchWrapper(ANSYSWrapperBase):
+    """A wrapper with one keypoint load, on component TIP."""
+    def __init__(self, name, runner, dbfile, **kwargs):
+        super(BenchWrapper, self).__init__(name, runner, dbfile, **kwargs)
+        self.components = {'keypoints': {'TIP': [1]}}
+
+def bench(tmpdir, nodes, runs, delay, results_format, handshake):
+    os.environ['FAKEANSYS_NODES'] = str(nodes)
+    os.environ['FAKEANSYS_DELAY'] = str(delay)
+    workingdir = os.path.join(tmpdir, 'n' + str(nodes))
+    dbfile = os.path.join(tmpdir, 'bench.db')
+    open(dbfile, 'w').close()
+    runner = ANSYSRunner('bench', workingdir, handshake = handshake, results_format = results_format)
+    try:
+        wrapper = BenchWrapper('bench', runner, dbfile)
+        wrapper.TIP_FX_i = 1.0
+        wrapper.execute() # starts the fake ANSYS
+        start = time.time()
+        for i in range(runs):
+            wrapper.TIP_FX_i = 2.0 + i # a new value, so not found in the cache
+            wrapper.execute()
+        elapsed = time.time() - start
+        f = open(runner.ansysout, 'r')
+        fake = sum(float(line.split()[-2]) for line in f.readlines()[-runs:])
+        f.close()
+        fname = os.path.join(workingdir, 'bench.' + runner.results_ext)
+        start = time.time()
+        ansysresults.read_results(fname, results_format)
+        parse = time.time() - start
+    finally:
+        runner.shutdown()
+    return ((elapsed - fake) / runs, runs / elapsed, parse)
+
+def main(args):
+    parser = argparse.ArgumentParser(description = 'Time ANSYSRunner against fakeansys')
+    parser.add_argument('--nodes', type = int, nargs = '+', default = [1000, 10000, 100000, 1000000])
+    parser.add_argument('--runs', type = int, default = 20)
+    parser.add_argument('--delay', type = float, default = 0.0, help = 'seconds each fake solve takes')
+    parser.add_argument('--format', default = 'numeric', choices = ['numeric', 'python'])
+    parser.add_argument('--handshake', default = 'file', choices = ['file', 'fifo'])
+    opts = parser.parse_args(args)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fakeansys.install(os.path.join(tmpdir, 'ansys'))
+        print '%10s %14s %14s %14s' % ('nodes', 'overhead (s)', 'runs/s', 'parse (s)')
+        for nodes in opts.nodes:
+            overhead, throughput, parse = bench(tmpdir, nodes, opts.runs, opts.delay, opts.format, opts.handshake)
+            print '%10d %14.4f %14.2f %14.4f' % (nodes, overhead, throughput, parse)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,20 +1,484 @@
 
+import logging
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
 import unittest
 
+import numpy
 
+from ansyswrapper import ansyscache
+from ansyswrapper import ansyscdb
+from ansyswrapper import ansysevents
+from ansyswrapper import ansysinfo
+from ansyswrapper import ansysmetrics
+from ansyswrapper import ansysresults
+from ansyswrapper import fakeansys
+from ansyswrapper.ansyswrapper import ANSYSRunner, ANSYSRunnerPool, ANSYSWrapperBase, load_components
+
+
+class TipWrapper(ANSYSWrapperBase):
+    """A wrapper with one keypoint load, on component TIP of the fake ANSYS."""
+    def __init__(self, name, runner, dbfile, **kwargs):
+        super(TipWrapper, self).__init__(name, runner, dbfile, **kwargs)
+        self.components = {'keypoints': {'TIP': [1]}}
+
+#the fake ANSYS shares 1000 nodes between TIP and ROOT, so the largest UX of TIP is FX * 500e-6
+def tip_ux(fx):
+    return fx * 500e-6
+
+@unittest.skipUnless(os.name == 'posix', 'fakeansys needs posix')
 class ANSYSWrapperBaseTestCase(unittest.TestCase):
 
     def setUp(self):
-        pass
-        
+        self.tmpdir = tempfile.mkdtemp()
+        fakeansys.install(os.path.join(self.tmpdir, 'ansys'))
+        os.environ['FAKEANSYS_NODES'] = '1000'
+        os.environ['FAKEANSYS_DELAY'] = '0'
+        self.dbfile = os.path.join(self.tmpdir, 'tip.db')
+        open(self.dbfile, 'w').close()
+        self.runners = []
+
+    def tearDown(self):
+        for runner in self.runners:
+            runner.shutdown()
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def wrapper(self, handshake = 'file', results_format = 'numeric', metrics = None, resident = False, **kwargs):
+        workingdir = os.path.join(self.tmpdir, handshake + results_format)
+        runner = ANSYSRunner('T', workingdir, timeout = '20', handshake = handshake, results_format = results_format,
+                             resident = resident, metrics = metrics)
+        self.runners.append(runner)
+        return TipWrapper('tip', runner, self.dbfile, **kwargs)
+
+    def test_execute(self):
+        for handshake in ('file', 'fifo'):
+            for results_format in ('numeric', 'python'):
+                w = self.wrapper(handshake, results_format)
+                w.TIP_FX_i = 10.0
+                w.execute()
+                self.assertTrue(w.ok)
+                self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(10.0))
+                w.TIP_FX_i = 20.0
+                w.execute()
+                self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(20.0))
+
+    @unittest.skipIf(sys.platform == 'win32', 'waitfor works on Windows')
+    def test_waitfor_elsewhere(self):
+        runner = ANSYSRunner('W', os.path.join(self.tmpdir, 'waitfor'), handshake = 'waitfor', quiet = True)
+        self.assertFalse(runner.ok)
+
+    def test_shutdown_closes_inotify(self):
+        w = self.wrapper()
+        inotify = w.runner.handshake.inotify
+        if inotify == None:
+            self.skipTest('no inotify')
+        w.TIP_FX_i = 1.0
+        w.execute()
+        w.runner.shutdown()
+        self.assertEqual(w.runner.handshake.inotify, None)
+        self.assertRaises(OSError, os.fstat, inotify.fd)
+
+    def test_cache(self):
+        w = self.wrapper()
+        w.TIP_FX_i = 10.0
+        w.execute()
+        w.TIP_FX_i = 20.0
+        w.execute()
+        w.TIP_FX_i = 10.0
+        w.execute()
+        self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(10.0))
+        self.assertEqual(open(w.runner.ansysout).read().count('solved'), 2)
+
+    def test_cache_key(self):
+        w = self.wrapper()
+        w.TIP_FX_i = 10.0
+        loads = w.input_loads()
+        keys = set([w.cache_key(loads)])
+        for other in (self.wrapper(outputs = ['TIP_UX_o_max']), self.wrapper(outputs = ['TIP_UX_o_max', 'TIP_UY_o_max']),
+                      self.wrapper(results_format = 'python')):
+            keys.add(other.cache_key(loads))
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(self.wrapper(outputs = ['TIP_UY_o_max', 'TIP_UX_o_max']).cache_key(loads),
+                         self.wrapper(outputs = ['TIP_UX_o_max', 'TIP_UY_o_max']).cache_key(loads))
+
+    def test_execute_batch(self):
+        w = self.wrapper()
+        results = w.execute_batch([{'TIP_FX_i': v} for v in (1.0, 2.0, 3.0)])
+        for v, outputs in zip((1.0, 2.0, 3.0), results):
+            self.assertNotEqual(outputs, None)
+            values = {}
+            for d in outputs:
+                values.update(d)
+            self.assertAlmostEqual(values['TIP_UX_o_max'], tip_ux(v))
+
+    def test_superposition(self):
+        w = self.wrapper(superposition = True)
+        for v in (3.0, 7.0, 5.0):
+            w.TIP_FX_i = v
+            w.execute()
+            self.assertTrue(w.ok)
+            self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(v))
+        #solved as it is, then a base and a unit case
+        self.assertEqual((w.superposition.solves, w.superposition.count), (3, 2))
+
+    def test_superposition_context(self):
+        w = self.wrapper(superposition = True)
+        w.superposition.max_bases = 2
+        w.TIP_FX_i = 1.0
+        solved = {}
+        for uz in (0.1, 0.2, 0.3, 0.4):
+            w.TIP_UZ_i = uz
+            w.execute()
+            self.assertTrue(w.ok)
+            solved[uz] = w.TIP_UX_o_max
+        #a context that keeps changing is solved once per run and gets no basis
+        self.assertEqual((w.superposition.solves, w.superposition.direct), (4, 4))
+        self.assertEqual(len(w.superposition.bases), 0)
+        for uz in (0.1, 0.2, 0.3):
+            w.TIP_UZ_i = uz
+            w.TIP_FX_i = 2.0
+            w.execute()
+            self.assertAlmostEqual(w.TIP_UX_o_max, solved[uz] + tip_ux(1.0))
+        self.assertEqual(w.superposition.count, 3)
+        self.assertEqual(len(w.superposition.bases), 2)
+
+    def test_start_execute(self):
+        w = self.wrapper()
+        w.TIP_FX_i = 4.0
+        run = w.start_execute()
+        run.wait()
+        self.assertTrue(run.ok)
+        self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(4.0))
+
+    def test_pipeline(self):
+        w = self.wrapper()
+        pipeline = w.runner.pipeline()
+        jobs = []
+        for v in (1.0, 2.0, 3.0):
+            w.TIP_FX_i = v
+            jobs.append((v, pipeline.submit(w)))
+        for v, job in jobs:
+            job.wait()
+            job.apply()
+            self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(v))
+        pipeline.close()
+
+    def test_pipeline_pool(self):
+        #a job submitted while another solves starts at once on the free worker
+        os.environ['FAKEANSYS_DELAY'] = '1.0'
+        runner = ANSYSRunnerPool('P', os.path.join(self.tmpdir, 'pool'), nworkers = 2, timeout = '20',
+                                 handshake = 'file', results_format = 'numeric')
+        self.runners.append(runner)
+        w = TipWrapper('tip', runner, self.dbfile)
+        pipeline = runner.pipeline()
+        w.TIP_FX_i = 1.0
+        first = pipeline.submit(w)
+        time.sleep(0.3)
+        w.TIP_FX_i = 2.0
+        second = pipeline.submit(w)
+        first.wait()
+        started = time.time()
+        second.wait()
+        pipeline.close()
+        self.assertTrue(first.ok and second.ok)
+        self.assertTrue(time.time() - started < 0.8)
+
+    def test_resident(self):
+        w = self.wrapper(resident = True)
+        w.TIP_FX_i = 10.0
+        w.TIP_FY_i = 1.0
+        w.execute()
+        w.TIP_FX_i = 20.0
+        w.execute()
+        self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(21.0))
+        dif = os.path.join(w.runner.workingdir, 'tip.dif')
+        self.assertEqual(open(dif).read(), 'fk,TIP,fx,20.0\n')
+        w.TIP_FY_i = 0.0
+        w.execute()
+        self.assertAlmostEqual(w.TIP_UX_o_max, tip_ux(20.0))
+        self.assertEqual(open(dif).read(), '')
+        self.assertEqual(open(os.path.join(w.runner.workingdir, 'tip.und')).read(), 'fkdele,TIP,fy\n')
+
+    def test_input_loads(self):
+        w = self.wrapper()
+        other = TipWrapper('other', w.runner, self.dbfile)
+        w.TIP_FX_i = 10.0
+        w.TIP_UZ_i = 0.5
+        loads = dict((load.name, load) for load in w.input_loads())
+        self.assertEqual(sorted(loads), ['TIP_FX_i', 'TIP_UZ_i'])
+        self.assertEqual(loads['TIP_FX_i'].command, 'fk,TIP,fx,10.0')
+        self.assertEqual(loads['TIP_FX_i'].undo, 'fkdele,TIP,fx')
+        self.assertEqual(loads['TIP_FX_i'].comment, '!apply FX_i 10.0 to  keypoint component TIP')
+        self.assertEqual(other.input_loads(), [])
+        self.assertTrue(other._load_table() is w._load_table())
+
+    def test_metrics(self):
+        events = []
+        trace = os.path.join(self.tmpdir, 'trace.jsonl')
+        metrics = ansysmetrics.Metrics(callback = events.append, trace = trace)
+        w = self.wrapper(metrics = metrics)
+        for v in (1.0, 2.0, 1.0):
+            w.TIP_FX_i = v
+            w.execute()
+        metrics.close()
+        summary = metrics.summary()
+        for phase in ('execute', 'cache_lookup', 'write_input', 'run', 'wait', 'ansys_resume', 'ansys_solve',
+                      'ansys_post', 'read_results', 'outputs', 'cache_put'):
+            self.assertTrue(phase in summary['spans'], phase)
+        self.assertEqual(summary['spans']['execute']['count'], 3)
+        self.assertEqual(summary['spans']['run']['count'], 2)
+        self.assertEqual(summary['counters']['cache_hits'], 1)
+        self.assertEqual(summary['counters']['cache_misses'], 2)
+        self.assertTrue(summary['counters']['bytes_read'] > 0)
+        self.assertEqual(len(open(trace).readlines()), len(events))
+
+    def test_phase_time_parameters(self):
+        #the fake ANSYS writes the phase times itself, so check the control script ANSYS would run
+        w = self.wrapper(metrics = ansysmetrics.Metrics())
+        w.TIP_FX_i = 1.0
+        w.execute()
+        script = open(w.runner.ansysfile).read().splitlines()
+        timers = set(line.split(',')[1] for line in script if line.upper().endswith(',ACTIVE,0,TIME,WALL'))
+        self.assertEqual(len(timers), 4)
+        arrays = set()
+        for line in script:
+            words = line.split('!')[0].split(',')
+            if words[0].lower() in ('*dim', '*del', '*voper', '*vfun', '*vget', '*vfill'):
+                arrays.add(words[1].split('(')[0].strip())
+        self.assertEqual(timers & arrays, set())
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'tip_cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def test_least_recently_used(self):
+        cache = ansyscache.ResultCache(self.fname, max_entries = 3)
+        for k in ('a', 'b', 'c'):
+            cache.put(k, ({k: 1.0},))
+        self.assertEqual(cache.get('a'), ({'a': 1.0},))
+        cache.put('d', ({'d': 1.0},))
+        self.assertEqual(len(cache), 3)
+        self.assertFalse('b' in cache)
+        self.assertEqual([k for k, v in cache.iteritems()], ['c', 'a', 'd'])
+        cache.close()
+
+        cache = ansyscache.ResultCache(self.fname, max_entries = 3)
+        self.assertFalse(cache.created)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual([k for k, v in cache.iteritems()], ['c', 'a', 'd'])
+        cache.put('e', ({'e': 1.0},))
+        self.assertEqual([k for k, v in cache.iteritems()], ['a', 'd', 'e'])
+        cache.close()
+
+class EventLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        self.logger = logging.getLogger('MSI.test')
+        self.logger.setLevel(logging.WARNING)
+        self.calls = []
+
     def tearDown(self):
-        pass
-        
-    # add some tests here...
-    
-    #def test_ANSYSWrapperBase(self):
-        #pass
-        
+        sys.stdout = self.stdout
+
+    def dump(self):
+        self.calls.append(1)
+        return 'dump'
+
+    def test_levels(self):
+        events = ansysevents.EventLog(self.logger)
+        events.debug('wrapper', 'Init: %s', ansysevents.lazy(self.dump))
+        self.assertEqual(self.calls, [])
+        self.assertFalse(events.enabled(logging.INFO))
+        events.warning('runner_error', 'Cannot find %s', 'ANSYS_SYSDIR')
+        self.assertEqual(sys.stdout.getvalue(), 'Cannot find ANSYS_SYSDIR\n')
+
+    def test_quiet(self):
+        events = ansysevents.EventLog(self.logger, quiet = True)
+        events.error('runner_error', 'Cannot find %s', 'ANSYS_SYSDIR')
+        self.assertEqual(sys.stdout.getvalue(), '')
+
+#fields are fixed width: the coordinates of node 1 touch, node 2 leaves out its zero Y and Z,
+#and element 6 has 10 nodes, the last 2 on the next line
+CDB = '''/COM,ANSYS RELEASE 14.5
+/UNITS,MPA
+NBLOCK,6,SOLID,      3,     10
+(3i9,6e21.13e3)
+        1        0        0 1.0000000000000E+000-2.5000000000000E+000-3.0000000000000E+000
+        2        0        0 4.0000000000000E+000
+       10        0        0 0.0000000000000E+000 7.0000000000000E+000
+N,R5.3,LOC,       -1,
+EBLOCK,19,SOLID,      2,      6
+(19i9)
+        1        1        1        1        0        0        0        0        4        0        5        1        2       10        1
+        1        2        1        1        0        0        0        0       10        0        6        1        2       10        1        2       10        1        2
+       10        1
+       -1
+CMBLOCK,TIP     ,NODE,        2  ! users node component definition
+(8i10)
+         1        -2
+CMBLOCK,E6,ELEM,        1
+(8i10)
+         6
+'''
+
+#as written by the APDL script of WrapperGenerator
+COMPONENTS = '''class FeaModelInPythonFormat:
+	def __init__(self):
+		self.nodeLabels = ["number", "x", "y", "z",]
+		self.units = 6
+		self.coordinateSystem = "Cartesian"
+		self.smoothingCoordinates = "XYZ"
+		self.nodeMap = {
+			"TIP" :
+			[
+			[     1,     1.0000,    -2.5000,     3.0000,],
+			[    10,     0.0000,     7.0000,     0.0000,],
+			],
+			"EMPTY" :
+			[
+			],
+			}
+		self.facetMap = {
+			"SKIN" :
+			[
+			[       5,        2,],
+			[       6,        0,],
+			],
+			"OLD" :
+			[
+			[     5,      2,      1,      2,     10,      0,      0,      0,      0,      0,],
+			],
+			"NONE" :
+			[
+			],
+			}
+'''
+
+class ModelFileTestCase(unittest.TestCase):
+
+    def test_read_components_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'c_tmp.py')
+            open(fname, 'w').write(COMPONENTS)
+            components = ansysresults.read_components_file(fname)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+        self.assertEqual(components.units, 6)
+        self.assertEqual(components.nodes['TIP'].tolist(), [1, 10])
+        self.assertEqual(components.coords['TIP'].tolist(), [[1.0, -2.5, 3.0], [0.0, 7.0, 0.0]])
+        self.assertEqual(len(components.nodes['EMPTY']), 0)
+        self.assertEqual(components.facets['SKIN'].tolist(), [[5, 2]])
+        self.assertEqual(components.facets['OLD'].tolist(), [[5, 2]])
+        self.assertEqual(components.facets['NONE'].shape, (0, 2))
+
+    def test_load_components(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'tipWrapper_components.npz')
+            numpy.savez(fname, **{'nodes/TIP': numpy.array([1, 10]), 'surfaces/SKIN': numpy.array([[5, 2]])})
+            a = load_components(fname)
+            b = load_components(fname)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+        self.assertEqual(a['nodes']['TIP'].tolist(), [1, 10])
+        self.assertEqual(a['surfaces']['SKIN'].tolist(), [[5, 2]])
+        self.assertFalse(a is b)
+        self.assertTrue(a['nodes']['TIP'] is b['nodes']['TIP'])
+        self.assertFalse(a['nodes']['TIP'].flags.writeable)
+
+    def test_read_cdb(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'model.cdb')
+            open(fname, 'w').write(CDB)
+            model = ansyscdb.read_cdb(fname)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+        self.assertEqual(model.node_ids.tolist(), [1, 2, 10])
+        self.assertEqual(model.coords.tolist(), [[1.0, -2.5, -3.0], [4.0, 0.0, 0.0], [0.0, 7.0, 0.0]])
+        self.assertEqual(model.element_ids.tolist(), [5, 6])
+        self.assertEqual(model.element_nodes.shape, (2, 10))
+        self.assertEqual(model.element_nodes[1].tolist(), [1, 2, 10, 1, 2, 10, 1, 2, 10, 1])
+        self.assertEqual(model.units, 'MPA')
+        self.assertEqual(model.component_nodes('TIP').tolist(), [1, 2])
+        self.assertEqual(model.component_nodes('E6').tolist(), [1, 2, 10])
+        self.assertEqual(model.node_coords([10]).tolist(), [[0.0, 7.0, 0.0]])
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class WrapperGeneratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.handler = ListHandler()
+        self.logger = logging.getLogger('MSI_generator_test')
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def generate(self, **kwargs):
+        from ansyswrapper.ansysWrapperGenerator import WrapperGenerator
+        g = WrapperGenerator('tip', os.path.join(self.tmpdir, 'tipWrapper.py'), logger_name = 'MSI_generator_test',
+                             quiet = True, **kwargs)
+        del self.handler.messages[:]
+        g.generate()
+        self.assertTrue(g.ok)
+        return g
+
+    def check_reused(self, **kwargs):
+        first = self.generate(**kwargs)
+        wrapper = os.path.join(self.tmpdir, 'tipWrapper.py')
+        self.assertTrue(os.path.exists(wrapper))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'tipWrapper_components.npz')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'tipWrapper_generated.json')))
+        stamp = os.path.getmtime(wrapper)
+        second = self.generate(**kwargs)
+        self.assertTrue([m for m in self.handler.messages if m.endswith('is up to date')])
+        self.assertEqual(os.path.getmtime(wrapper), stamp)
+        self.assertEqual(second.unitskey, first.unitskey)
+        self.assertEqual(second.unitsinfo.info, first.unitsinfo.info)
+        self.assertEqual(sorted(second.components), sorted(first.components))
+        for k, v in first.components.iteritems():
+            self.assertEqual(sorted(second.components[k]), sorted(v))
+            for name, a in v.iteritems():
+                self.assertEqual(numpy.asarray(second.components[k][name]).tolist(), numpy.asarray(a).tolist())
+        return second
+
+    def test_components_file(self):
+        fname = os.path.join(self.tmpdir, 'c_tmp.py')
+        open(fname, 'w').write(COMPONENTS)
+        g = self.check_reused(componentsfile = fname)
+        self.assertEqual(g.unitskey, '6')
+        self.assertEqual(g.components['nodes']['TIP'].tolist(), [1, 10])
+        self.assertEqual(g.components['surfaces']['SKIN'].tolist(), [[5, 2]])
+
+    def test_cdb(self):
+        fname = os.path.join(self.tmpdir, 'model.cdb')
+        open(fname, 'w').write(CDB)
+        g = self.check_reused(cdbfile = fname)
+        self.assertEqual(g.unitskey, ansysinfo.unitsindices['MPA'])
+        self.assertEqual(g.components['nodes']['TIP'].tolist(), [1, 2])
+
 if __name__ == "__main__":
     unittest.main()
-    
\ No newline at end of file